@@ -7,12 +7,145 @@ load_dotenv()
 # server variables
 HOST = os.getenv("HOST")
 PORT = int(os.getenv("PORT"))
+# worker processes, each serves its own WebSocket clients
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY') or 1)
 
 # cache database
 REDIS_HOST = os.getenv('REDIS_HOST')
 REDIS_PORT = os.getenv('REDIS_PORT')
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS') or 20)
+# seconds
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT') or 5.0)
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT') or 5.0)
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL') or 30)
+
+# seconds, startup connects in the background with jittered exponential backoff between attempts
+DB_CONNECT_DELAY = float(os.getenv('DB_CONNECT_DELAY') or 0.5)
+DB_CONNECT_MAX_DELAY = float(os.getenv('DB_CONNECT_MAX_DELAY') or 10.0)
+# seconds, budget for each /ready dependency check
+READY_CHECK_TIMEOUT = float(os.getenv('READY_CHECK_TIMEOUT') or 1.0)
 
 # mongo connection string
 MONGO_CONNECTION_STRING = os.getenv('MONGO_CONNECTION_STRING')
-MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')
\ No newline at end of file
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE') or 20)
+# threads running blocking pymongo calls, keep at or below the pool size
+MONGO_EXECUTOR_WORKERS = int(os.getenv('MONGO_EXECUTOR_WORKERS') or 10)
+# seconds
+MONGO_QUERY_TIMEOUT = float(os.getenv('MONGO_QUERY_TIMEOUT') or 5.0)
+MONGO_STREAM_BATCH_SIZE = int(os.getenv('MONGO_STREAM_BATCH_SIZE') or 500)
+# serve /performance from pre-aggregated rollups, needs a replica set for change streams
+PERFORMANCE_ROLLUPS = (os.getenv('PERFORMANCE_ROLLUPS') or 'true').lower() == 'true'
+
+# every event is also appended to a capped stream so clients can resume after a reconnect
+EVENT_STREAM = os.getenv('EVENT_STREAM') or 'events'
+EVENT_STREAM_MAXLEN = int(os.getenv('EVENT_STREAM_MAXLEN') or 10000)
+# most events replayed to one resuming client, beyond that it should reload over REST
+REPLAY_MAX_EVENTS = int(os.getenv('REPLAY_MAX_EVENTS') or 1000)
+
+# seconds, ticks for the same position within the window go out as one delta frame
+POSITION_DELTA_WINDOW = float(os.getenv('POSITION_DELTA_WINDOW') or 0.25)
+
+# WebSocket snapshot, stats as the first frame, open positions and the latest signals after a matching subscribe
+SNAPSHOT_ON_CONNECT = (os.getenv('SNAPSHOT_ON_CONNECT') or 'true').lower() == 'true'
+SNAPSHOT_SIGNALS = int(os.getenv('SNAPSHOT_SIGNALS') or 50)
+# stream entries scanned for recent signals when warming up
+SNAPSHOT_SCAN = int(os.getenv('SNAPSHOT_SCAN') or 1000)
+
+# /positions/analytics, pulls every closed position in the range so it gets a longer timeout
+ANALYTICS_QUERY_TIMEOUT = float(os.getenv('ANALYTICS_QUERY_TIMEOUT') or 30.0)
+# points per returned series, and trades in the rolling hit rate window
+ANALYTICS_POINTS = int(os.getenv('ANALYTICS_POINTS') or 500)
+ANALYTICS_WINDOW = int(os.getenv('ANALYTICS_WINDOW') or 50)
+
+# orders routes, most ids per /orders/batch and hash fields per HSCAN step when listing
+ORDERS_BATCH_MAX = int(os.getenv('ORDERS_BATCH_MAX') or 500)
+ORDERS_SCAN_COUNT = int(os.getenv('ORDERS_SCAN_COUNT') or 500)
+# list orders from the secondary indexes instead of HSCAN, only turn it on once every writer of the orders
+# hash goes through RedisClient and `python -m app.database.redis rebuild orders` has run
+ORDERS_INDEXED = (os.getenv('ORDERS_INDEXED') or 'false').lower() == 'true'
+
+# realtime consumer, 'pubsub' reads the channels, 'stream' the event stream and lets clients resume
+# only switch to 'stream' once every producer appends to EVENT_STREAM, events only PUBLISHed are never read there
+REALTIME_SOURCE = os.getenv('REALTIME_SOURCE') or 'pubsub'
+REALTIME_READ_COUNT = int(os.getenv('REALTIME_READ_COUNT') or 100)
+REALTIME_QUEUE_SIZE = int(os.getenv('REALTIME_QUEUE_SIZE') or 1000)
+REALTIME_POLL_TIMEOUT = float(os.getenv('REALTIME_POLL_TIMEOUT') or 1.0)
+REALTIME_RECONNECT_DELAY = float(os.getenv('REALTIME_RECONNECT_DELAY') or 0.5)
+REALTIME_RECONNECT_MAX_DELAY = float(os.getenv('REALTIME_RECONNECT_MAX_DELAY') or 30.0)
+
+# position stats
+STATS_BROADCAST_INTERVAL = float(os.getenv('STATS_BROADCAST_INTERVAL') or 0.5)
+STATS_RESYNC_INTERVAL = float(os.getenv('STATS_RESYNC_INTERVAL') or 60.0)
+# seconds, one worker holds the leader lock, computes stats for all of them and keeps the rollups current
+STATS_LEADER_TTL = float(os.getenv('STATS_LEADER_TTL') or 10.0)
+
+# response cache for closed positions routes
+CACHE_MAXSIZE = int(os.getenv('CACHE_MAXSIZE') or 256)
+# seconds, also bounds how stale the rolling one week window of /positions/latest gets
+CACHE_TTL = float(os.getenv('CACHE_TTL') or 30.0)
+# share cached responses between workers through Redis
+CACHE_REDIS = (os.getenv('CACHE_REDIS') or 'false').lower() == 'true'
+
+# admission control, REST requests beyond the in-flight limit get a fast 503 instead of queueing, 0 turns it off
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT') or 32)
+# the limit drops to ADMISSION_PRESSURE_IN_FLIGHT while the realtime queue is at least this full,
+# or the event loop wakes up ADMISSION_MAX_LOOP_LAG seconds late, so REST backs off before broadcasts fall behind
+ADMISSION_PRESSURE_THRESHOLD = float(os.getenv('ADMISSION_PRESSURE_THRESHOLD') or 0.5)
+ADMISSION_MAX_LOOP_LAG = float(os.getenv('ADMISSION_MAX_LOOP_LAG') or 0.1)
+ADMISSION_PRESSURE_IN_FLIGHT = int(os.getenv('ADMISSION_PRESSURE_IN_FLIGHT') or 4)
+# seconds, Retry-After of shed requests
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER') or 1)
+
+# token bucket rate limits, requests per second and burst, a rate of 0 turns a limit off
+# per client IP and per user_id query parameter on REST routes
+# the IP is the peer address unless uvicorn trusts it as a proxy: behind nginx or the Docker bridge every client
+# shares the proxy's bucket, so the per IP limits are off by default. Set uvicorn's FORWARDED_ALLOW_IPS to the
+# proxy addresses before turning them on, uvicorn then takes the client from X-Forwarded-For
+RATE_LIMIT_IP_RATE = float(os.getenv('RATE_LIMIT_IP_RATE') or 0)
+RATE_LIMIT_IP_BURST = int(os.getenv('RATE_LIMIT_IP_BURST') or 40)
+RATE_LIMIT_USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE') or 10.0)
+RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST') or 20)
+# WebSocket connection attempts per client IP, reconnect storms are closed with 1013 before any route runs
+RATE_LIMIT_WS_CONNECT_RATE = float(os.getenv('RATE_LIMIT_WS_CONNECT_RATE') or 0)
+RATE_LIMIT_WS_CONNECT_BURST = int(os.getenv('RATE_LIMIT_WS_CONNECT_BURST') or 5)
+# buckets are per worker unless shared through Redis
+RATE_LIMIT_REDIS = (os.getenv('RATE_LIMIT_REDIS') or 'false').lower() == 'true'
+# clients tracked by each in-process limiter, the least recently seen are forgotten first
+RATE_LIMIT_MAXSIZE = int(os.getenv('RATE_LIMIT_MAXSIZE') or 10000)
+
+# access logging, errors and slow requests are always logged
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv('ACCESS_LOG_SAMPLE_RATE') or 0.01)
+# seconds
+ACCESS_LOG_SLOW_REQUEST = float(os.getenv('ACCESS_LOG_SLOW_REQUEST') or 1.0)
+
+# response compression
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE') or 1024)
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL') or 5)
+
+# websocket fan-out
+WS_QUEUE_SIZE = int(os.getenv('WS_QUEUE_SIZE') or 100)
+# seconds a single send may take, a watchdog evicts connections stuck in one for longer
+WS_SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT') or 5.0)
+WS_SLOW_CONSUMER_POLICY = os.getenv('WS_SLOW_CONSUMER_POLICY') or 'drop_oldest'
+WS_PER_MESSAGE_DEFLATE = (os.getenv('WS_PER_MESSAGE_DEFLATE') or 'true').lower() == 'true'
+# seconds, protocol level ping/pong run by uvicorn, a client missing a pong for WS_PING_TIMEOUT is disconnected
+# the same interval paces the ConnectionManager sweep that closes idle clients, it sends no frames of its own
+WS_PING_INTERVAL = float(os.getenv('WS_PING_INTERVAL') or 20.0)
+WS_PING_TIMEOUT = float(os.getenv('WS_PING_TIMEOUT') or 20.0)
+# seconds without any message from a client before it is closed, 0 never closes idle clients
+# protocol pongs don't count, only turn it on for clients that send something periodically
+WS_IDLE_TIMEOUT = float(os.getenv('WS_IDLE_TIMEOUT') or 0)
+# bytes, largest message a client may send, subscriptions are tiny
+WS_MAX_MESSAGE_SIZE = int(os.getenv('WS_MAX_MESSAGE_SIZE') or 65536)
+# bytes queued for one connection, beyond it the slow consumer policy applies as for a full queue
+WS_MAX_QUEUE_BYTES = int(os.getenv('WS_MAX_QUEUE_BYTES') or 1048576)
+# bytes queued across all connections of a worker, beyond it the largest backlogs are disconnected
+# counted per connection, broadcast frames are shared so the memory really used is at most this
+WS_MAX_BUFFERED_BYTES = int(os.getenv('WS_MAX_BUFFERED_BYTES') or 67108864)
+# connections per worker, more are refused with 1013 (try again later)
+WS_MAX_CONNECTIONS = int(os.getenv('WS_MAX_CONNECTIONS') or 1000)
+# subscribe/unsubscribe/resume messages a client may send, per second and burst
+WS_MESSAGE_RATE = float(os.getenv('WS_MESSAGE_RATE') or 5.0)
+WS_MESSAGE_BURST = int(os.getenv('WS_MESSAGE_BURST') or 20)
@@ -1,36 +1,179 @@
-from time import sleep
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pymongo
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.errors import ConnectionFailure, PyMongoError
 from app.config import (
+    DB_CONNECT_DELAY,
+    DB_CONNECT_MAX_DELAY,
     MONGO_CONNECTION_STRING,
-    MONGO_DB_NAME
+    MONGO_DB_NAME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_EXECUTOR_WORKERS,
+    MONGO_QUERY_TIMEOUT,
+    MONGO_STREAM_BATCH_SIZE
 )
 from loguru import logger
+from app.utils.backoff import retry_until
 
 mongo_logger = logger.bind(name="MongoDB")
 
+# Indexes every route query shape relies on, created at startup by ensure_indexes
+INDEXES = {
+    "closed_positions": [
+        # /positions/latest: exit_time range, newest first, _id breaks ties for keyset paging
+        IndexModel([("exit_time", DESCENDING), ("_id", DESCENDING)], name="exit_time_id"),
+        # /positions/performance: equality on user, range on entry timestamp
+        IndexModel([("user_id", ASCENDING), ("timestamp", ASCENDING)], name="user_timestamp")
+    ],
+    "performance_rollups": [
+        # bucket lookups, and the unique key $merge upserts on
+        IndexModel([("user_id", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+                   name="user_granularity_bucket", unique=True)
+    ]
+}
+
 class MongoDBClient:
-    def __init__(self, db_name, max_retries=20):
+    def __init__(self, db_name, max_pool_size=MONGO_MAX_POOL_SIZE):
         self.db_name = db_name
-        self.max_retries = max_retries
-        self.client = MongoClient(MONGO_CONNECTION_STRING)
-        self._connect()
-
-    def _connect(self):
-        retries = 0
-        while retries < self.max_retries:
-            try:
-                self.client.admin.command('ping')
-                mongo_logger.info("Connected to MongoDB!!!")
-                return
-            except ConnectionFailure:
-                retries += 1
-                mongo_logger.info(f"Attempt {retries} to reconnect...")
-                sleep(retries * 0.5)
-        raise Exception("Too many retries.")
+        # connect=False defers the monitor threads and sockets to the first operation,
+        # importing this module does no I/O
+        self.client = MongoClient(MONGO_CONNECTION_STRING, maxPoolSize=max_pool_size, connect=False)
 
     def get_database(self):
         return self.client[self.db_name]
 
+    def status(self) -> dict:
+        """Topology as the driver's monitors last saw it, no round trip"""
+        topology = self.client.topology_description
+        return {
+            "topology": topology.topology_type_name,
+            "servers": {f"{host}:{port}": server.server_type_name
+                        for (host, port), server in topology.server_descriptions().items()},
+            "readable": topology.has_readable_server(),
+            "max_pool_size": self.client.options.pool_options.max_pool_size
+        }
+
+def ensure_indexes(database, collections=None):
+    """Create the declared indexes, a no-op for indexes that already exist
+
+    Never raises, queries still work without an index, only slower.
+    """
+    for name in collections or INDEXES:
+        try:
+            created = database[name].create_indexes(INDEXES[name])
+            mongo_logger.info(f"Ensured indexes on {name}: {', '.join(created)}")
+        except PyMongoError as e:
+            # e.g. an equivalent index exists under another name, or the server went away mid-startup
+            mongo_logger.error(f"Could not ensure indexes on {name}: {str(e)}")
+
+class AsyncCollection:
+    """Runs pymongo operations on a bounded executor so callers never block the event loop"""
+
+    def __init__(self, collection, executor, timeout):
+        self.collection = collection
+        self.executor = executor
+        self.timeout = timeout
+
+    async def _run(self, fn, timeout=None):
+        def call():
+            # Client side operation timeout, covers server selection, the query and every getMore
+            with pymongo.timeout(timeout or self.timeout):
+                return fn()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def _cursor(self, filter, projection=None, sort=None, limit=0, batch_size=None):
+        cursor = self.collection.find(filter, projection, limit=limit)
+        if sort:
+            cursor = cursor.sort(sort)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    async def find(self, filter, projection=None, sort=None, limit=0, timeout=None):
+        """Fetch all matching documents"""
+        return await self._run(lambda: list(self._cursor(filter, projection, sort, limit)), timeout)
+
+    async def find_one(self, filter, projection=None, sort=None, timeout=None):
+        return await self._run(lambda: self.collection.find_one(filter, projection, sort=sort), timeout)
+
+    async def stream(self, filter, projection=None, sort=None, limit=0, batch_size=MONGO_STREAM_BATCH_SIZE,
+                     timeout=None):
+        """Yield matching documents, pulling one batch at a time from the executor"""
+        cursor = self._cursor(filter, projection, sort, limit, batch_size)
+
+        def next_batch():
+            batch = []
+            for document in cursor:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    break
+            return batch
+
+        try:
+            while True:
+                batch = await self._run(next_batch, timeout)
+                if not batch:
+                    return
+                for document in batch:
+                    yield document
+                if len(batch) < batch_size:
+                    return
+        finally:
+            await asyncio.get_running_loop().run_in_executor(self.executor, cursor.close)
+
+    async def columns(self, filter, fields, timeout=None):
+        """Fetch some fields of every matching document as one list per field, None where missing
+
+        fields is a list of names, or a projection mapping names to 1 or an expression.
+        """
+        def fetch():
+            projection = dict(fields) if isinstance(fields, dict) else {field: 1 for field in fields}
+            columns = {field: [] for field in projection}
+            appends = [(field, columns[field].append) for field in projection]
+            projection["_id"] = 0
+            for document in self._cursor(filter, projection):
+                for field, append in appends:
+                    append(document.get(field))
+            return columns
+        return await self._run(fetch, timeout)
+
+    async def aggregate(self, pipeline, timeout=None):
+        return await self._run(lambda: list(self.collection.aggregate(pipeline)), timeout)
+
+class AsyncDatabase:
+    """Async facade over a pymongo database, db.<collection> returns an AsyncCollection"""
+
+    def __init__(self, database, max_workers=MONGO_EXECUTOR_WORKERS, timeout=MONGO_QUERY_TIMEOUT):
+        self.database = database
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+        self.connected = False
+
+    def __getitem__(self, name):
+        return AsyncCollection(self.database[name], self.executor, self.timeout)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def ping(self, timeout=None):
+        def call():
+            with pymongo.timeout(timeout or self.timeout):
+                self.database.client.admin.command('ping')
+        await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def connect(self):
+        """Wait until MongoDB answers a ping, retrying with backoff"""
+        await retry_until("MongoDB", self.ping, ConnectionFailure, mongo_logger,
+                          DB_CONNECT_DELAY, DB_CONNECT_MAX_DELAY)
+        self.connected = True
+        mongo_logger.info("Connected to MongoDB!!!")
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
 mongo_client = MongoDBClient(db_name=MONGO_DB_NAME)
 db = mongo_client.get_database()
+async_db = AsyncDatabase(db)
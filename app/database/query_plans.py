@@ -0,0 +1,68 @@
+"""
+Explain each route's query shape and fail if any of them is not index-backed.
+
+    python -m app.database.query_plans [--user-id <id>]
+"""
+import argparse
+from datetime import timedelta
+from app.database.mongodb import db, ensure_indexes
+from app.services.rollups import ROLLUPS, performance_pipeline
+from app.utils.datetime import get_current_time
+
+def query_shapes(database, user_id):
+    """Explain output for every query the positions routes run, keyed by route"""
+    now = get_current_time()
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        "/positions/latest": database.closed_positions.find(
+            {"exit_time": {"$gt": now - timedelta(days=7)}}
+        ).sort([("exit_time", -1), ("_id", -1)]).explain(),
+        "/positions/performance (pipeline)": database.command(
+            "aggregate", "closed_positions",
+            pipeline=performance_pipeline(user_id, day, day + timedelta(days=1)),
+            explain=True
+        ),
+        "/positions/performance (rollups)": database[ROLLUPS].find({
+            "user_id": user_id,
+            "granularity": "day",
+            "bucket": {"$gte": day - timedelta(days=30), "$lt": day}
+        }).explain()
+    }
+
+def _stages(node):
+    """Every stage name in the winning plans of an explain document"""
+    if isinstance(node, list):
+        for item in node:
+            yield from _stages(item)
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                yield value
+            else:
+                yield from _stages(value)
+
+def check(explain):
+    """Return the stages of a plan and whether it is index-backed"""
+    stages = set(_stages(explain))
+    return stages, "COLLSCAN" not in stages and bool(stages & {"IXSCAN", "EXPRESS_IXSCAN", "IDHACK"})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", default="diagnostic")
+    parser.add_argument("--no-ensure", action="store_true", help="Check the indexes as they are")
+    args = parser.parse_args()
+
+    if not args.no_ensure:
+        ensure_indexes(db)
+    failed = False
+    for route, explain in query_shapes(db, args.user_id).items():
+        stages, indexed = check(explain)
+        failed |= not indexed
+        print(f"{'OK  ' if indexed else 'FAIL'} {route}: {', '.join(sorted(stages))}")
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,25 @@
+import argparse
 import redis
-from time import sleep
+import redis.asyncio as aioredis
+from datetime import datetime, timezone
+from time import time
 from loguru import logger
 from app.config import (
+    DB_CONNECT_DELAY,
+    DB_CONNECT_MAX_DELAY,
     REDIS_HOST,
     REDIS_PORT,
-    REDIS_PASSWORD
+    REDIS_PASSWORD,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    EVENT_STREAM,
+    EVENT_STREAM_MAXLEN
 )
 import json
+from app.utils.backoff import retry_until
+from app.utils.streams import stream_id
 
 redis_logger = logger.bind(name="Redis")
 
@@ -14,54 +27,188 @@ redis_host = REDIS_HOST
 redis_port = int(REDIS_PORT) or 6379
 redis_password = REDIS_PASSWORD
 
-class RedisClient:
-    def __init__(self, prefix, redis_host, redis_port, redis_password, max_retries=20):
+# HINCRBYFLOAT, then append and publish the new value, in one round trip.
+# KEYS[1] hash key, KEYS[2] event stream,
+# ARGV: field, amount, channel, event json before and after the value, stream maxlen
+INCREMENT_AND_PUBLISH = """
+local value = redis.call('HINCRBYFLOAT', KEYS[1], ARGV[1], ARGV[2])
+local event = ARGV[4] .. value .. ARGV[5]
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[6], '*', 'channel', ARGV[3], 'event', event)
+redis.call('PUBLISH', ARGV[3], event)
+return value
+"""
+
+# Hashes with secondary indexes: a set per value of each field, and a sorted set by timestamp.
+# Documents without a usable timestamp are scored by when they were first indexed.
+INDEXED_CATEGORIES = ("positions", "orders")
+INDEXED_FIELDS = ("user_id", "symbol", "status")
+
+# Write or delete one document and move its index entries in the same step, so the
+# indexes never disagree with the hash. Index keys are built in the script, single node only.
+# The caller reads the stored document under WATCH and does any merge itself: the script never
+# decodes JSON, Redis' cjson would round numbers to 14 digits and turn empty arrays into objects.
+# KEYS[1] category hash, KEYS[2] time index,
+# ARGV: identifier, index key prefix, document json ('' deletes), score ('' keeps the current one), now,
+# then field, value before, value after ('' for none) for each indexed field
+WRITE_INDEXED = """
+local id, prefix, document = ARGV[1], ARGV[2], ARGV[3]
+if document == '' then
+    redis.call('HDEL', KEYS[1], id)
+    redis.call('ZREM', KEYS[2], id)
+else
+    redis.call('HSET', KEYS[1], id, document)
+    if ARGV[4] ~= '' then
+        redis.call('ZADD', KEYS[2], ARGV[4], id)
+    else
+        redis.call('ZADD', KEYS[2], 'NX', ARGV[5], id)
+    end
+end
+for i = 6, #ARGV, 3 do
+    local field, before, after = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    if before ~= '' and before ~= after then redis.call('SREM', prefix .. field .. ':' .. before, id) end
+    if after ~= '' then redis.call('SADD', prefix .. field .. ':' .. after, id) end
+end
+return 1
+"""
+
+class BaseRedisClient:
+    """Key and event helpers shared by the sync and async clients"""
+
+    def _event(self, category, action, data, **fields):
+        """Serialize an event envelope, published_at lets consumers measure delivery lag"""
+        return json.dumps({
+            "category": category,
+            "action": action,
+            "data": data,
+            "published_at": time(),
+            **fields
+        })
+
+    def _queue_event(self, pipe, category, event):
+        """Append an event to the stream and publish it, on a pipeline"""
+        pipe.xadd(EVENT_STREAM, {"channel": category, "event": event}, maxlen=EVENT_STREAM_MAXLEN, approximate=True)
+        pipe.publish(category, event)
+
+    def _increment_event(self, category, identifier, field):
+        """Split an update event around the incremented value, for INCREMENT_AND_PUBLISH"""
+        marker = "__value__"
+        event = self._event(category, "update", {
+            "identifier": identifier,
+            field: marker
+        })
+        return event.split(json.dumps(marker), 1)
+
+    def _generate_key(self, category, *args):
+        """Generate a key for a category and identifier"""
+        return category if not args else f"{category}:{':'.join(map(str, args))}"
+
+    def _index_key(self, category, *parts):
+        return ":".join(("idx", category) + tuple(map(str, parts)))
+
+    def _score(self, data):
+        """Epoch seconds of a document's timestamp, None when it has none"""
+        value = data.get("timestamp")
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        # Naive timestamps are UTC, like everything the producers write
+        return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+    def _index_values(self, document):
+        """{field: value} as the index keys hold it, for the indexed fields a document has"""
+        if not isinstance(document, dict):
+            return {}
+        return {field: str(document[field]) for field in INDEXED_FIELDS if document.get(field) is not None}
+
+    def _write_indexed_args(self, category, identifier, stored, document=None, score=None):
+        """WRITE_INDEXED arguments replacing the decoded stored document (None if absent), deleting it without one"""
+        before, after = self._index_values(stored), self._index_values(document)
+        changes = [part for field in INDEXED_FIELDS for part in (field, before.get(field, ""), after.get(field, ""))]
+        return {
+            "keys": [category, self._index_key(category, "time")],
+            "args": [identifier, self._index_key(category, ""), "" if document is None else json.dumps(document),
+                     "" if score is None else score, time(), *changes]
+        }
+
+    def _queue_index(self, pipe, category, identifier, data):
+        """Add one document's index entries on a pipeline, for rebuilds"""
+        for field, value in self._index_values(data).items():
+            pipe.sadd(self._index_key(category, field, value), identifier)
+        score = self._score(data)
+        pipe.zadd(self._index_key(category, "time"), {identifier: time() if score is None else score})
+
+    def _filter_keys(self, category, filters):
+        """Index sets for {field: value} filters, None values are ignored"""
+        unknown = set(filters or ()) - set(INDEXED_FIELDS)
+        if category not in INDEXED_CATEGORIES or unknown:
+            raise ValueError(f"{category} has no index on {', '.join(sorted(unknown)) or 'any field'}")
+        return [self._index_key(category, field, value)
+                for field, value in (filters or {}).items() if value is not None]
+
+    def _queue_recent(self, pipe, category, limit, before):
+        """Newest entries of the time index, before (score, identifier) when given, ties at that score included"""
+        key = self._index_key(category, "time")
+        if before is None:
+            pipe.zrevrange(key, 0, limit - 1 if limit else -1, withscores=True)
+            return
+        pipe.zrangebyscore(key, before[0], before[0], withscores=True)
+        pipe.zrevrangebyscore(key, f"({before[0]!r}", "-inf", start=0 if limit else None, num=limit, withscores=True)
+
+    def _page(self, matches, limit=None, before=None):
+        """Newest first (identifier, score) pairs strictly after before in that order, at most limit"""
+        entries = sorted(((member.decode("utf-8"), score) for member, score in matches),
+                         key=lambda entry: (entry[1], entry[0]), reverse=True)
+        if before is not None:
+            entries = [entry for entry in entries if (entry[1], entry[0]) < (before[0], before[1])]
+        return entries[:limit] if limit else entries
+
+class RedisClient(BaseRedisClient):
+    def __init__(self, prefix, redis_host, redis_port, redis_password):
         self.prefix = prefix
-        self.max_retries = max_retries
+        # Connects on the first command, nothing happens at import
         self.client = redis.Redis(
             host=redis_host,
             port=redis_port,
-            password=redis_password
+            password=redis_password,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL
         )
-        self._connect()
         self.pubsub = self.client.pubsub()
-
-    def _connect(self):
-        retries = 0
-        while retries < self.max_retries:
-            try:
-                self.client.ping()
-                redis_logger.info("Connected to Redis!!!")
-                return
-            except redis.ConnectionError:
-                retries += 1
-                redis_logger.info(f"Attempt {retries} to reconnect...")
-                sleep(retries * 0.5)
-        raise Exception("Too many retries.")
+        self._increment_and_publish = self.client.register_script(INCREMENT_AND_PUBLISH)
+        self._write_indexed = self.client.register_script(WRITE_INDEXED)
 
     def publish(self, channel: str, message: str):
         """Publish a message to a channel"""
         self.client.publish(channel, message)
         logger.info(f"Published message to channel: {channel}")
 
-    def _publish_event(self, category, action, data):
-        """Helper method to publish events"""
-        event = {
-            "category": category,
-            "action": action,
-            "data": data
-        }
-        self.publish(category, json.dumps(event))
-
-    def _generate_key(self, category, *args):
-        """Generate a key for a category and identifier"""
-        return category if not args else f"{category}:{':'.join(map(str, args))}"
+    def _publish_event(self, category, action, data, pipe=None):
+        """Helper method to append and publish events, queued on pipe when given"""
+        if pipe is not None:
+            self._queue_event(pipe, category, self._event(category, action, data))
+            return
+        with self.client.pipeline() as pipe:
+            self._queue_event(pipe, category, self._event(category, action, data))
+            pipe.execute()
+        logger.info(f"Published message to channel: {category}")
 
     # Set or update a hash
     def set_hash(self, category, key, data):
         """Set or update a hash"""
         if not key:
             key = self._generate_key(category, key)
+        if category in INDEXED_CATEGORIES:
+            def write(pipe):
+                # Under WATCH, the index entries to move are those of the document replaced
+                stored = pipe.hget(category, key)
+                pipe.multi()
+                self._write_indexed(client=pipe, **self._write_indexed_args(
+                    category, key, json.loads(stored) if stored else None, data, self._score(data)
+                ))
+            self.client.transaction(write, category)
+            return
         self.client.hset(category, key, json.dumps(data))
 
     # Get a hash
@@ -72,56 +219,386 @@ class RedisClient:
         data = self.client.hget(category, key)
         return json.loads(data) if data else None
 
+    def get_hashes(self, category, keys):
+        """Get several hashes in one HMGET, None for missing keys"""
+        if not keys:
+            return []
+        values = self.client.hmget(category, keys)
+        return [json.loads(value) if value else None for value in values]
+
     # Update specific fields in a hash
     def update_hash(self, category, identifier, updates):
-        """Update specific fields in a hash"""
+        """Update specific fields in a hash
+
+        Writes the category:identifier hash, never the category document, so the indexes built from
+        that document have nothing to move. Use set_hash to change what get_hash and the indexes see.
+        """
         key = self._generate_key(category, identifier)
-        self.client.hset(key, mapping=updates)
+        # Write and publish in a single MULTI/EXEC round trip
+        with self.client.pipeline() as pipe:
+            pipe.hset(key, mapping=updates)
+            self._publish_event(category, "update", {
+                "identifier": identifier,
+                **updates
+            }, pipe)
+            pipe.execute()
         logger.info(f"Updated hash for key: {key}")
-        # Publish event
-        self._publish_event(category, "update", {
-            "identifier": identifier,
-            **updates
-        })
 
     # Delete a hash
     def delete_hash(self, category, identifier):
         """Delete a hash"""
         key = self._generate_key(category, identifier)
-        # Get the data before deleting
-        data = self.get_hash(category, identifier)
-        self.client.delete(key)
+        indexed = category in INDEXED_CATEGORIES
+
+        def write(pipe):
+            # Get the data before deleting, under WATCH for indexed categories
+            stored = pipe.hget(category, identifier) if indexed else self.client.hget(category, identifier)
+            data = json.loads(stored) if stored else None
+            pipe.multi()
+            pipe.delete(key)
+            if indexed:
+                self._write_indexed(client=pipe, **self._write_indexed_args(category, identifier, data))
+            self._publish_event(category, "delete", {
+                "identifier": identifier,
+                **(data or {})
+            }, pipe)
+        self.client.transaction(write, *([category] if indexed else []))
         logger.info(f"Deleted hash for key: {key}")
-        # Publish event
-        self._publish_event(category, "delete", {
-            "identifier": identifier,
-            **data
-        })
 
     def get_all_hashes(self, category):
         """Get all hashes in a category"""
         data = self.client.hgetall(category)
         return [json.loads(value) for value in data.values()]
 
+    def scan_hashes(self, category, cursor=0, count=None):
+        """One HSCAN step over a category, as the next cursor (0 when done) and {identifier: data}"""
+        cursor, data = self.client.hscan(category, cursor, count=count)
+        return cursor, {key.decode("utf-8"): json.loads(value) for key, value in data.items()}
+
+    def query_ids(self, category, filters=None, limit=None, before=None):
+        """Identifiers matching every {field: value} filter, newest first as (identifier, score)
+
+        before is the (score, identifier) a previous page ended on. Costs O(matches) with
+        filters, and O(log n + limit) without.
+        """
+        keys = self._filter_keys(category, filters)
+        if keys:
+            # Sets weigh 0, so every match keeps its time index score
+            weights = {self._index_key(category, "time"): 1, **{key: 0 for key in keys}}
+            return self._page(self.client.zinter(weights, withscores=True), limit, before)
+        with self.client.pipeline(transaction=False) as pipe:
+            self._queue_recent(pipe, category, limit, before)
+            return self._page([match for matches in pipe.execute() for match in matches], limit, before)
+
+    def query_hashes(self, category, filters=None, limit=None, before=None):
+        """query_ids resolved with one HMGET over the matches only, as (identifier, score, data)"""
+        entries = self.query_ids(category, filters, limit, before)
+        documents = self.get_hashes(category, [identifier for identifier, _ in entries])
+        return [(identifier, score, data) for (identifier, score), data in zip(entries, documents)]
+
+    def indexes_built(self, category):
+        """Whether rebuild_indexes has run and the time index still covers every document in the hash
+
+        A writer going around RedisClient adds documents the indexes never see, the hash then outgrows them.
+        """
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.exists(self._index_key(category, "built"))
+            pipe.hlen(category)
+            pipe.zcard(self._index_key(category, "time"))
+            built, documents, indexed = pipe.execute()
+        return bool(built) and indexed >= documents
+
+    def rebuild_indexes(self, category, count=1000):
+        """Recreate a category's indexes from its hash, for documents written before indexing
+
+        Run it while writers are quiet, a delete racing the scan can leave a stale entry behind.
+        """
+        stale = list(self.client.scan_iter(match=self._index_key(category, "*"), count=count))
+        for start in range(0, len(stale), count):
+            self.client.delete(*stale[start:start + count])
+        cursor, total = 0, 0
+        while True:
+            cursor, batch = self.scan_hashes(category, cursor, count)
+            with self.client.pipeline(transaction=False) as pipe:
+                for identifier, data in batch.items():
+                    self._queue_index(pipe, category, identifier, data)
+                pipe.execute()
+            total += len(batch)
+            if cursor == 0:
+                break
+        self.client.set(self._index_key(category, "built"), time())
+        redis_logger.info(f"Rebuilt indexes for {total} {category}")
+        return total
+
+    def get_all_hashes_by_key(self, category):
+        """Get all hashes in a category keyed by identifier"""
+        data = self.client.hgetall(category)
+        return {key.decode("utf-8"): json.loads(value) for key, value in data.items()}
+
     # Increment a field in a hash (e.g., quantity)
     def increment_hash_field(self, category, identifier, field, amount=1):
         """Increment a field in a hash"""
         key = self._generate_key(category, identifier)
-        new_value = self.client.hincrbyfloat(key, field, amount)
+        prefix, suffix = self._increment_event(category, identifier, field)
+        new_value = self._increment_and_publish(
+            keys=[key, EVENT_STREAM],
+            args=[field, amount, category, prefix, suffix, EVENT_STREAM_MAXLEN]
+        )
         logger.info(f"Incremented {field} by {amount} for key: {key}")
-        # Publish event
-        self._publish_event(category, "update", {
-            "identifier": identifier,
-            field: new_value
-        })
+        return float(new_value)
 
     def get_pubsub(self):
         """Get a pubsub instance"""
         return self.client.pubsub()
 
+class AsyncRedisClient(BaseRedisClient):
+    """asyncio counterpart of RedisClient backed by a bounded, health-checked connection pool"""
+
+    def __init__(self, prefix, redis_host, redis_port, redis_password,
+                 max_connections=REDIS_MAX_CONNECTIONS, pool_timeout=REDIS_POOL_TIMEOUT):
+        self.prefix = prefix
+        # Waits up to pool_timeout for a free connection instead of opening unbounded sockets
+        self.pool = aioredis.BlockingConnectionPool(
+            host=redis_host,
+            port=redis_port,
+            password=redis_password,
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        self._increment_and_publish = self.client.register_script(INCREMENT_AND_PUBLISH)
+        self._write_indexed = self.client.register_script(WRITE_INDEXED)
+        self.connected = False
+
+    async def ping(self):
+        return await self.client.ping()
+
+    async def connect(self):
+        """Wait until Redis answers a ping, retrying with backoff"""
+        await retry_until("Redis", self.ping, (redis.ConnectionError, redis.TimeoutError, OSError), redis_logger,
+                          DB_CONNECT_DELAY, DB_CONNECT_MAX_DELAY)
+        self.connected = True
+        redis_logger.info("Connected to Redis!!!")
+
+    def status(self) -> dict:
+        """Pool occupancy without taking a connection"""
+        return {
+            "max_connections": self.pool.max_connections,
+            "in_use": len(self.pool._in_use_connections),
+            "idle": len(self.pool._available_connections)
+        }
+
+    async def publish(self, channel: str, message: str):
+        """Publish a message to a channel"""
+        await self.client.publish(channel, message)
+        logger.info(f"Published message to channel: {channel}")
+
+    def _publish_event(self, category, action, data, pipe):
+        """Queue an event on a pipeline"""
+        self._queue_event(pipe, category, self._event(category, action, data))
+
+    async def publish_event(self, category, action, data, **fields):
+        """Append an event to the stream and publish it, extra fields go in the envelope"""
+        async with self.client.pipeline() as pipe:
+            self._queue_event(pipe, category, self._event(category, action, data, **fields))
+            await pipe.execute()
+
+    async def last_event_id(self):
+        """Id of the newest stream entry, so a reader can start after it"""
+        entries = await self.client.xrevrange(EVENT_STREAM, count=1)
+        return entries[0][0].decode("utf-8") if entries else "0-0"
+
+    async def read_events(self, last_id, count, block):
+        """Block up to block seconds for entries after last_id, as (id, channel, event json)"""
+        streams = await self.client.xread({EVENT_STREAM: last_id}, count=count, block=int(block * 1000))
+        return [
+            (event_id.decode("utf-8"), fields[b"channel"].decode("utf-8"), fields[b"event"])
+            for _, entries in streams
+            for event_id, fields in entries
+        ]
+
+    async def recent_events(self, last_id, count):
+        """Up to count entries up to and including last_id, oldest first"""
+        entries = await self.client.xrevrange(EVENT_STREAM, max=last_id or "+", count=count)
+        return [
+            (event_id.decode("utf-8"), fields[b"channel"].decode("utf-8"), fields[b"event"])
+            for event_id, fields in reversed(entries)
+        ]
+
+    async def events_after(self, last_id, count):
+        """Up to count entries after last_id, and False if some were already trimmed or left out"""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.xrange(EVENT_STREAM, count=1)
+            pipe.xrange(EVENT_STREAM, min=f"({last_id}", count=count + 1)
+            oldest, entries = await pipe.execute()
+        # Trimming drops the oldest entries first, so nothing is missing while the oldest is not newer than last_id
+        trimmed = oldest and stream_id(oldest[0][0].decode("utf-8")) > stream_id(last_id)
+        complete = not trimmed and len(entries) <= count
+        return [
+            (event_id.decode("utf-8"), fields[b"channel"].decode("utf-8"), fields[b"event"])
+            for event_id, fields in entries[:count]
+        ], complete
+
+    async def set_hash(self, category, key, data):
+        """Set or update a hash"""
+        if not key:
+            key = self._generate_key(category, key)
+        if category in INDEXED_CATEGORIES:
+            async def write(pipe):
+                # Under WATCH, the index entries to move are those of the document replaced
+                stored = await pipe.hget(category, key)
+                pipe.multi()
+                # On a pipeline the script is only queued, awaiting it runs nothing yet
+                await self._write_indexed(client=pipe, **self._write_indexed_args(
+                    category, key, json.loads(stored) if stored else None, data, self._score(data)
+                ))
+            await self.client.transaction(write, category)
+            return
+        await self.client.hset(category, key, json.dumps(data))
+
+    async def get_hash(self, category, key):
+        """Get a hash"""
+        if not key:
+            key = self._generate_key(category, key)
+        data = await self.client.hget(category, key)
+        return json.loads(data) if data else None
+
+    async def get_hashes(self, category, keys):
+        """Get several hashes in one HMGET, None for missing keys"""
+        if not keys:
+            return []
+        values = await self.client.hmget(category, keys)
+        return [json.loads(value) if value else None for value in values]
+
+    async def update_hash(self, category, identifier, updates):
+        """Update specific fields in a hash, the category document and its indexes are left alone"""
+        key = self._generate_key(category, identifier)
+        async with self.client.pipeline() as pipe:
+            pipe.hset(key, mapping=updates)
+            self._publish_event(category, "update", {
+                "identifier": identifier,
+                **updates
+            }, pipe)
+            await pipe.execute()
+        logger.info(f"Updated hash for key: {key}")
+
+    async def delete_hash(self, category, identifier):
+        """Delete a hash"""
+        key = self._generate_key(category, identifier)
+        indexed = category in INDEXED_CATEGORIES
+
+        async def write(pipe):
+            # Get the data before deleting, under WATCH for indexed categories
+            stored = await (pipe if indexed else self.client).hget(category, identifier)
+            data = json.loads(stored) if stored else None
+            pipe.multi()
+            pipe.delete(key)
+            if indexed:
+                await self._write_indexed(client=pipe, **self._write_indexed_args(category, identifier, data))
+            self._publish_event(category, "delete", {
+                "identifier": identifier,
+                **(data or {})
+            }, pipe)
+        await self.client.transaction(write, *([category] if indexed else []))
+        logger.info(f"Deleted hash for key: {key}")
+
+    async def get_all_hashes(self, category):
+        """Get all hashes in a category"""
+        data = await self.client.hgetall(category)
+        return [json.loads(value) for value in data.values()]
+
+    async def scan_hashes(self, category, cursor=0, count=None):
+        """One HSCAN step over a category, as the next cursor (0 when done) and {identifier: data}"""
+        cursor, data = await self.client.hscan(category, cursor, count=count)
+        return cursor, {key.decode("utf-8"): json.loads(value) for key, value in data.items()}
+
+    async def query_ids(self, category, filters=None, limit=None, before=None):
+        """Identifiers matching every {field: value} filter, newest first as (identifier, score)
+
+        before is the (score, identifier) a previous page ended on. Costs O(matches) with
+        filters, and O(log n + limit) without.
+        """
+        keys = self._filter_keys(category, filters)
+        if keys:
+            # Sets weigh 0, so every match keeps its time index score
+            weights = {self._index_key(category, "time"): 1, **{key: 0 for key in keys}}
+            return self._page(await self.client.zinter(weights, withscores=True), limit, before)
+        async with self.client.pipeline(transaction=False) as pipe:
+            self._queue_recent(pipe, category, limit, before)
+            return self._page([match for matches in await pipe.execute() for match in matches], limit, before)
+
+    async def query_hashes(self, category, filters=None, limit=None, before=None):
+        """query_ids resolved with one HMGET over the matches only, as (identifier, score, data)"""
+        entries = await self.query_ids(category, filters, limit, before)
+        documents = await self.get_hashes(category, [identifier for identifier, _ in entries])
+        return [(identifier, score, data) for (identifier, score), data in zip(entries, documents)]
+
+    async def indexes_built(self, category):
+        """Whether rebuild_indexes has run and the time index still covers every document in the hash"""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.exists(self._index_key(category, "built"))
+            pipe.hlen(category)
+            pipe.zcard(self._index_key(category, "time"))
+            built, documents, indexed = await pipe.execute()
+        return bool(built) and indexed >= documents
+
+    async def get_all_hashes_by_key(self, category):
+        """Get all hashes in a category keyed by identifier"""
+        data = await self.client.hgetall(category)
+        return {key.decode("utf-8"): json.loads(value) for key, value in data.items()}
+
+    async def increment_hash_field(self, category, identifier, field, amount=1):
+        """Increment a field in a hash"""
+        key = self._generate_key(category, identifier)
+        prefix, suffix = self._increment_event(category, identifier, field)
+        new_value = await self._increment_and_publish(
+            keys=[key, EVENT_STREAM],
+            args=[field, amount, category, prefix, suffix, EVENT_STREAM_MAXLEN]
+        )
+        logger.info(f"Incremented {field} by {amount} for key: {key}")
+        return float(new_value)
+
+    def get_pubsub(self):
+        """Get a pubsub instance, it holds one pool connection until closed"""
+        return self.client.pubsub()
+
+    async def close(self):
+        await self.client.aclose()
+        await self.pool.disconnect()
+
 redis_client = RedisClient(
     prefix='alphaedge',
     redis_host=REDIS_HOST,
     redis_port=REDIS_PORT,
     redis_password=REDIS_PASSWORD
-)
\ No newline at end of file
+)
+
+async_redis_client = AsyncRedisClient(
+    prefix='alphaedge',
+    redis_host=redis_host,
+    redis_port=redis_port,
+    redis_password=redis_password
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the secondary indexes of the Redis hashes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="Rebuild indexes from the hashes")
+    # No choices=, argparse checks an empty nargs="*" list against them and rejects it
+    rebuild_parser.add_argument("categories", nargs="*", metavar="category",
+                                help=f"one of {', '.join(INDEXED_CATEGORIES)}, all of them by default")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        unknown = set(args.categories) - set(INDEXED_CATEGORIES)
+        if unknown:
+            parser.error(f"no indexes on {', '.join(sorted(unknown))}")
+        for category in args.categories or INDEXED_CATEGORIES:
+            redis_client.rebuild_indexes(category)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,40 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.websockets import WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
 from loguru import logger
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
 from contextlib import asynccontextmanager
 import logging
 import sys
 import asyncio
 
+from app.middleware.admission import AdmissionMiddleware
+from app.middleware.compression import CompressionMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.database.mongodb import async_db, db, ensure_indexes, mongo_client
+from app.database.redis import async_redis_client
 from app.services.websocket import manager
 from app.config import (
+    DB_CONNECT_DELAY,
+    DB_CONNECT_MAX_DELAY,
     HOST,
-    PORT
+    PORT,
+    READY_CHECK_TIMEOUT,
+    WEB_CONCURRENCY,
+    WS_MAX_MESSAGE_SIZE,
+    WS_PER_MESSAGE_DEFLATE,
+    WS_PING_INTERVAL,
+    WS_PING_TIMEOUT
 )
+from app.services.admission import admission
+from app.services.cache import response_cache
+from app.services.metrics import registry
 from app.services.realtime import RealtimeService
+from app.services.rollups import rollup_watcher
+from app.utils.backoff import backoff_delay
 
 from app.routes.dashboard import router as dashboard_router
 from app.routes.orders import router as orders_router
@@ -24,7 +45,8 @@ logger.add(
     sys.stdout,
     format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
     level="INFO",
-    colorize=True
+    colorize=True,
+    enqueue=True  # Format and write on loguru's worker thread, off the event loop
 )
 logger.add(
     "./app.log",  # File path for logging
@@ -32,7 +54,8 @@ logger.add(
     retention="10 days",  # Keep logs for 10 days
     compression="zip",  # Compress rotated logs
     format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-    level="INFO"
+    level="INFO",
+    enqueue=True
 )
 
 # Intercept uvicorn's default logger
@@ -44,29 +67,70 @@ class InterceptHandler(logging.Handler):
         except ValueError:
             level = record.levelno
 
-        # Find caller from where originated the logged message
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
-            frame = frame.f_back
-            depth += 1
-
-        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+        # The stdlib record already knows where it came from, no need to walk the stack
+        origin = {"name": record.name, "function": record.funcName, "line": record.lineno}
+        logger.patch(lambda r: r.update(origin)).opt(exception=record.exc_info).log(level, record.getMessage())
 
 # Setup intercept handler for uvicorn
 logging.getLogger("uvicorn").handlers = [InterceptHandler()]
+# MetricsMiddleware writes the sampled access log, drop uvicorn's line per request
 logging.getLogger("uvicorn.access").handlers = [InterceptHandler()]
+logging.getLogger("uvicorn.access").disabled = True
+
+async def connect_databases():
+    """Connect both databases and ensure the indexes, cancelling the other connect if one fails"""
+    connects = [asyncio.ensure_future(async_db.connect()), asyncio.ensure_future(async_redis_client.connect())]
+    try:
+        await asyncio.gather(*connects)
+    except BaseException:
+        for task in connects:
+            task.cancel()
+        raise
+    await asyncio.get_running_loop().run_in_executor(async_db.executor, ensure_indexes, db)
+
+async def start_services(app: FastAPI):
+    """Wait for both databases, then start everything that needs them"""
+    started = asyncio.get_running_loop().time()
+    attempt = 0
+    while True:
+        try:
+            await connect_databases()
+            break
+        except Exception as e:
+            # The connects only retry unreachable servers, e.g. a rejected login lands here.
+            # Without a retry /ready would answer 503 forever and the realtime service never start
+            delay = backoff_delay(attempt, DB_CONNECT_DELAY, DB_CONNECT_MAX_DELAY)
+            attempt += 1
+            logger.error(f"Startup failed ({str(e) or type(e).__name__}), attempt {attempt}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    # The realtime service also runs the rollup watcher while its worker is the elected leader
+    asyncio.create_task(app.state.realtime.start_listening())
+    app.state.ready = True
+    logger.info(f"Ready in {asyncio.get_running_loop().time() - started:.2f}s")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Create and start realtime service
-    realtime_service = RealtimeService()
-    asyncio.create_task(realtime_service.start_listening())
+    # Serve /health straight away, databases are connected in the background and /ready reports when it's done
+    app.state.ready = False
+    realtime_service = app.state.realtime = RealtimeService()
+    admission.start()
+    manager.start()
+    startup = asyncio.create_task(start_services(app))
     yield
+    startup.cancel()
+    admission.stop()
+    await manager.close()
     # Stop realtime service
     await realtime_service.stop_listening()
+    rollup_watcher.stop()
+    async_db.close()
+    await async_redis_client.close()
 
 app = FastAPI(lifespan=lifespan, debug=True)
 
+# Innermost, so shed responses still get CORS headers and are counted by MetricsMiddleware
+app.add_middleware(AdmissionMiddleware)
+
 # Add CORS middleware
 origins = ["http://localhost:5173", "alphaedge.vatsalpandya.com"]
 
@@ -76,33 +140,93 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified", "X-Next-Cursor"],
 )
 
+# Compress large JSON bodies for clients that accept gzip or br
+app.add_middleware(CompressionMiddleware)
+# Outermost, so latency covers compression and every other middleware
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(dashboard_router, prefix="/api/v1/dashboard", tags=["dashboard"])
 app.include_router(orders_router, prefix="/api/v1/orders", tags=["orders"])
 app.include_router(positions_router, prefix="/api/v1/positions", tags=["positions"])
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Incoming request: {request.method} {request.url}")
-    response = await call_next(request)
-    logger.info(f"Response status: {response.status_code}")
-    return response
+@app.exception_handler(PyMongoError)
+async def mongo_error_handler(request: Request, exc: PyMongoError):
+    logger.error(f"MongoDB error on {request.method} {request.url.path}: {str(exc)}")
+    if exc.timeout:
+        return JSONResponse(status_code=504, content={"error": "Database query timed out"})
+    return JSONResponse(status_code=503, content={"error": "Database unavailable"})
+
+@app.exception_handler(RedisError)
+async def redis_error_handler(request: Request, exc: RedisError):
+    logger.error(f"Redis error on {request.method} {request.url.path}: {str(exc)}")
+    return JSONResponse(status_code=503, content={"error": "Cache unavailable"})
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    if not await manager.connect(websocket):
+        return
     try:
         while True:
-            await websocket.receive_text()
+            # {"action": "subscribe" | "unsubscribe", "channel": ..., "user_id": ..., "symbol": ...}
+            # {"action": "resume", "last_event_id": ...} after subscribing, replays missed events first
+            message = await websocket.receive_text()
+            manager.handle_client_message(websocket, message)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return admission.stats()
+
+@app.get("/ws/stats")
+async def websocket_stats():
+    return manager.stats()
+
+@app.get("/realtime/stats")
+async def realtime_stats():
+    return app.state.realtime.metrics()
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
+    """Liveness, the process is serving requests, never touches a database"""
     return {"status": "healthy"}
 
+async def _check(ping):
+    try:
+        await asyncio.wait_for(ping(), READY_CHECK_TIMEOUT)
+        return True
+    except Exception:
+        return False
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness, startup finished and both databases answer now"""
+    mongo_ok, redis_ok = await asyncio.gather(
+        _check(lambda: async_db.ping(READY_CHECK_TIMEOUT)), _check(async_redis_client.ping)
+    )
+    ready = app.state.ready and mongo_ok and redis_ok
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "status": "ready" if ready else "starting" if not app.state.ready else "degraded",
+        "mongodb": {"ok": mongo_ok, **mongo_client.status()},
+        "redis": {"ok": redis_ok, **async_redis_client.status()}
+    })
+
 if __name__ == "__main__":
     import uvicorn
     logger.info(f'Running application on {HOST}:{PORT}')
-    uvicorn.run(app, host=HOST, port=PORT)
+    # Workers are separate processes, so uvicorn needs the import string rather than the app
+    # Only the websockets implementation sends protocol pings, wsproto would never notice a vanished client
+    uvicorn.run("app.main:app", host=HOST, port=PORT, workers=WEB_CONCURRENCY, ws="websockets",
+                ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE, ws_ping_interval=WS_PING_INTERVAL,
+                ws_ping_timeout=WS_PING_TIMEOUT, ws_max_size=WS_MAX_MESSAGE_SIZE)
@@ -0,0 +1,65 @@
+import math
+from starlette.datastructures import QueryParams
+from starlette.responses import JSONResponse
+from starlette.websockets import WebSocket
+from app.config import ADMISSION_RETRY_AFTER
+from app.services.admission import admission, connect_limiter, ip_limiter, user_limiter
+from app.services.metrics import http_requests_rejected_total, websocket_connections_rejected_total
+
+# Probes and scrapes must keep answering while traffic is shed
+EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+
+def client_ip(scope):
+    """The peer address, already the X-Forwarded-For client when uvicorn trusts the peer (FORWARDED_ALLOW_IPS)"""
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionMiddleware:
+    """Fast 503s beyond the in-flight limit and 429s past a client's rate limit, before any route runs
+
+    WebSocket handshakes are rate limited per IP here, the connection cap is ConnectionManager's.
+    """
+
+    def __init__(self, app, retry_after=ADMISSION_RETRY_AFTER):
+        self.app = app
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            return await self._websocket(scope, receive, send)
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        if not admission.try_enter():
+            http_requests_rejected_total.inc("overloaded")
+            return await self._reject(scope, receive, send, 503, "Server busy", self.retry_after)
+        try:
+            wait = await self._rate_limit(scope)
+            if wait > 0:
+                http_requests_rejected_total.inc("rate_limited")
+                return await self._reject(scope, receive, send, 429, "Too many requests", wait)
+            await self.app(scope, receive, send)
+        finally:
+            admission.leave()
+
+    async def _rate_limit(self, scope):
+        """Seconds until the client may retry, 0 when the request is within its IP and user limits"""
+        wait = await ip_limiter.take(client_ip(scope))
+        user_id = QueryParams(scope.get("query_string", b"")).get("user_id")
+        if wait == 0 and user_id:
+            wait = await user_limiter.take(user_id)
+        return wait
+
+    async def _reject(self, scope, receive, send, status, error, retry_after):
+        response = JSONResponse(status_code=status, content={"error": error},
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        await response(scope, receive, send)
+
+    async def _websocket(self, scope, receive, send):
+        if await connect_limiter.take(client_ip(scope)) > 0:
+            websocket_connections_rejected_total.inc("rate_limited")
+            # Closing before accept() is a plain HTTP 403, accept first so the client sees 1013: try again later
+            websocket = WebSocket(scope, receive, send)
+            await websocket.accept()
+            return await websocket.close(code=1013)
+        await self.app(scope, receive, send)
@@ -0,0 +1,109 @@
+import gzip
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from app.config import COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, gzip is always available
+    brotli = None
+
+def choose_encoding(accept_encoding: str):
+    """Pick br over gzip when the client accepts it and brotli is installed"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+class StreamCompressor:
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=min(level, 11))
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        if self.encoding == "br":
+            out = self.compressor.process(data)
+            return out + (self.compressor.finish() if final else self.compressor.flush())
+        out = self.compressor.compress(data)
+        # Sync flush so streamed NDJSON lines reach the client as they are produced
+        return out + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli for responses above a size threshold, streamed bodies included"""
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE, level=COMPRESSION_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = Headers(raw=message["headers"])
+                passthrough = "content-encoding" in headers or message["status"] in (204, 304)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                if start is not None:
+                    await send(start)
+                    start = None
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    start = None
+                    return await send(message)
+                headers["Content-Encoding"] = encoding
+                if more_body:
+                    compressor = StreamCompressor(encoding, self.level)
+                    del headers["Content-Length"]
+                else:
+                    body = compress(body, encoding, self.level)
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+                if not more_body:
+                    return await send({"type": "http.response.body", "body": body})
+            await send({
+                "type": "http.response.body",
+                "body": compressor.compress(body, final=not more_body),
+                "more_body": more_body
+            })
+
+        await self.app(scope, receive, wrapped_send)
@@ -0,0 +1,45 @@
+import random
+from time import perf_counter
+from loguru import logger
+from app.config import ACCESS_LOG_SAMPLE_RATE, ACCESS_LOG_SLOW_REQUEST
+from app.services.metrics import (
+    http_request_duration_seconds,
+    http_requests_in_flight,
+    http_requests_total
+)
+
+class MetricsMiddleware:
+    """Per-route latency histograms, status counts and in-flight gauge, with sampled access logs"""
+
+    def __init__(self, app, sample_rate=ACCESS_LOG_SAMPLE_RATE, slow_request=ACCESS_LOG_SLOW_REQUEST):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_request = slow_request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started
+            http_requests_in_flight.dec()
+            # Route templates keep label cardinality bounded, raw paths carry ids
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_request_duration_seconds.observe(elapsed, method, route)
+            http_requests_total.inc(method, route, str(status))
+            # Errors and slow requests are always logged, everything else is sampled
+            if status >= 500 or elapsed >= self.slow_request or random.random() < self.sample_rate:
+                logger.info(f"{method} {scope['path']} {status} {elapsed * 1000:.1f}ms")
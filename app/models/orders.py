@@ -1,5 +1,7 @@
 from datetime import datetime
+from typing import List
 from pydantic import BaseModel, Field
+from app.config import ORDERS_BATCH_MAX
 
 class Order(BaseModel):
     id: str = Field(alias="_id")
@@ -31,3 +33,6 @@ class Order(BaseModel):
 
     class Config:
         populate_by_name = True
+
+class OrderBatch(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=ORDERS_BATCH_MAX)
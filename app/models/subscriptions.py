@@ -0,0 +1,20 @@
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+from app.utils.streams import STREAM_ID
+
+# position_deltas carries per-position changes, opt-in since unsubscribed clients only get positions and signals
+CHANNELS = ("orders", "positions", "trades", "signals", "position_deltas")
+
+class Subscription(BaseModel):
+    action: Literal["subscribe", "unsubscribe"]
+    channel: Literal["orders", "positions", "trades", "signals", "position_deltas"]
+    user_id: Optional[str] = None
+    symbol: Optional[str] = None
+
+    def topic(self):
+        return (self.channel, self.user_id, self.symbol)
+
+class Resume(BaseModel):
+    """Replay events missed since last_event_id, the id of the last event the client received"""
+    action: Literal["resume"]
+    last_event_id: str = Field(..., regex=STREAM_ID.pattern)
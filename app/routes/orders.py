@@ -1,17 +1,96 @@
-from fastapi import APIRouter
-from app.database.redis import redis_client
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from loguru import logger
+from pydantic import ValidationError
+from app.config import ORDERS_INDEXED, ORDERS_SCAN_COUNT
+from app.database.redis import async_redis_client
+from app.models.orders import Order, OrderBatch
+from app.utils.codec import dumps
+from app.utils.http import make_etag, not_modified, validators
 
 router = APIRouter()
 
-@router.get("/{order_id}")
-async def get_order(order_id: str):
+def parse_order(order_id, order):
+    """Validate a stored order against the Order model, None if it doesn't fit"""
+    try:
+        return Order.parse_obj({**order, "_id": order_id}).dict()
+    except ValidationError as e:
+        logger.warning(f"Order {order_id} failed validation: {str(e)}")
+        return None
+
+def encode_cursor(scan_cursor, skip):
+    return f"{scan_cursor}-{skip}"
+
+def decode_cursor(cursor):
+    """HSCAN cursor of the batch the page stopped in, and how many of its entries were already looked at
+
+    The offset assumes the batch comes back the same, which only holds while the hash doesn't change.
     """
-    Get a specific order by ID from redis
+    try:
+        scan_cursor, skip = (int(part) for part in cursor.split("-"))
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if scan_cursor < 0 or skip < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return scan_cursor, skip
+
+def encode_index_cursor(score, order_id):
+    return urlsafe_b64encode(json.dumps([score, order_id]).encode()).decode()
+
+def decode_index_cursor(cursor):
+    """(score, identifier) of the last order on the previous page"""
+    try:
+        score, order_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return float(score), str(order_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def list_indexed_orders(filters, limit, cursor=None):
+    """A page of orders newest first from the secondary indexes, reads only the matching orders"""
+    entries = await async_redis_client.query_hashes(
+        "orders", filters, limit + 1, decode_index_cursor(cursor) if cursor else None
+    )
+    orders = []
+    for order_id, _, order in entries[:limit]:
+        # None when the order was deleted between the index read and the HMGET
+        parsed = parse_order(order_id, order) if order is not None else None
+        if parsed is not None:
+            orders.append(parsed)
+    if len(entries) <= limit:
+        return orders, None
+    order_id, score, _ = entries[limit - 1]
+    return orders, encode_index_cursor(score, order_id)
+
+async def list_orders(filters, limit, cursor=None):
+    """A page of orders matching every filter, and the cursor of the next page or None
+
+    Reads the secondary indexes with ORDERS_INDEXED on, as long as they cover the whole hash, and those
+    pages are exact. Otherwise this walks the orders hash with HSCAN, so memory stays bounded by
+    ORDERS_SCAN_COUNT, but a selective filter may read many batches to fill one page. HSCAN only promises
+    to return entries present for the whole walk, so orders added, removed or rehashed while a client
+    pages may be repeated or missed.
     """
-    order = redis_client.get_hash("orders", order_id)
-    if not order:
-        return {"error": "Order not found"}
-    return {"id": order_id, **order}
+    if ORDERS_INDEXED and await async_redis_client.indexes_built("orders"):
+        return await list_indexed_orders(filters, limit, cursor)
+    scan_cursor, skip = decode_cursor(cursor) if cursor else (0, 0)
+    orders = []
+    while True:
+        next_cursor, batch = await async_redis_client.scan_hashes("orders", scan_cursor, ORDERS_SCAN_COUNT)
+        for position, (order_id, order) in enumerate(batch.items()):
+            if position < skip or any(str(order.get(field)) != value for field, value in filters.items()):
+                continue
+            if len(orders) == limit:
+                # Another match exists, the next page starts with it if the batch comes back the same
+                return orders, encode_cursor(scan_cursor, position)
+            parsed = parse_order(order_id, order)
+            if parsed is not None:
+                orders.append(parsed)
+        if next_cursor == 0:
+            return orders, None
+        scan_cursor, skip = next_cursor, 0
 
 @router.get("/status")
 async def orders_status():
@@ -19,3 +98,58 @@ async def orders_status():
     Check orders endpoint health
     """
     return {"status": "healthy"}
+
+@router.get("", response_model=List[dict])
+async def get_orders(
+    response: Response,
+    user_id: str = Query(default=None, description="User ID"),
+    status: str = Query(default=None, description="Order status"),
+    symbol: str = Query(default=None, description="Symbol"),
+    limit: int = Query(default=100, ge=1, le=1000, description="Orders per page"),
+    cursor: str = Query(default=None, description="X-Next-Cursor of the previous page")
+):
+    """
+    List orders matching the given filters, newest first when read from the indexes
+
+    The next page's cursor is returned in the X-Next-Cursor header.
+    Without the indexes, orders changed while paging may be repeated or missed.
+    Orders that fail validation are left out.
+    """
+    filters = {field: value for field, value in (("user_id", user_id), ("status", status), ("symbol", symbol))
+               if value is not None}
+    orders, next_cursor = await list_orders(filters, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return orders
+
+@router.post("/batch")
+async def get_orders_batch(batch: OrderBatch):
+    """
+    Get many orders by ID with a single HMGET, in request order
+    """
+    ids = list(dict.fromkeys(batch.ids))
+    values = await async_redis_client.get_hashes("orders", ids)
+    orders, missing, invalid = [], [], []
+    for order_id, order in zip(ids, values):
+        if order is None:
+            missing.append(order_id)
+            continue
+        parsed = parse_order(order_id, order)
+        if parsed is None:
+            invalid.append(order_id)
+        else:
+            orders.append(parsed)
+    return {"orders": orders, "missing": missing, "invalid": invalid}
+
+# Declared last, the path parameter would otherwise swallow /status and /batch
+@router.get("/{order_id}")
+async def get_order(order_id: str, request: Request):
+    """
+    Get a specific order by ID from redis
+    """
+    order = await async_redis_client.get_hash("orders", order_id)
+    if not order:
+        return {"error": "Order not found"}
+    order = {"id": order_id, **order}
+    etag = make_etag(dumps(order))
+    return not_modified(request, etag) or JSONResponse(order, headers=validators(etag))
@@ -1,13 +1,22 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from contextlib import aclosing
 from typing import List
 from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Query
+from bson import json_util
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
-from app.database.mongodb import db
-from app.database.redis import redis_client
-from app.utils.datetime import get_current_time
-from pytz import timezone
+from app.config import ANALYTICS_POINTS
+from app.database.mongodb import async_db
+from app.database.redis import async_redis_client
+from app.services.analytics import get_analytics
+from app.services.cache import CLOSED_POSITIONS, response_cache
+from app.services.rollups import get_performance
+from app.utils.codec import dumps
+from app.utils.datetime import IST, UTC, get_current_time
+from app.utils.http import make_etag, not_modified, validators
 
 router = APIRouter()
 
@@ -21,71 +30,184 @@ class PositionResponse(BaseModel):
     totalCost: float
     pl: str
 
+# Only the fields format_position reads, keeps order_result and friends off the wire
+LATEST_PROJECTION = {
+    "_id": 1,
+    "symbol": 1,
+    "position_id": 1,
+    "quantity": 1,
+    "entry_price": 1,
+    "current_price": 1,
+    "realized_pnl": 1,
+    "blocked_capital": 1,
+    "strike_price": 1,
+    "right": 1,
+    "expiry_date": 1,
+    "exit_time": 1
+}
+LATEST_SORT = [("exit_time", -1), ("_id", -1)]
+
+def encode_cursor(position):
+    return urlsafe_b64encode(json_util.dumps([position["exit_time"], position["_id"]]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        exit_time, position_id = json_util.loads(urlsafe_b64decode(cursor.encode()))
+        return exit_time.replace(tzinfo=None), position_id
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def latest_query(cursor=None):
+    one_week_ago = (get_current_time() - timedelta(days=7)).replace(tzinfo=None)
+    query = {"exit_time": {"$gt": one_week_ago}}
+    if cursor:
+        # Keyset: strictly after the last row of the previous page in (exit_time, _id) desc order
+        exit_time, position_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [
+            {"exit_time": {"$lt": exit_time}},
+            {"exit_time": exit_time, "_id": {"$lt": position_id}}
+        ]}]}
+    return query
+
+def format_position(position):
+    # Convert executionDateTime to IST
+    execution_datetime_ist = position["exit_time"].replace(tzinfo=UTC).astimezone(IST)
+
+    # Calculate total cost
+    total_cost = float(position["quantity"]) * float(position["entry_price"])
+
+    # Format the position data
+    return {
+        "symbol": position["symbol"],
+        "tradeId": position["position_id"],
+        "quantity": int(position["quantity"]),
+        "entry_price": f"{float(position['entry_price']):.2f}",
+        "exit_price": f"{float(position['current_price']):.2f}",
+        "executionDateTime": execution_datetime_ist,
+        "totalCost": round(total_cost, 2),
+        "pl": round(float(position["realized_pnl"]), 2),
+        "used_margin": round(position.get("blocked_capital", 0), 2),
+        # TODO: This is hardcoded for now but can be improved later
+        "identifier": f"Nifty50 {position['strike_price']} {position['right']} {position['expiry_date']}"
+    }
+
+class LatestPage:
+    """Pulls at most limit positions off a cursor stream and remembers where the page ended"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.last = None
+        self.has_more = False
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.last) if self.has_more else None
+
+    async def positions(self, query):
+        stream = async_db.closed_positions.stream(query, LATEST_PROJECTION, sort=LATEST_SORT,
+                                                  limit=self.limit + 1 if self.limit else 0)
+        count = 0
+        async with aclosing(stream) as positions:
+            async for position in positions:
+                if self.limit and count == self.limit:
+                    # The extra row only tells us another page exists
+                    self.has_more = True
+                    return
+                count += 1
+                self.last = position
+                yield position
+
+    async def day_groups(self, query):
+        """Yield exit-day groups as soon as each one is complete, rows arrive newest first"""
+        group = None
+        async for position in self.positions(query):
+            formatted_position = format_position(position)
+            date_key = formatted_position["executionDateTime"].strftime("%B %d, %Y")
+            if group is not None and group["date"] != date_key:
+                yield group
+                group = None
+            if group is None:
+                group = {
+                    "date": date_key,
+                    "trades": [],
+                    "pnl": 0.0
+                }
+            group["trades"].append(formatted_position)
+            group["pnl"] += formatted_position["pl"]
+        if group is not None:
+            yield group
+
 @router.get("/latest", response_model=List[dict])
-async def get_latest_positions():
+async def get_latest_positions(
+    request: Request,
+    response: Response,
+    limit: int = Query(default=None, ge=1, le=1000, description="Trades per page, all of the last week when omitted"),
+    cursor: str = Query(default=None, description="X-Next-Cursor of the previous page"),
+    stream: bool = Query(default=False, description="Stream day groups as NDJSON")
+):
     """
     Get latest positions sorted by date, grouped by exit day
-    """
-    one_week_ago = (get_current_time() - timedelta(days=7)).replace(tzinfo=None)
-    # Fetch from MongoDB with date filter
-    positions = list(db.closed_positions.find({
-        "exit_time": {"$gt": one_week_ago}
-    }).sort("exit_time", -1))
-
-    grouped_positions = {}
-
-    for position in positions:
-        # Convert executionDateTime to IST
-        ist = timezone('Asia/Kolkata')
-        execution_datetime_ist = position["exit_time"].replace(tzinfo=timezone('UTC')).astimezone(ist)
-
-        # Calculate total cost
-        total_cost = float(position["quantity"]) * float(position["entry_price"])
-        realized_pnl = round(float(position["realized_pnl"]), 2)
-        
-        # Format the position data
-        formatted_position = {
-            "symbol": position["symbol"],
-            "tradeId": position["position_id"],
-            "quantity": int(position["quantity"]),
-            "entry_price": f"{float(position['entry_price']):.2f}",
-            "exit_price": f"{float(position['current_price']):.2f}",
-            "executionDateTime": execution_datetime_ist,
-            "totalCost": round(total_cost, 2),
-            "pl": realized_pnl,
-            "used_margin": round(position.get("blocked_capital", 0), 2),
-            # TODO: This is hardcoded for now but can be improved later
-            "identifier": f"Nifty50 {position['strike_price']} {position['right']} {position['expiry_date']}"
-        }
 
-        # Group by date
-        date_key = execution_datetime_ist.strftime("%B %d, %Y")
-        if date_key not in grouped_positions:
-            grouped_positions[date_key] = {
-                "date": date_key,
-                "trades": [],
-                "pnl": 0.0
-            }
-        
-        grouped_positions[date_key]["trades"].append(formatted_position)
-        grouped_positions[date_key]["pnl"] += realized_pnl
-
-    # Convert grouped data to a list
-    response = list(grouped_positions.values())
-    return response
+    With limit set, the next page's cursor is returned in the X-Next-Cursor header
+    (or a trailing {"next_cursor": ...} line when streaming). A day can span pages.
+    """
+    if stream or "application/x-ndjson" in request.headers.get("accept", ""):
+        page = LatestPage(limit)
+        query = latest_query(cursor)
+
+        async def lines():
+            async for group in page.day_groups(query):
+                yield dumps(group) + b"\n"
+            if page.next_cursor:
+                yield dumps({"next_cursor": page.next_cursor}) + b"\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    async def load():
+        page = LatestPage(limit)
+        groups = [group async for group in page.day_groups(latest_query(cursor))]
+        # Over every row served, so a corrected row anywhere in the window changes it, computed once per cached page
+        return [groups, page.next_cursor, make_etag(dumps(groups), page.next_cursor)]
+
+    groups, next_cursor, etag = await response_cache.get_or_load(
+        CLOSED_POSITIONS, "latest-page", {"limit": limit, "cursor": cursor}, load
+    )
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    response.headers.update(validators(etag))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return groups
 
 @router.get("/stats")
-async def get_positions_stats():
+async def get_positions_stats(request: Request):
     """
     Get positions stats
     """
-    stats = redis_client.get_hash("stats", "web")
+    stats = await async_redis_client.get_hash("stats", "web")
     if not stats:
         stats = {
             "total_positions": 0,
             "total_pnl": 0.0
         }
-    return stats
+    etag = make_etag(dumps(stats))
+    return not_modified(request, etag) or JSONResponse(stats, headers=validators(etag))
+
+@router.get("/open")
+async def get_open_positions_summary(
+    request: Request,
+    user_id: str = Query(default=None, description="User ID"),
+    symbol: str = Query(default=None, description="Symbol")
+):
+    """
+    Get count, unrealized PnL and exposure of open positions, in total and per symbol
+    """
+    # Answered from the realtime service's in-memory position book, no Redis round trip
+    book = request.app.state.realtime.book
+    return {
+        **book.summary(user_id, symbol),
+        "by_symbol": book.by_symbol(user_id)
+    }
 
 @router.get("/performance")
 async def get_performance_stats(
@@ -102,139 +224,32 @@ async def get_performance_stats(
     if to_date is None:
         to_date = from_date + timedelta(days=1)
 
-    pipeline = [
-        {
-            "$match": {
-                "user_id": user_id,
-                "timestamp": {
-                    "$gte": from_date,
-                    "$lt": to_date
-                }
-            }
-        },
-        {
-            "$addFields": {
-                "trade_result": {
-                    "$cond": [
-                        {"$gt": ["$unrealized_pnl", 0]},
-                        "win",
-                        "loss"
-                    ]
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": "$trade_result",
-                "count": {"$sum": 1},
-                "max_pnl": {"$max": "$unrealized_pnl"},
-                "min_pnl": {"$min": "$unrealized_pnl"},
-                "total_pnl": {"$sum": "$unrealized_pnl"}
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "winning_trades": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$_id", "win"]}, "$count", 0]
-                    }
-                },
-                "losing_trades": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$_id", "loss"]}, "$count", 0]
-                    }
-                },
-                "max_win": {
-                    "$max": {
-                        "$cond": [{"$eq": ["$_id", "win"]}, "$max_pnl", None]
-                    }
-                },
-                "max_loss": {
-                    "$min": {
-                        "$cond": [{"$eq": ["$_id", "loss"]}, "$min_pnl", None]
-                    }
-                },
-                "total_win": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$_id", "win"]}, "$total_pnl", 0]
-                    }
-                },
-                "total_loss": {
-                    "$sum": {
-                        "$cond": [{"$eq": ["$_id", "loss"]}, "$total_pnl", 0]
-                    }
-                },
-                "total_pnl": {"$sum": "$total_pnl"}
-            }
-        },
-        {
-            "$addFields": {
-                "avg_winner": {
-                    "$cond": [
-                        {"$gt": ["$winning_trades", 0]},
-                        {"$round": [{"$divide": ["$total_win", "$winning_trades"]}, 2]},
-                        0
-                    ]
-                },
-                "avg_loser": {
-                    "$cond": [
-                        {"$gt": ["$losing_trades", 0]},
-                        {"$round": [{"$divide": ["$total_loss", "$losing_trades"]}, 2]},
-                        0
-                    ]
-                },
-                "total_win": {"$round": ["$total_win", 2]},
-                "total_loss": {"$round": ["$total_loss", 2]},
-                "total_pnl": {"$round": ["$total_pnl", 2]},
-                "max_win": {"$round": ["$max_win", 2]},
-                "max_loss": {"$round": ["$max_loss", 2]},
-                "hit_rate": {
-                    "$cond": [
-                        {"$gt": [{"$add": ["$winning_trades", "$losing_trades"]}, 0]},
-                        {"$round": [
-                            {"$multiply": [
-                                {"$divide": [
-                                    "$winning_trades",
-                                    {"$add": ["$winning_trades", "$losing_trades"]}
-                                ]},
-                                100
-                            ]},
-                            2
-                        ]},
-                        0
-                    ]
-                }
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "winning_trades": 1,
-                "losing_trades": 1,
-                "max_win": 1,
-                "max_loss": 1,
-                "total_win": 1,
-                "total_loss": 1,
-                "total_pnl": 1,
-                "avg_winner": 1,
-                "avg_loser": 1,
-                "hit_rate": 1
-            }
-        }
-    ]
-
-    result = list(db.closed_positions.aggregate(pipeline))
-
-    return result[0] if result else {
-        "winning_trades": 0,
-        "losing_trades": 0,
-        "max_win": 0,
-        "max_loss": 0,
-        "total_win": 0,
-        "total_loss": 0,
-        "total_pnl": 0,
-        "avg_winner": 0,
-        "avg_loser": 0,
-        "hit_rate": 0
-    }
+    return await response_cache.get_or_load(
+        CLOSED_POSITIONS,
+        "performance",
+        {"user_id": user_id, "from_date": from_date.isoformat(), "to_date": to_date.isoformat()},
+        lambda: get_performance(user_id, from_date, to_date)
+    )
+
+@router.get("/analytics")
+async def get_positions_analytics(
+    user_id: str = Query(..., description="User ID"),
+    from_date: datetime = Query(default=None, description="Start date, 30 days before to_date by default"),
+    to_date: datetime = Query(default=None, description="End date, the end of today by default"),
+    points: int = Query(default=ANALYTICS_POINTS, ge=10, le=5000, description="Points per returned series")
+):
+    """
+    Get equity curve, drawdown, rolling hit rate, holding times and PnL per symbol, strike and broker
+    """
+    if to_date is None:
+        # Whole days, so the cache key stays the same for the rest of the day
+        to_date = get_current_time().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    if from_date is None:
+        from_date = to_date - timedelta(days=30)
+
+    return await response_cache.get_or_load(
+        CLOSED_POSITIONS,
+        "analytics",
+        {"user_id": user_id, "from_date": from_date.isoformat(), "to_date": to_date.isoformat(), "points": points},
+        lambda: get_analytics(user_id, from_date, to_date, points)
+    )
@@ -0,0 +1,181 @@
+import asyncio
+from collections import OrderedDict
+from loguru import logger
+from app.config import (
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_LOOP_LAG,
+    ADMISSION_PRESSURE_IN_FLIGHT,
+    ADMISSION_PRESSURE_THRESHOLD,
+    RATE_LIMIT_IP_BURST,
+    RATE_LIMIT_IP_RATE,
+    RATE_LIMIT_MAXSIZE,
+    RATE_LIMIT_REDIS,
+    RATE_LIMIT_USER_BURST,
+    RATE_LIMIT_USER_RATE,
+    RATE_LIMIT_WS_CONNECT_BURST,
+    RATE_LIMIT_WS_CONNECT_RATE
+)
+from app.database.redis import async_redis_client
+from app.utils.ratelimit import TokenBucket
+
+# Take a token from the bucket at KEYS[1], ARGV rate per second and burst, returns the seconds to wait
+# Redis' clock keeps the refill consistent across workers
+TOKEN_BUCKET = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RateLimiter:
+    """Token buckets per client key, in process or shared between workers through Redis"""
+
+    def __init__(self, name, rate, burst, shared=RATE_LIMIT_REDIS, maxsize=RATE_LIMIT_MAXSIZE, prefix="ratelimit"):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.shared = shared
+        self.maxsize = maxsize
+        self.prefix = prefix
+        # key -> TokenBucket, least recently seen first
+        self.buckets = OrderedDict()
+        self.limited = 0
+        self._take = async_redis_client.client.register_script(TOKEN_BUCKET) if shared else None
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _take_local(self, key):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            # A forgotten client starts again with a full bucket
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.take()
+
+    async def take(self, key):
+        """Take a token for key, returns 0 or the seconds until the client may retry"""
+        if not self.enabled:
+            return 0.0
+        wait = None
+        if self.shared:
+            try:
+                wait = float(await self._take(keys=[f"{self.prefix}:{self.name}:{key}"], args=[self.rate, self.burst]))
+            except Exception as e:
+                # Keep limiting per worker rather than failing requests on a Redis outage
+                logger.warning(f"Shared rate limit check failed: {str(e)}")
+        if wait is None:
+            wait = self._take_local(key)
+        if wait > 0:
+            self.limited += 1
+        return wait
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "shared": self.shared,
+            "clients": len(self.buckets),
+            "limited": self.limited
+        }
+
+class AdmissionControl:
+    """Bounds concurrent REST requests, tighter while the realtime broadcaster is behind
+
+    Everything runs on one event loop, so a request that is admitted competes with the broadcaster for it.
+    Shedding early keeps that competition bounded instead of letting latency grow for everyone.
+    """
+
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, pressure_threshold=ADMISSION_PRESSURE_THRESHOLD,
+                 max_loop_lag=ADMISSION_MAX_LOOP_LAG, pressure_in_flight=ADMISSION_PRESSURE_IN_FLIGHT,
+                 lag_interval=0.05):
+        self.max_in_flight = max_in_flight
+        self.pressure_threshold = pressure_threshold
+        self.max_loop_lag = max_loop_lag
+        self.pressure_in_flight = pressure_in_flight
+        self.lag_interval = lag_interval
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        # seconds the event loop woke up late on the last sample
+        self.loop_lag = 0.0
+        # () -> float, how full the realtime queue is from 0 to 1, set by RealtimeService
+        self.pressure = None
+        self._task = None
+
+    async def _sample_lag(self):
+        """A busy loop delays broadcasts as much as requests, measure how late a short sleep returns"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, loop.time() - started - self.lag_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample_lag())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def under_pressure(self):
+        if self.max_loop_lag > 0 and self.loop_lag >= self.max_loop_lag:
+            return True
+        return self.pressure is not None and self.pressure() >= self.pressure_threshold
+
+    def limit(self):
+        """Requests allowed in flight right now, None for no limit"""
+        if self.max_in_flight <= 0:
+            return None
+        if self.under_pressure():
+            return min(self.max_in_flight, self.pressure_in_flight)
+        return self.max_in_flight
+
+    def try_enter(self):
+        """Claim an in-flight slot without waiting, False when the request should be shed"""
+        limit = self.limit()
+        if limit is not None and self.in_flight >= limit:
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def leave(self):
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit(),
+            "max_in_flight": self.max_in_flight,
+            "under_pressure": self.under_pressure(),
+            "loop_lag_ms": round(self.loop_lag * 1000, 3),
+            "realtime_queue": round(self.pressure(), 3) if self.pressure is not None else None,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "rate_limits": {limiter.name: limiter.stats() for limiter in (ip_limiter, user_limiter, connect_limiter)}
+        }
+
+admission = AdmissionControl()
+ip_limiter = RateLimiter("ip", RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+user_limiter = RateLimiter("user", RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST)
+connect_limiter = RateLimiter("ws_connect", RATE_LIMIT_WS_CONNECT_RATE, RATE_LIMIT_WS_CONNECT_BURST)
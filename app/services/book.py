@@ -0,0 +1,183 @@
+import math
+import numpy as np
+from loguru import logger
+
+# Numeric position fields kept as float64 columns, parsed once when an event arrives
+COLUMNS = ("quantity", "entry_price", "current_price", "unrealized_pnl")
+
+def _number(value):
+    """A finite float, None for anything else, NaN or inf would poison every sum over the column"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+class _Codes:
+    """Interns repeated strings such as user ids and symbols as small integer codes, 0 is unknown"""
+
+    def __init__(self):
+        self.codes = {None: 0}
+        self.values = [None]
+
+    def code(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class PositionBook:
+    """Open positions as NumPy columns with an identifier -> row index
+
+    Rows freed by deletes are zeroed and reused, so aggregates are plain sums over the
+    first `size` rows with no mask or JSON parsing involved.
+    """
+
+    def __init__(self, capacity=1024):
+        self.index = {}
+        self.free = []
+        self.size = 0
+        self.users = _Codes()
+        self.symbols = _Codes()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.live = np.zeros(capacity, dtype=bool)
+        self.user = np.zeros(capacity, dtype=np.int32)
+        self.symbol = np.zeros(capacity, dtype=np.int32)
+        for column in COLUMNS:
+            setattr(self, column, np.zeros(capacity, dtype=np.float64))
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for name in ("live", "user", "symbol") + COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.capacity] = column
+            setattr(self, name, grown)
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, identifier):
+        return str(identifier) in self.index
+
+    def load(self, positions: dict):
+        """Start over from a full {identifier: position} read of the positions hash"""
+        self.index = {}
+        self.free = []
+        self.size = 0
+        self.users = _Codes()
+        self.symbols = _Codes()
+        self._allocate(max(1024, 1 << max(len(positions) - 1, 0).bit_length()))
+        for identifier, position in positions.items():
+            if not isinstance(position, dict):
+                logger.warning(f"Skipping position {identifier}, expected an object, got {type(position).__name__}")
+                continue
+            self.upsert(identifier, position)
+
+    def upsert(self, identifier, fields: dict):
+        """Set the given fields of a position, adding it if it is new
+
+        A field that isn't a number is logged and left as it was, one bad row can't break the aggregates.
+        """
+        identifier = str(identifier)
+        row = self.index.get(identifier)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                if self.size == self.capacity:
+                    self._grow()
+                row = self.size
+                self.size += 1
+            self.index[identifier] = row
+            self.live[row] = True
+        for column in COLUMNS:
+            value = fields.get(column)
+            if value is None:
+                continue
+            number = _number(value)
+            if number is None:
+                logger.warning(f"Ignoring {column}={value!r} of position {identifier}, not a number")
+                continue
+            getattr(self, column)[row] = number
+        if fields.get("user_id") is not None:
+            self.user[row] = self.users.code(str(fields["user_id"]))
+        if fields.get("symbol") is not None:
+            self.symbol[row] = self.symbols.code(str(fields["symbol"]))
+
+    def remove(self, identifier):
+        row = self.index.pop(str(identifier), None)
+        if row is None:
+            return
+        self.live[row] = False
+        self.user[row] = 0
+        self.symbol[row] = 0
+        for column in COLUMNS:
+            getattr(self, column)[row] = 0.0
+        self.free.append(row)
+
+    def apply(self, event: dict):
+        """Apply one positions event published by RedisClient"""
+        data = event.get("data") or {}
+        identifier = data.get("identifier")
+        if identifier is None:
+            return
+        if event.get("action") == "delete":
+            self.remove(identifier)
+        else:
+            self.upsert(identifier, data)
+
+    def _mask(self, user_id=None, symbol=None):
+        mask = self.live[:self.size].copy()
+        if user_id is not None:
+            code = self.users.codes.get(str(user_id))
+            if code is None:
+                return np.zeros(self.size, dtype=bool)
+            mask &= self.user[:self.size] == code
+        if symbol is not None:
+            code = self.symbols.codes.get(str(symbol))
+            if code is None:
+                return np.zeros(self.size, dtype=bool)
+            mask &= self.symbol[:self.size] == code
+        return mask
+
+    def total_pnl(self, decimals=2) -> float:
+        """Sum of unrealized PnL, each position rounded first like the dashboard shows it"""
+        return float(np.round(self.unrealized_pnl[:self.size], decimals).sum())
+
+    def summary(self, user_id=None, symbol=None) -> dict:
+        """Count, PnL and gross exposure of the open positions matching the filters"""
+        mask = self._mask(user_id, symbol)
+        exposure = np.abs(self.quantity[:self.size] * self.current_price[:self.size])
+        return {
+            "positions": int(mask.sum()),
+            "unrealized_pnl": round(float(self.unrealized_pnl[:self.size][mask].sum()), 2),
+            "exposure": round(float(exposure[mask].sum()), 2)
+        }
+
+    def _group(self, codes, values, mask) -> dict:
+        codes = codes[:self.size][mask]
+        exposure = np.abs(self.quantity[:self.size] * self.current_price[:self.size])[mask]
+        counts = np.bincount(codes, minlength=len(values))
+        pnl = np.bincount(codes, weights=self.unrealized_pnl[:self.size][mask], minlength=len(values))
+        exposure = np.bincount(codes, weights=exposure, minlength=len(values))
+        return {
+            value: {
+                "positions": int(counts[code]),
+                "unrealized_pnl": round(float(pnl[code]), 2),
+                "exposure": round(float(exposure[code]), 2)
+            }
+            for code, value in enumerate(values)
+            if counts[code] and value is not None
+        }
+
+    def by_symbol(self, user_id=None) -> dict:
+        return self._group(self.symbol, self.symbols.values, self._mask(user_id=user_id))
+
+    def by_user(self, symbol=None) -> dict:
+        return self._group(self.user, self.users.values, self._mask(symbol=symbol))
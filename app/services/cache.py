@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from loguru import logger
+from app.config import (
+    CACHE_MAXSIZE,
+    CACHE_TTL,
+    CACHE_REDIS
+)
+from app.database.redis import async_redis_client
+from app.utils.codec import dumps, loads
+
+# Namespace for responses derived from closed positions
+CLOSED_POSITIONS = "closed_positions"
+
+# Drop every shared entry of a namespace, KEYS[1] is the namespace's key index set
+INVALIDATE = """
+local keys = redis.call('SMEMBERS', KEYS[1])
+for i = 1, #keys, 500 do
+    redis.call('DEL', unpack(keys, i, math.min(i + 499, #keys)))
+end
+redis.call('DEL', KEYS[1])
+return #keys
+"""
+
+class ResponseCache:
+    """In-process LRU with TTL, an optional shared Redis tier, and single-flight loading"""
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, shared=CACHE_REDIS, prefix="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.prefix = prefix
+        # key -> (namespace, expires_at, value)
+        self.entries = OrderedDict()
+        self.inflight = {}
+        # Bumped on invalidation so loads that started before it are not stored
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._invalidate = async_redis_client.client.register_script(INVALIDATE) if shared else None
+
+    def key(self, namespace, route, params):
+        query = urlencode(sorted((name, str(value)) for name, value in params.items() if value is not None))
+        return f"{namespace}:{route}?{query}"
+
+    def _get_local(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _set_local(self, namespace, key, value):
+        self.entries[key] = (namespace, time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def _get_shared(self, key):
+        try:
+            data = await async_redis_client.client.get(f"{self.prefix}:{key}")
+            return loads(data) if data else None
+        except Exception as e:
+            logger.warning(f"Shared cache read failed: {str(e)}")
+            return None
+
+    async def _set_shared(self, namespace, key, value):
+        try:
+            async with async_redis_client.client.pipeline(transaction=False) as pipe:
+                pipe.set(f"{self.prefix}:{key}", dumps(value), ex=int(self.ttl) or 1)
+                pipe.sadd(f"{self.prefix}:index:{namespace}", f"{self.prefix}:{key}")
+                pipe.expire(f"{self.prefix}:index:{namespace}", int(self.ttl) or 1)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Shared cache write failed: {str(e)}")
+
+    async def get_or_load(self, namespace, route, params, loader):
+        """Return the cached value for route and params, running loader once on a miss"""
+        key = self.key(namespace, route, params)
+        entry = self._get_local(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[2]
+
+        if key in self.inflight:
+            # Someone is already loading this key, wait for their result instead of querying again
+            self.coalesced += 1
+            return await asyncio.shield(self.inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        generation = self.generations.get(namespace, 0)
+        try:
+            value = await self._get_shared(key) if self.shared else None
+            if value is None:
+                self.misses += 1
+                value = await loader()
+                if self.shared and generation == self.generations.get(namespace, 0):
+                    await self._set_shared(namespace, key, value)
+            else:
+                self.hits += 1
+            if generation == self.generations.get(namespace, 0):
+                self._set_local(namespace, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting on it
+            future.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    async def invalidate(self, namespace):
+        """Drop every cached response of a namespace, locally and in the shared tier"""
+        self.generations[namespace] = self.generations.get(namespace, 0) + 1
+        for key in [key for key, entry in self.entries.items() if entry[0] == namespace]:
+            del self.entries[key]
+        if self.shared:
+            try:
+                await self._invalidate(keys=[f"{self.prefix}:index:{namespace}"])
+            except Exception as e:
+                logger.warning(f"Shared cache invalidation failed: {str(e)}")
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "inflight": len(self.inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced
+        }
+
+response_cache = ResponseCache()
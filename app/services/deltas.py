@@ -0,0 +1,58 @@
+import asyncio
+from app.utils.codec import Frame
+
+# WebSocket channel for per-position changes
+POSITION_DELTAS = "position_deltas"
+
+class PositionDeltas:
+    """Per-position changes merged over a conflation window, one frame per changed position per flush
+
+    Frames carry only the fields that changed, and a per-position seq that increases by one
+    with every frame. A client that sees a gap lost a frame to the slow consumer policy and
+    should reconnect for a fresh snapshot.
+    """
+
+    def __init__(self):
+        # identifier -> {"action", "data", "user_id", "symbol", "ticks"}
+        self.pending = {}
+        self.sequences = {}
+        self.changed = asyncio.Event()
+
+    def add(self, event: dict, position: dict):
+        """Merge one positions event, position is the full position for routing by user and symbol"""
+        data = event.get("data") or {}
+        identifier = data.get("identifier")
+        if identifier is None:
+            return
+        identifier = str(identifier)
+        delta = self.pending.get(identifier)
+        if event.get("action") == "delete":
+            # Earlier ticks do not matter once the position is gone
+            delta = {"action": "delete", "data": {}, "ticks": delta["ticks"] if delta else 0}
+        elif delta is None or delta["action"] == "delete":
+            delta = {"action": "update", "data": {}, "ticks": delta["ticks"] if delta else 0}
+        if delta["action"] == "update":
+            delta["data"].update((field, value) for field, value in data.items() if field != "identifier")
+        delta["ticks"] += 1
+        delta["user_id"] = position.get("user_id")
+        delta["symbol"] = position.get("symbol")
+        self.pending[identifier] = delta
+        self.changed.set()
+
+    def flush(self):
+        """Take the merged changes as (frame, user_id, symbol, ticks) and start a new window"""
+        pending, self.pending = self.pending, {}
+        self.changed.clear()
+        for identifier, delta in pending.items():
+            seq = self.sequences.get(identifier, 0) + 1
+            if delta["action"] == "delete":
+                self.sequences.pop(identifier, None)
+            else:
+                self.sequences[identifier] = seq
+            yield Frame({
+                "type": "position_delta",
+                "action": delta["action"],
+                "identifier": identifier,
+                "seq": seq,
+                "data": delta["data"]
+            }), delta["user_id"], delta["symbol"], delta["ticks"]
@@ -0,0 +1,218 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+
+# seconds, tuned for API and event pipeline latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        # Executor and watcher threads record too, keep updates atomic
+        self.lock = Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1.0):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def value(self, *labels):
+        return self.values.get(labels, 0.0)
+
+    def render(self):
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in self.values.items()
+        ]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # per-bucket counts (last one is +Inf), sum, count
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self, *labels):
+        """count, sum and the approximate p50/p99 upper bounds for one label set"""
+        state = self.values.get(labels)
+        if not state:
+            return {"count": 0, "sum": 0.0, "p50": None, "p99": None}
+        counts, total, count = state
+        return {"count": count, "sum": total, "p50": self._quantile(counts, count, 0.5),
+                "p99": self._quantile(counts, count, 0.99)}
+
+    def _quantile(self, counts, count, q):
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            if running >= q * count:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = self.header()
+        for labels, (counts, total, count) in self.values.items():
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                running += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.labelnames, labels, [f'le="{le}"'])
+                lines.append(f"{self.name}_bucket{bucket_labels} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Rate:
+    """Events per second over a sliding window of one second buckets, event loop only"""
+
+    def __init__(self, window=10):
+        self.window = window
+        # [second, count]
+        self.buckets = deque()
+
+    def mark(self):
+        second = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += 1
+        else:
+            self.buckets.append([second, 1])
+            self._trim(second)
+
+    def _trim(self, second):
+        while self.buckets and self.buckets[0][0] <= second - self.window:
+            self.buckets.popleft()
+
+    def per_second(self):
+        self._trim(int(time.monotonic()))
+        return sum(count for _, count in self.buckets) / self.window
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        lines = []
+        for metric in self.metrics.values():
+            with metric.lock:
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status", ("method", "route", "status")
+)
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route", ("method", "route")
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+)
+http_requests_rejected_total = registry.counter(
+    "http_requests_rejected_total", "HTTP requests turned away by admission control by reason", ("reason",)
+)
+
+# Realtime pipeline, publish timestamps come from the publisher's clock
+realtime_events_total = registry.counter(
+    "realtime_events_total", "Events consumed from Redis by channel", ("channel",)
+)
+realtime_receive_lag_seconds = registry.histogram(
+    "realtime_receive_lag_seconds", "Time from publish to receipt from Redis by channel", ("channel",)
+)
+realtime_processing_seconds = registry.histogram(
+    "realtime_processing_seconds", "Time spent handling one event by channel", ("channel",)
+)
+realtime_event_latency_seconds = registry.histogram(
+    "realtime_event_latency_seconds", "Time from publish until queued for the last WebSocket client by channel",
+    ("channel",)
+)
+realtime_queue_depth = registry.gauge(
+    "realtime_queue_depth", "Events received from Redis and waiting to be processed"
+)
+
+position_delta_ticks_total = registry.counter(
+    "position_delta_ticks_total", "Position changes merged into delta frames"
+)
+position_delta_frames_total = registry.counter(
+    "position_delta_frames_total", "Position delta frames broadcast after conflation"
+)
+
+# WebSocket fan-out
+websocket_fanout_seconds = registry.histogram(
+    "websocket_fanout_seconds", "Time to queue one broadcast for every recipient by channel", ("channel",)
+)
+websocket_connections = registry.gauge(
+    "websocket_connections", "Connected WebSocket clients"
+)
+websocket_messages_sent_total = registry.counter(
+    "websocket_messages_sent_total", "Messages written to WebSocket clients"
+)
+websocket_messages_dropped_total = registry.counter(
+    "websocket_messages_dropped_total", "Messages dropped from full WebSocket client queues"
+)
+websocket_send_failures_total = registry.counter(
+    "websocket_send_failures_total", "WebSocket sends that failed or timed out"
+)
+websocket_evictions_total = registry.counter(
+    "websocket_evictions_total", "WebSocket clients disconnected by the server"
+)
+websocket_connections_rejected_total = registry.counter(
+    "websocket_connections_rejected_total", "WebSocket connection attempts refused by reason", ("reason",)
+)
+websocket_reaped_total = registry.counter(
+    "websocket_reaped_total", "WebSocket clients closed by the idle sweep by reason", ("reason",)
+)
+websocket_buffered_bytes = registry.gauge(
+    "websocket_buffered_bytes", "Outbound bytes queued across WebSocket clients"
+)
@@ -1,72 +1,447 @@
-import json
 import asyncio
+import time
+from collections import defaultdict
+from redis.exceptions import ConnectionError as RedisConnectionError, LockError, TimeoutError as RedisTimeoutError
 from loguru import logger
-from app.database.redis import redis_client
+from app.config import (
+    PERFORMANCE_ROLLUPS,
+    POSITION_DELTA_WINDOW,
+    REALTIME_READ_COUNT,
+    REALTIME_SOURCE,
+    REALTIME_QUEUE_SIZE,
+    REALTIME_POLL_TIMEOUT,
+    REALTIME_RECONNECT_DELAY,
+    REALTIME_RECONNECT_MAX_DELAY,
+    REPLAY_MAX_EVENTS,
+    SNAPSHOT_ON_CONNECT,
+    SNAPSHOT_SCAN,
+    STATS_BROADCAST_INTERVAL,
+    STATS_LEADER_TTL,
+    STATS_RESYNC_INTERVAL
+)
+from app.database.redis import async_redis_client
+from app.services.admission import admission
+from app.services.book import PositionBook
+from app.services.cache import CLOSED_POSITIONS, response_cache
+from app.services.deltas import POSITION_DELTAS, PositionDeltas
+from app.services.metrics import (
+    Rate,
+    position_delta_frames_total,
+    position_delta_ticks_total,
+    realtime_event_latency_seconds,
+    realtime_events_total,
+    realtime_processing_seconds,
+    realtime_queue_depth,
+    realtime_receive_lag_seconds,
+    websocket_fanout_seconds,
+    websocket_messages_dropped_total,
+    websocket_messages_sent_total,
+    websocket_send_failures_total
+)
+from app.services.rollups import rollup_watcher
+from app.services.snapshot import Snapshot
+from app.services.stats import PositionStats
 from app.services.websocket import manager
+from app.utils.backoff import backoff_delay
+from app.utils.codec import Frame, loads
+
+# The stats leader publishes every snapshot here, each worker relays it to its own clients
+STATS_CHANNEL = "stats:web"
+STATS_LEADER_LOCK = "lock:stats:web"
+
+def _latency(histogram, channel):
+    """Approximate p50/p99 in milliseconds, as histogram bucket upper bounds"""
+    snapshot = histogram.snapshot(channel)
+    quantiles = {
+        name: None if snapshot[name] in (None, float("inf")) else round(snapshot[name] * 1000, 3)
+        for name in ("p50", "p99")
+    }
+    return {"count": snapshot["count"], **quantiles}
 
 class RealtimeService:
-    def __init__(self):
-        self.pubsub = redis_client.get_pubsub()
-        self.channels = ["orders", "positions", "trades", "signals"]
+    def __init__(self, queue_size=REALTIME_QUEUE_SIZE):
+        self.pubsub = None
+        # Stream position, kept across reconnects so nothing published meanwhile is lost
+        self.last_event_id = None
+        # Consecutive failed connection attempts, for the reconnect backoff
+        self.attempt = 0
+        self.channels = ["orders", "positions", "trades", "signals", STATS_CHANNEL]
         self.running = False
+        # Bounded so a slow consumer stops the reader, and Redis buffers the backlog
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Typed copy of the open positions for aggregates, kept by every worker
+        self.book = PositionBook()
+        self.stats = PositionStats(self.book)
+        self.stats_changed = asyncio.Event()
+        # Only the worker holding the leader lock publishes stats, the rest relay its snapshots
+        self.leader = False
+        self.leader_lock = async_redis_client.client.lock(
+            STATS_LEADER_LOCK, timeout=STATS_LEADER_TTL, thread_local=False
+        )
+        # Publish time of the oldest positions event not yet broadcast
+        self.stats_pending_since = None
+        self.snapshot = Snapshot()
+        self.deltas = PositionDeltas()
+        self.rates = defaultdict(Rate)
+        self._tasks = []
+        if REALTIME_SOURCE == "stream":
+            manager.history = self.events_after
+        if SNAPSHOT_ON_CONNECT:
+            manager.snapshot = self.snapshot.frame
+        # REST requests are cut back while events wait here, broadcasting comes first
+        admission.pressure = self.pressure
 
-    def get_position_stats(self):
-        positions = redis_client.get_all_hashes("positions")
-        print(positions)
-        stats = {
-            "total_positions": len(positions),
-            "total_pnl": sum(round(float(position["unrealized_pnl"]), 2) for position in positions)
-        }
-        redis_client.set_hash("stats", "web", stats)
-        return stats
+    async def _resync_stats(self):
+        """Rebuild position stats from a full read of the positions hash"""
+        positions = await async_redis_client.get_all_hashes_by_key("positions")
+        self.stats.load(positions)
 
-    async def start_listening(self):
-        """Start listening to Redis channels"""
-        self.running = True
-        self.pubsub.subscribe(*self.channels)
-        
+    def _set_leader(self, leader):
+        """Stats and the rollup watcher run on the leader only, so rollups are rebuilt by one worker"""
+        self.leader = leader
+        if PERFORMANCE_ROLLUPS:
+            if leader:
+                rollup_watcher.start()
+            else:
+                rollup_watcher.stop()
+
+    async def _elect(self):
+        """Take or renew the stats leader lock every third of its TTL"""
+        while self.running:
+            try:
+                if self.leader:
+                    await self.leader_lock.reacquire()
+                elif await self.leader_lock.acquire(blocking=False):
+                    logger.info("Became stats leader")
+                    self._set_leader(True)
+                    # Start from a full read in case events were missed before taking over
+                    self.stats.needs_resync = True
+                    self.stats_changed.set()
+            except LockError as e:
+                logger.warning(f"Lost stats leadership: {str(e)}")
+                self._set_leader(False)
+            except Exception as e:
+                # Step down, another worker takes over once the lock expires
+                logger.warning(f"Stats leader election failed: {str(e)}")
+                self._set_leader(False)
+            await asyncio.sleep(STATS_LEADER_TTL / 3)
+
+    async def _resign(self):
+        """Release the leader lock so another worker takes over without waiting for the TTL"""
+        if not self.leader:
+            return
+        self._set_leader(False)
+        try:
+            await self.leader_lock.release()
+        except Exception as e:
+            logger.debug(f"Error releasing stats leader lock: {str(e)}")
+
+    async def _flush_stats(self):
+        """Persist and publish position stats, at most once per STATS_BROADCAST_INTERVAL"""
+        loop = asyncio.get_running_loop()
+        next_resync = loop.time()
+        while self.running:
+            try:
+                await asyncio.wait_for(self.stats_changed.wait(), timeout=max(0.0, next_resync - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self.stats_changed.clear()
+            if not self.leader:
+                next_resync = loop.time() + STATS_RESYNC_INTERVAL
+                continue
+            try:
+                if self.stats.needs_resync or loop.time() >= next_resync:
+                    await self._resync_stats()
+                    next_resync = loop.time() + STATS_RESYNC_INTERVAL
+                if self.stats.dirty:
+                    self.stats.dirty = False
+                    stats = self.stats.snapshot()
+                    await async_redis_client.set_hash("stats", "web", stats)
+                    await async_redis_client.publish_event(
+                        STATS_CHANNEL, self.stats.last_action, stats, pending_since=self.stats_pending_since
+                    )
+                    self.stats_pending_since = None
+            except Exception as e:
+                logger.error(f"Error publishing position stats: {str(e)}")
+            # Coalesce bursts: everything that arrives meanwhile goes out in the next flush
+            await asyncio.sleep(STATS_BROADCAST_INTERVAL)
+
+    async def _flush_deltas(self):
+        """Broadcast merged per-position changes, at most once per POSITION_DELTA_WINDOW"""
+        while self.running:
+            await self.deltas.changed.wait()
+            # Ticks that arrive within the window are merged into the same frame
+            await asyncio.sleep(POSITION_DELTA_WINDOW)
+            for frame, user_id, symbol, ticks in self.deltas.flush():
+                position_delta_ticks_total.inc(amount=ticks)
+                position_delta_frames_total.inc()
+                try:
+                    await manager.broadcast(frame, POSITION_DELTAS, user_id, symbol)
+                except Exception as e:
+                    logger.error(f"Error broadcasting position delta: {str(e)}")
+
+    async def _subscribe(self):
+        """Open a fresh pub/sub connection and subscribe to all channels"""
+        self.pubsub = async_redis_client.get_pubsub()
+        await self.pubsub.subscribe(*self.channels)
         logger.info(f"Started listening to channels: {self.channels}")
-        
+
+    async def _close(self):
+        """Close the pub/sub connection, ignoring errors from a dead socket"""
+        try:
+            if self.pubsub is not None:
+                await self.pubsub.aclose()
+        except Exception as e:
+            logger.debug(f"Error closing Redis pub/sub connection: {str(e)}")
+        self.pubsub = None
+
+    async def _load_snapshot(self):
+        """Warm the connect snapshot, events after last_event_id are applied on top
+
+        Only connection errors propagate to the reconnect loop. Anything else, like a document that
+        doesn't decode, is logged and events keep flowing without the snapshot until the next reconnect.
+        """
+        try:
+            positions, stats, entries = await asyncio.gather(
+                async_redis_client.get_all_hashes_by_key("positions"),
+                async_redis_client.get_hash("stats", "web"),
+                async_redis_client.recent_events(self.last_event_id, SNAPSHOT_SCAN)
+            )
+            signals = [
+                self._broadcast(channel, loads(raw), event_id)[0].payload
+                for event_id, channel, raw in entries
+                if channel == "signals"
+            ]
+            self.snapshot.load(positions, stats, signals[-self.snapshot.signals.maxlen:], self.last_event_id)
+            self.stats.load(positions)
+        except (RedisConnectionError, RedisTimeoutError, OSError):
+            raise
+        except Exception as e:
+            logger.error(f"Error loading the realtime snapshot: {str(e)}")
+
+    async def _read_pubsub(self):
+        await self._subscribe()
+        # Events published while disconnected are lost, start the snapshot over
+        await self._load_snapshot()
+        self.attempt = 0
+        while self.running:
+            # Returns as soon as a message arrives, the timeout only bounds idle waits
+            message = await self.pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=REALTIME_POLL_TIMEOUT
+            )
+            if message is None or message["type"] != "message":
+                continue
+            # Blocks while the queue is full instead of buffering without bound
+            await self.queue.put((message["channel"].decode("utf-8"), message["data"], time.time(), None))
+
+    async def _read_stream(self):
+        if self.last_event_id is None:
+            self.last_event_id = await async_redis_client.last_event_id()
+        if not self.snapshot.ready:
+            await self._load_snapshot()
+        logger.info(f"Reading event stream after {self.last_event_id}")
+        self.attempt = 0
+        while self.running:
+            # Returns as soon as entries arrive, the block timeout only bounds idle waits
+            events = await async_redis_client.read_events(self.last_event_id, REALTIME_READ_COUNT, REALTIME_POLL_TIMEOUT)
+            received_at = time.time()
+            for event_id, channel, raw in events:
+                if channel in self.channels:
+                    await self.queue.put((channel, raw, received_at, event_id))
+                self.last_event_id = event_id
+
+    async def _read_messages(self):
+        """Read events from Redis into the queue, reconnecting on connection loss"""
         while self.running:
             try:
-                message = self.pubsub.get_message()
-                if message and message['type'] == 'message':
-                    channel = message['channel'].decode('utf-8')
-                    data = json.loads(message['data'].decode('utf-8'))
-
-                    # Log the message
-                    logger.info(f"Received event from channel '{channel}': {data}")
-
-                    if channel == "positions":
-                        stats = self.get_position_stats()
-                        broadcast_message = json.dumps({
-                            "type": channel,
-                            "action": data["action"],
-                            "data": stats
-                        })
-                        await manager.broadcast(broadcast_message)
-
-                    if channel == "signals":
-                        # Format the message for broadcasting
-                        broadcast_message = json.dumps({
-                            "type": channel,
-                            "action": data["action"],
-                            "category": data["category"],
-                            "data": data["data"]
-                        })
-                        
-                        logger.info(f"Broadcasting {data['action']} event for {channel}")
-                        await manager.broadcast(broadcast_message)
-                    
+                if REALTIME_SOURCE == "stream":
+                    await self._read_stream()
+                else:
+                    await self._read_pubsub()
+            except (RedisConnectionError, RedisTimeoutError, OSError) as e:
+                await self._reconnect(f"Lost Redis connection ({str(e)})")
+            except Exception as e:
+                # A reader that died here would stop every broadcast without a trace, start over instead
+                logger.exception(f"Realtime reader failed: {str(e)}")
+                await self._reconnect("Realtime reader failed")
+
+    async def _reconnect(self, reason):
+        """Close the connection and wait out the jittered backoff before the next attempt"""
+        self.attempt += 1
+        delay = backoff_delay(self.attempt - 1, REALTIME_RECONNECT_DELAY, REALTIME_RECONNECT_MAX_DELAY)
+        logger.warning(f"{reason}, reconnecting in {delay:.1f}s")
+        if REALTIME_SOURCE != "stream":
+            # Events published while disconnected are lost, rebuild from the hash
+            self.stats.needs_resync = True
+            self.stats_changed.set()
+        await self._close()
+        await asyncio.sleep(delay)
+
+    async def _process_messages(self):
+        """Dispatch queued messages one at a time"""
+        while self.running:
+            channel, raw, received_at, event_id = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                data = loads(raw)
+                published_at = data.get("published_at")
+                if published_at:
+                    realtime_receive_lag_seconds.observe(max(0.0, received_at - published_at), channel)
+                await self.handle_message(channel, data, event_id)
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
-                await asyncio.sleep(1)
+            finally:
+                self.queue.task_done()
+                realtime_processing_seconds.observe(time.perf_counter() - started, channel)
+                realtime_events_total.inc(channel)
+                realtime_queue_depth.set(value=self.queue.qsize())
+                self.rates[channel].mark()
+
+    def _broadcast(self, channel, data, event_id=None):
+        """The frame an event goes out as and its route, (frame, channel, user_id, symbol, key) or None"""
+        payload = data.get("data")
+        user_id = payload.get("user_id") if isinstance(payload, dict) else None
+        symbol = payload.get("symbol") if isinstance(payload, dict) else None
+        key = None
+
+        if channel == STATS_CHANNEL:
+            message = {
+                "type": "positions",
+                "action": data["action"],
+                "data": payload
+            }
+            # Stats are full snapshots, so a newer one replaces a queued one
+            channel = key = "positions"
+        elif channel == "signals":
+            message = {
+                "type": channel,
+                "action": data["action"],
+                "category": data["category"],
+                "data": payload
+            }
+        elif channel in ("orders", "trades"):
+            message = {
+                "type": channel,
+                "action": data["action"],
+                "data": payload
+            }
+        else:
+            return None
+
+        if event_id is not None:
+            # Clients send back the last id they saw to resume after a reconnect
+            message["id"] = event_id
+        return Frame(message), channel, user_id, symbol, key
+
+    async def handle_message(self, channel, data, event_id=None):
+        """Handle a single decoded event from Redis"""
+        # Log the message
+        logger.info(f"Received event from channel '{channel}': {data}")
+
+        published_at = data.get("published_at")
+
+        if channel == "positions":
+            # The delta routes by the full position, a delete event carries it and removes it from the snapshot
+            position = data.get("data") or {}
+            self.snapshot.apply_position(data, event_id)
+            if manager.has_subscribers(POSITION_DELTAS):
+                self.deltas.add(data, self.snapshot.positions.get(str(position.get("identifier")), position))
+            self.stats.apply(data)
+            if self.leader and (self.stats.dirty or self.stats.needs_resync):
+                if self.stats_pending_since is None:
+                    self.stats_pending_since = published_at
+                self.stats_changed.set()
+
+        # A position leaving the open book, or any trade, means closed positions changed
+        if channel == "trades" or (channel == "positions" and data.get("action") == "delete"):
+            await response_cache.invalidate(CLOSED_POSITIONS)
+
+        # Positions events reach clients through the stats snapshots
+        broadcast = self._broadcast(channel, data, event_id)
+        if broadcast is None:
+            return
+        frame, target, user_id, symbol, key = broadcast
+        if channel == STATS_CHANNEL:
+            self.snapshot.apply_stats(frame.payload["data"], event_id)
+        elif channel == "signals":
+            self.snapshot.add_signal(frame.payload, event_id)
+        if manager.has_subscribers(target):
+            if channel == "signals":
+                logger.info(f"Broadcasting {data['action']} event for {channel}")
+            await manager.broadcast(frame, target, user_id, symbol, key=key)
+
+        # Stats snapshots are measured from the oldest positions event they cover
+        started = data.get("pending_since") if channel == STATS_CHANNEL else published_at
+        if started:
+            realtime_event_latency_seconds.observe(time.time() - started, target)
+
+    async def events_after(self, last_event_id):
+        """Frames for the events after last_event_id, oldest first, and whether none are missing"""
+        entries, complete = await async_redis_client.events_after(last_event_id, REPLAY_MAX_EVENTS)
+        events = []
+        for event_id, channel, raw in entries:
+            if channel not in self.channels:
                 continue
-                
-            await asyncio.sleep(0.1) # Prevent CPU overload
+            broadcast = self._broadcast(channel, loads(raw), event_id)
+            if broadcast is not None:
+                events.append((event_id, *broadcast))
+        return events, complete
+
+    def pressure(self) -> float:
+        """How full the event queue is, from 0 to 1"""
+        return self.queue.qsize() / self.queue.maxsize if self.queue.maxsize else 0.0
+
+    def metrics(self) -> dict:
+        """Per-channel pipeline latencies and rates, for the debug route"""
+        channels = {}
+        for channel in self.channels:
+            channels[channel] = {
+                "events": int(realtime_events_total.value(channel)),
+                "events_per_second": round(self.rates[channel].per_second(), 2),
+                "receive_lag_ms": _latency(realtime_receive_lag_seconds, channel),
+                "processing_ms": _latency(realtime_processing_seconds, channel),
+                "fanout_ms": _latency(websocket_fanout_seconds, channel),
+                "end_to_end_ms": _latency(realtime_event_latency_seconds, channel)
+            }
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "connections": len(manager.active_connections),
+            "sent": int(websocket_messages_sent_total.value()),
+            "dropped": int(websocket_messages_dropped_total.value()),
+            "send_failures": int(websocket_send_failures_total.value()),
+            "evicted": manager.evicted,
+            "stats_leader": self.leader,
+            "channels": channels
+        }
+
+    async def start_listening(self):
+        """Start listening to Redis channels"""
+        self.running = True
+        self._tasks = [
+            asyncio.create_task(self._elect()),
+            asyncio.create_task(self._read_messages()),
+            asyncio.create_task(self._process_messages()),
+            asyncio.create_task(self._flush_stats()),
+            asyncio.create_task(self._flush_deltas())
+        ]
+        for task in self._tasks:
+            task.add_done_callback(self._task_done)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _task_done(self, task):
+        """Log a task that ended with an error, gather(return_exceptions=True) would swallow it"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.opt(exception=task.exception()).error(f"Realtime task {task.get_coro().__qualname__} failed")
 
     async def stop_listening(self):
         """Stop listening to Redis channels"""
         self.running = False
-        self.pubsub.unsubscribe()
-        logger.info("Stopped listening to Redis channels") 
\ No newline at end of file
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._resign()
+        await self._close()
+        logger.info("Stopped listening to Redis channels")
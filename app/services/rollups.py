@@ -0,0 +1,466 @@
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+from loguru import logger
+from pymongo.errors import OperationFailure, PyMongoError
+from app.config import PERFORMANCE_ROLLUPS
+from app.database.mongodb import async_db, db, ensure_indexes
+from app.utils.datetime import UTC, get_current_time
+
+rollup_logger = logger.bind(name="Rollups")
+
+ROLLUPS = "performance_rollups"
+ROLLUP_STATE = "performance_rollups_state"
+HOUR = "hour"
+DAY = "day"
+
+EMPTY_PERFORMANCE = {
+    "winning_trades": 0,
+    "losing_trades": 0,
+    "max_win": 0,
+    "max_loss": 0,
+    "total_win": 0,
+    "total_loss": 0,
+    "total_pnl": 0,
+    "avg_winner": 0,
+    "avg_loser": 0,
+    "hit_rate": 0
+}
+
+def performance_pipeline(user_id, from_date, to_date):
+    """Aggregate a user's closed positions in [from_date, to_date) straight from the raw trades"""
+    return [
+        {
+            "$match": {
+                "user_id": user_id,
+                "timestamp": {
+                    "$gte": from_date,
+                    "$lt": to_date
+                }
+            }
+        },
+        {
+            "$addFields": {
+                "trade_result": {
+                    "$cond": [
+                        {"$gt": ["$unrealized_pnl", 0]},
+                        "win",
+                        "loss"
+                    ]
+                }
+            }
+        },
+        {
+            "$group": {
+                "_id": "$trade_result",
+                "count": {"$sum": 1},
+                "max_pnl": {"$max": "$unrealized_pnl"},
+                "min_pnl": {"$min": "$unrealized_pnl"},
+                "total_pnl": {"$sum": "$unrealized_pnl"}
+            }
+        },
+        {
+            "$group": {
+                "_id": None,
+                "winning_trades": {
+                    "$sum": {
+                        "$cond": [{"$eq": ["$_id", "win"]}, "$count", 0]
+                    }
+                },
+                "losing_trades": {
+                    "$sum": {
+                        "$cond": [{"$eq": ["$_id", "loss"]}, "$count", 0]
+                    }
+                },
+                "max_win": {
+                    "$max": {
+                        "$cond": [{"$eq": ["$_id", "win"]}, "$max_pnl", None]
+                    }
+                },
+                "max_loss": {
+                    "$min": {
+                        "$cond": [{"$eq": ["$_id", "loss"]}, "$min_pnl", None]
+                    }
+                },
+                "total_win": {
+                    "$sum": {
+                        "$cond": [{"$eq": ["$_id", "win"]}, "$total_pnl", 0]
+                    }
+                },
+                "total_loss": {
+                    "$sum": {
+                        "$cond": [{"$eq": ["$_id", "loss"]}, "$total_pnl", 0]
+                    }
+                },
+                "total_pnl": {"$sum": "$total_pnl"}
+            }
+        },
+        {
+            "$addFields": {
+                "avg_winner": {
+                    "$cond": [
+                        {"$gt": ["$winning_trades", 0]},
+                        {"$round": [{"$divide": ["$total_win", "$winning_trades"]}, 2]},
+                        0
+                    ]
+                },
+                "avg_loser": {
+                    "$cond": [
+                        {"$gt": ["$losing_trades", 0]},
+                        {"$round": [{"$divide": ["$total_loss", "$losing_trades"]}, 2]},
+                        0
+                    ]
+                },
+                "total_win": {"$round": ["$total_win", 2]},
+                "total_loss": {"$round": ["$total_loss", 2]},
+                "total_pnl": {"$round": ["$total_pnl", 2]},
+                "max_win": {"$round": ["$max_win", 2]},
+                "max_loss": {"$round": ["$max_loss", 2]},
+                "hit_rate": {
+                    "$cond": [
+                        {"$gt": [{"$add": ["$winning_trades", "$losing_trades"]}, 0]},
+                        {"$round": [
+                            {"$multiply": [
+                                {"$divide": [
+                                    "$winning_trades",
+                                    {"$add": ["$winning_trades", "$losing_trades"]}
+                                ]},
+                                100
+                            ]},
+                            2
+                        ]},
+                        0
+                    ]
+                }
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "winning_trades": 1,
+                "losing_trades": 1,
+                "max_win": 1,
+                "max_loss": 1,
+                "total_win": 1,
+                "total_loss": 1,
+                "total_pnl": 1,
+                "avg_winner": 1,
+                "avg_loser": 1,
+                "hit_rate": 1
+            }
+        }
+    ]
+
+# Win/loss split used by every rollup stage, identical to performance_pipeline
+_IS_WIN = {"$gt": ["$unrealized_pnl", 0]}
+
+_BUCKET_FIELDS = {
+    "win_count": {"$sum": {"$cond": [_IS_WIN, 1, 0]}},
+    "loss_count": {"$sum": {"$cond": [_IS_WIN, 0, 1]}},
+    "win_total": {"$sum": {"$cond": [_IS_WIN, "$unrealized_pnl", 0]}},
+    "loss_total": {"$sum": {"$cond": [_IS_WIN, 0, "$unrealized_pnl"]}},
+    "max_win": {"$max": {"$cond": [_IS_WIN, "$unrealized_pnl", None]}},
+    "min_loss": {"$min": {"$cond": [_IS_WIN, None, "$unrealized_pnl"]}}
+}
+
+def _hour_of(field):
+    return {"$dateFromParts": {
+        "year": {"$year": field},
+        "month": {"$month": field},
+        "day": {"$dayOfMonth": field},
+        "hour": {"$hour": field}
+    }}
+
+def _day_of(field):
+    return {"$dateFromParts": {
+        "year": {"$year": field},
+        "month": {"$month": field},
+        "day": {"$dayOfMonth": field}
+    }}
+
+def _trade_buckets_pipeline(match, merge=True):
+    """Group raw trades into hourly buckets, merged into the rollup collection when merge is set"""
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "bucket": _hour_of("$timestamp")},
+            **_BUCKET_FIELDS
+        }},
+        {"$project": {"_id": 0, "user_id": "$_id.user_id", "granularity": HOUR, "bucket": "$_id.bucket",
+                      **{field: 1 for field in _BUCKET_FIELDS}}}
+    ]
+    if merge:
+        pipeline.append({"$merge": {"into": ROLLUPS, "on": ["user_id", "granularity", "bucket"],
+                                    "whenMatched": "replace", "whenNotMatched": "insert"}})
+    return pipeline
+
+def _day_buckets_pipeline(match):
+    """Fold hourly buckets into daily buckets"""
+    return [
+        {"$match": {"granularity": HOUR, **match}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "bucket": _day_of("$bucket")},
+            "win_count": {"$sum": "$win_count"},
+            "loss_count": {"$sum": "$loss_count"},
+            "win_total": {"$sum": "$win_total"},
+            "loss_total": {"$sum": "$loss_total"},
+            "max_win": {"$max": "$max_win"},
+            "min_loss": {"$min": "$min_loss"}
+        }},
+        {"$project": {"_id": 0, "user_id": "$_id.user_id", "granularity": DAY, "bucket": "$_id.bucket",
+                      **{field: 1 for field in _BUCKET_FIELDS}}},
+        {"$merge": {"into": ROLLUPS, "on": ["user_id", "granularity", "bucket"],
+                    "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+def _to_utc(value):
+    return value.astimezone(UTC).replace(tzinfo=None) if value.tzinfo else value
+
+def _floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _ceil_hour(value):
+    floor = _floor_hour(value)
+    return floor if floor == value else floor + timedelta(hours=1)
+
+def _floor_day(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _ceil_day(value):
+    floor = _floor_day(value)
+    return floor if floor == value else floor + timedelta(days=1)
+
+def split_range(from_date, to_date):
+    """Cover [from_date, to_date) with raw slivers, hourly buckets and daily buckets"""
+    raw, hours, days = [], [], []
+    first_hour, last_hour = _ceil_hour(from_date), _floor_hour(to_date)
+    if first_hour >= last_hour:
+        return [(from_date, to_date)], hours, days
+    if from_date < first_hour:
+        raw.append((from_date, first_hour))
+    if last_hour < to_date:
+        raw.append((last_hour, to_date))
+    first_day, last_day = _ceil_day(first_hour), _floor_day(last_hour)
+    if first_day < last_day:
+        days.append((first_day, last_day))
+        hours += [(start, end) for start, end in ((first_hour, first_day), (last_day, last_hour)) if start < end]
+    else:
+        hours.append((first_hour, last_hour))
+    return raw, hours, days
+
+def summarize(buckets):
+    """Merge bucket partials into the shape returned by performance_pipeline"""
+    winning = sum(bucket["win_count"] for bucket in buckets)
+    losing = sum(bucket["loss_count"] for bucket in buckets)
+    if winning + losing == 0:
+        return dict(EMPTY_PERFORMANCE)
+    total_win = sum(bucket["win_total"] for bucket in buckets)
+    total_loss = sum(bucket["loss_total"] for bucket in buckets)
+    wins = [bucket["max_win"] for bucket in buckets if bucket.get("max_win") is not None]
+    losses = [bucket["min_loss"] for bucket in buckets if bucket.get("min_loss") is not None]
+    return {
+        "winning_trades": winning,
+        "losing_trades": losing,
+        "max_win": round(max(wins), 2) if wins else None,
+        "max_loss": round(min(losses), 2) if losses else None,
+        "total_win": round(total_win, 2),
+        "total_loss": round(total_loss, 2),
+        "total_pnl": round(total_win + total_loss, 2),
+        "avg_winner": round(total_win / winning, 2) if winning else 0,
+        "avg_loser": round(total_loss / losing, 2) if losing else 0,
+        "hit_rate": round(winning / (winning + losing) * 100, 2)
+    }
+
+def _rollup_queries(user_id, from_date, to_date):
+    """Rollup bucket filter (or None) and raw sliver pipelines covering [from_date, to_date)"""
+    raw, hours, days = split_range(_to_utc(from_date), _to_utc(to_date))
+    bucket_query = None
+    if hours or days:
+        bucket_query = {"user_id": user_id, "$or": [
+            {"granularity": granularity, "bucket": {"$gte": start, "$lt": end}}
+            for granularity, ranges in ((HOUR, hours), (DAY, days))
+            for start, end in ranges
+        ]}
+    slivers = [
+        _trade_buckets_pipeline({"user_id": user_id, "timestamp": {"$gte": start, "$lt": end}}, merge=False)
+        for start, end in raw
+    ]
+    return bucket_query, slivers
+
+async def get_performance(user_id, from_date, to_date):
+    """Performance stats for [from_date, to_date), merged from rollups when they are live"""
+    if not PERFORMANCE_ROLLUPS or not await rollup_watcher.live():
+        result = await async_db.closed_positions.aggregate(performance_pipeline(user_id, from_date, to_date))
+        return result[0] if result else dict(EMPTY_PERFORMANCE)
+
+    bucket_query, slivers = _rollup_queries(user_id, from_date, to_date)
+    buckets = await async_db[ROLLUPS].find(bucket_query, {"_id": 0}) if bucket_query else []
+    for pipeline in slivers:
+        buckets += await async_db.closed_positions.aggregate(pipeline)
+    return summarize(buckets)
+
+def refresh_bucket(user_id, timestamp):
+    """Recompute the hourly and daily buckets holding one trade, safe to repeat
+
+    Deleted trades are not seen by the watcher, run rebuild after removing closed positions.
+    """
+    hour = _floor_hour(_to_utc(timestamp))
+    day = _floor_day(hour)
+    db[ROLLUPS].delete_many({"user_id": user_id, "$or": [
+        {"granularity": HOUR, "bucket": hour},
+        {"granularity": DAY, "bucket": day}
+    ]})
+    db.closed_positions.aggregate(_trade_buckets_pipeline({
+        "user_id": user_id,
+        "timestamp": {"$gte": hour, "$lt": hour + timedelta(hours=1)}
+    }))
+    db[ROLLUPS].aggregate(_day_buckets_pipeline({
+        "user_id": user_id,
+        "bucket": {"$gte": day, "$lt": day + timedelta(days=1)}
+    }))
+
+def rebuild(user_id=None):
+    """Rebuild every rollup bucket, or one user's, from closed_positions"""
+    # $merge needs the unique index on its "on" fields
+    ensure_indexes(db, [ROLLUPS])
+    match = {"user_id": user_id} if user_id else {}
+    db[ROLLUPS].delete_many(match)
+    db.closed_positions.aggregate(_trade_buckets_pipeline({**match, "timestamp": {"$type": "date"}}))
+    db[ROLLUPS].aggregate(_day_buckets_pipeline(match))
+    rollup_logger.info(f"Rebuilt performance rollups for {user_id or 'all users'}")
+
+class RollupWatcher:
+    """Keeps rollups current by refreshing the buckets touched by each closed_positions change
+
+    Only the leader worker runs it, every worker reads from the rollup state whether the collection is complete.
+    """
+
+    def __init__(self, max_await_ms=1000, state_ttl=5.0):
+        self.max_await_ms = max_await_ms
+        # seconds a worker trusts its last read of built_at
+        self.state_ttl = state_ttl
+        self._stopped = threading.Event()
+        self._thread = None
+        self._live = False
+        self._checked_at = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive() and not self._stopped.is_set():
+            return
+        # A fresh event per thread, so one still winding down after stop() can't be revived
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stopped,), name="rollup-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    async def live(self):
+        """Whether rollups are complete, built_at is only set while no rebuild is running"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.state_ttl:
+            state = await async_db[ROLLUP_STATE].find_one({"_id": "closed_positions"}, {"built_at": 1})
+            self._live = bool(state and state.get("built_at"))
+            self._checked_at = now
+        return self._live
+
+    def _watch(self, resume_token):
+        return db.closed_positions.watch(
+            [{"$match": {"operationType": {"$in": ["insert", "replace", "update"]}}}],
+            full_document="updateLookup",
+            resume_after=resume_token,
+            max_await_time_ms=self.max_await_ms
+        )
+
+    def _run(self, stopped):
+        try:
+            state = db[ROLLUP_STATE].find_one({"_id": "closed_positions"}) or {}
+            token = state.get("resume_token")
+            try:
+                stream = self._watch(token)
+            except OperationFailure:
+                if token is None:
+                    raise
+                rollup_logger.warning("Rollup resume token is no longer valid, rebuilding")
+                token = None
+                stream = self._watch(None)
+            with stream:
+                if token is None:
+                    # Other workers use the raw pipeline until the rebuild is done
+                    db[ROLLUP_STATE].update_one({"_id": "closed_positions"}, {"$unset": {"built_at": ""}})
+                    # The stream is already open, so changes made during the rebuild are replayed after it
+                    rebuild()
+                    # Saved now rather than after the first change, a restart resumes instead of rebuilding again
+                    db[ROLLUP_STATE].update_one({"_id": "closed_positions"}, {"$set": {
+                        "built_at": get_current_time(),
+                        "resume_token": stream.resume_token
+                    }}, upsert=True)
+                rollup_logger.info("Performance rollups are live")
+                while not stopped.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    position = change.get("fullDocument") or {}
+                    if position.get("user_id") and isinstance(position.get("timestamp"), datetime):
+                        refresh_bucket(position["user_id"], position["timestamp"])
+                    db[ROLLUP_STATE].update_one({"_id": "closed_positions"},
+                                                {"$set": {"resume_token": stream.resume_token}}, upsert=True)
+        except PyMongoError as e:
+            # Change streams need a replica set, /performance keeps using the raw pipeline without them
+            rollup_logger.warning(f"Performance rollups unavailable, using the raw pipeline: {str(e)}")
+            try:
+                # Nothing keeps them current any more, the next leader rebuilds them
+                db[ROLLUP_STATE].update_one({"_id": "closed_positions"},
+                                            {"$unset": {"built_at": "", "resume_token": ""}})
+            except PyMongoError as e:
+                rollup_logger.warning(f"Failed to mark performance rollups stale: {str(e)}")
+
+rollup_watcher = RollupWatcher()
+
+def compare(expected, actual):
+    """{field: (expected, actual)} for the fields of two performance results that differ beyond rounding"""
+    return {
+        key: (expected.get(key), actual.get(key)) for key in EMPTY_PERFORMANCE
+        if not _close(expected.get(key), actual.get(key))
+    }
+
+def verify(user_id, from_date, to_date):
+    """Compare rollup-based stats with performance_pipeline for one user and range"""
+    expected = list(db.closed_positions.aggregate(performance_pipeline(user_id, from_date, to_date)))
+    expected = expected[0] if expected else dict(EMPTY_PERFORMANCE)
+    bucket_query, slivers = _rollup_queries(user_id, from_date, to_date)
+    buckets = list(db[ROLLUPS].find(bucket_query, {"_id": 0})) if bucket_query else []
+    for pipeline in slivers:
+        buckets += list(db.closed_positions.aggregate(pipeline))
+    actual = summarize(buckets)
+    return expected, actual, compare(expected, actual)
+
+def _close(a, b):
+    if a is None or b is None:
+        return a == b
+    return abs(a - b) <= 0.011
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the /performance rollup collection")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="Rebuild rollups from closed_positions")
+    rebuild_parser.add_argument("--user-id")
+    verify_parser = commands.add_parser("verify", help="Check rollups against the raw pipeline")
+    verify_parser.add_argument("--user-id", required=True)
+    verify_parser.add_argument("--from-date", type=datetime.fromisoformat, required=True)
+    verify_parser.add_argument("--to-date", type=datetime.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rebuild(args.user_id)
+        return
+    expected, actual, mismatches = verify(args.user_id, args.from_date, args.to_date)
+    if mismatches:
+        for key, (want, got) in mismatches.items():
+            rollup_logger.error(f"Rollups differ from the raw pipeline on {key}: pipeline={want} rollups={got}")
+        raise SystemExit(1)
+    rollup_logger.info(f"Rollups match the raw pipeline: {actual}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+from collections import deque
+from typing import Callable, Optional
+from app.config import SNAPSHOT_SIGNALS
+from app.services.deltas import POSITION_DELTAS
+from app.utils.codec import Frame
+
+class Snapshot:
+    """Current stats, open positions and recent signals, sent to clients instead of a round of REST calls
+
+    Kept up to date from the event stream. Stats go to every new connection as one shared frame, encoded at
+    most once per version. Positions and signals belong to users, they only go out after a subscribe and only
+    what the subscription would have received live.
+    """
+
+    def __init__(self, max_signals=SNAPSHOT_SIGNALS):
+        self.stats = None
+        self.positions = {}
+        self.signals = deque(maxlen=max_signals)
+        self.version = 0
+        self.last_event_id = None
+        self.ready = False
+        self._frame = None
+
+    def load(self, positions: dict, stats: Optional[dict], signals: list, last_event_id=None):
+        """Start over from a full {identifier: position} read, the stats hash and recent signal frames"""
+        self.positions = {str(identifier): position for identifier, position in positions.items()}
+        self.stats = stats
+        self.signals.clear()
+        self.signals.extend(signals)
+        self.ready = True
+        self._changed(last_event_id)
+
+    def apply_position(self, event: dict, event_id=None):
+        """Apply one positions event published by RedisClient"""
+        data = event.get("data") or {}
+        identifier = data.get("identifier")
+        if identifier is None:
+            return
+        identifier = str(identifier)
+        if event.get("action") == "delete":
+            self.positions.pop(identifier, None)
+        else:
+            # Replace rather than mutate, frames already handed out keep the old dict
+            self.positions[identifier] = {**self.positions.get(identifier, {}), **data}
+        self._changed(event_id)
+
+    def apply_stats(self, stats: dict, event_id=None):
+        self.stats = stats
+        self._changed(event_id)
+
+    def add_signal(self, message: dict, event_id=None):
+        """Remember a broadcast signal frame, the oldest falls off past max_signals"""
+        self.signals.append(message)
+        self._changed(event_id)
+
+    def _changed(self, event_id):
+        self.version += 1
+        if event_id is not None:
+            self.last_event_id = event_id
+        self._frame = None
+
+    def frame(self, match: Optional[Callable] = None) -> Optional[Frame]:
+        """The snapshot frame for the current version, None until the first load or when nothing matches
+
+        match(channel, user_id, symbol) is the route a connection's subscription accepts: stats as the positions
+        channel carries them, each position as its position_deltas frames, each signal as its signals frame.
+        Without it the frame holds the stats only.
+        """
+        if not self.ready:
+            return None
+        if match is None:
+            if self._frame is None:
+                self._frame = self._build(self.stats, {}, [])
+            return self._frame
+        stats = self.stats if match("positions", None, None) else None
+        positions = {
+            identifier: position for identifier, position in self.positions.items()
+            if match(POSITION_DELTAS, position.get("user_id"), position.get("symbol"))
+        }
+        signals = [signal for signal in self.signals if match("signals", *_route(signal.get("data")))]
+        if stats is None and not positions and not signals:
+            return None
+        return self._build(stats, positions, signals)
+
+    def _build(self, stats, positions, signals) -> Frame:
+        payload = {
+            "type": "snapshot",
+            "version": self.version,
+            "data": {
+                "stats": stats,
+                # Copies, the frame is encoded when first sent and must not see later events
+                "positions": dict(positions),
+                "signals": list(signals)
+            }
+        }
+        if self.last_event_id is not None:
+            # Everything after this id reaches the client live
+            payload["id"] = self.last_event_id
+        return Frame(payload)
+
+def _route(data):
+    """(user_id, symbol) of an event payload, as RealtimeService routes it"""
+    if not isinstance(data, dict):
+        return None, None
+    return data.get("user_id"), data.get("symbol")
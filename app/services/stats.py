@@ -0,0 +1,52 @@
+from loguru import logger
+from app.services.book import PositionBook
+
+class PositionStats:
+    """Running position totals over the position book, kept current from positions events instead of HGETALL per tick"""
+
+    def __init__(self, book: PositionBook = None):
+        self.book = book if book is not None else PositionBook()
+        self.version = 0
+        self.last_action = None
+        self.dirty = False
+        self.needs_resync = True
+
+    def load(self, positions: dict):
+        """Rebuild the book from a full {identifier: position} read of the positions hash"""
+        before = self.book.total_pnl()
+        self.book.load(positions)
+        total_pnl = self.book.total_pnl()
+        if abs(total_pnl - before) >= 0.005:
+            logger.info(f"Resynced position stats, total_pnl drifted from {before:.2f} to {total_pnl:.2f}")
+        self.needs_resync = False
+        self._changed("resync")
+
+    def apply(self, event: dict):
+        """Apply one positions event published by RedisClient"""
+        data = event.get("data") or {}
+        action = event.get("action")
+        identifier = data.get("identifier")
+        if identifier is None:
+            self.needs_resync = True
+            return
+
+        known = identifier in self.book
+        self.book.apply(event)
+        if action != "delete" and "unrealized_pnl" not in data:
+            if known:
+                # Nothing the totals depend on changed
+                return
+            # A new position without its PnL, count it and fetch the rest on the next resync
+            self.needs_resync = True
+        self._changed(action)
+
+    def _changed(self, action):
+        self.version += 1
+        self.last_action = action
+        self.dirty = True
+
+    def snapshot(self) -> dict:
+        return {
+            "total_positions": len(self.book),
+            "total_pnl": round(self.book.total_pnl(), 2)
+        }
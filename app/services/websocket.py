@@ -1,20 +1,590 @@
-from typing import List
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Dict, Optional, Set, Union
 from fastapi import WebSocket
+from loguru import logger
+from app.config import (
+    WS_IDLE_TIMEOUT,
+    WS_MAX_BUFFERED_BYTES,
+    WS_MAX_CONNECTIONS,
+    WS_MAX_QUEUE_BYTES,
+    WS_MESSAGE_BURST,
+    WS_MESSAGE_RATE,
+    WS_PING_INTERVAL,
+    WS_QUEUE_SIZE,
+    WS_SEND_TIMEOUT,
+    WS_SLOW_CONSUMER_POLICY
+)
+from app.models.subscriptions import Resume, Subscription
+from app.services.metrics import (
+    websocket_buffered_bytes,
+    websocket_connections,
+    websocket_connections_rejected_total,
+    websocket_evictions_total,
+    websocket_fanout_seconds,
+    websocket_messages_dropped_total,
+    websocket_messages_sent_total,
+    websocket_reaped_total,
+    websocket_send_failures_total
+)
+from app.utils.codec import Frame, JSON, MSGPACK, loads, supported_formats
+from app.utils.ratelimit import TokenBucket
+from app.utils.streams import stream_id
+
+# Slow consumer policies, applied when a connection's queue is full
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# Channels delivered to connections that never subscribed, as before topics existed
+DEFAULT_CHANNELS = ("positions", "signals")
+
+def _matches(topic: tuple, channel: str, user_id=None, symbol=None) -> bool:
+    """Whether a frame routed to (channel, user_id, symbol) reaches subscribers of topic, None in a topic matches all"""
+    return topic[0] == channel and topic[1] in (None, user_id) and topic[2] in (None, symbol)
+
+class ByteBudget:
+    """Outbound bytes queued across the connections of one worker, 0 for no limit"""
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+
+    def add(self, size: int):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def exceeded(self) -> bool:
+        return 0 < self.limit < self.used
+
+class Connection:
+    """A WebSocket with its own bounded outbound queue and writer task"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str, fmt: str = JSON,
+                 messages: Optional[TokenBucket] = None, max_queue_bytes: int = 0,
+                 budget: Optional[ByteBudget] = None):
+        self.websocket = websocket
+        self.format = fmt
+        self.queue_size = queue_size
+        self.policy = policy
+        # (key, message, size in bytes as sent)
+        self.queue = deque()
+        self.max_queue_bytes = max_queue_bytes
+        self.budget = budget
+        # Bytes held in the queue and in pending, not counting the message being written
+        self.queued_bytes = 0
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # perf_counter when the send in progress started, None between sends, watched by ConnectionManager
+        self.send_started: Optional[float] = None
+        self.topics = set()
+        # Live messages held back while missed events are replayed, None when not resuming.
+        # Same entries as the queue and held to the same limits and slow consumer policy
+        self.pending: Optional[deque] = None
+        # Stream id of the last snapshot sent after a subscribe, everything after it was delivered live
+        self.snapshot_id: Optional[str] = None
+        self.connected_at = time.time()
+        # Limits what the client sends, None for no limit
+        self.messages = messages
+        # When the client last sent a message, protocol pongs are answered by uvicorn and never show up here
+        self.last_seen = self.connected_at
+        # stats
+        self.sent = 0
+        self.dropped = 0
+        self.limited = 0
+        self.coalesced = 0
+        self.max_queue_depth = 0
+        self.max_queued_bytes = 0
+        self.last_send_latency = 0.0
+        self.max_send_latency = 0.0
+        self.total_send_latency = 0.0
+
+    def size(self, message: Union[Frame, str]) -> int:
+        """Bytes the message goes out as, encoding a frame here saves doing it in the writer"""
+        if isinstance(message, str):
+            return len(message)
+        return len(message.msgpack) if self.format == MSGPACK else len(message.text)
+
+    def _account(self, size: int):
+        self.queued_bytes += size
+        self.max_queued_bytes = max(self.max_queued_bytes, self.queued_bytes)
+        if self.budget is not None:
+            self.budget.add(size)
+
+    def _full(self, entries: deque, size: int) -> bool:
+        return len(entries) >= self.queue_size or 0 < self.max_queue_bytes < self.queued_bytes + size
+
+    def enqueue(self, message: Union[Frame, str], key: Optional[str] = None) -> bool:
+        """Queue a message, or hold it back during a replay, returns False if the connection should be dropped"""
+        size = self.size(message)
+        entries = self.queue if self.pending is None else self.pending
+        if entries and self._full(entries, size):
+            if self.policy == DISCONNECT:
+                return False
+            if self.policy == COALESCE and key is not None:
+                # Replace the queued message for the same key in place
+                for index, (queued_key, _, queued_size) in enumerate(entries):
+                    if queued_key == key:
+                        entries[index] = (key, message, size)
+                        self._account(size - queued_size)
+                        self.coalesced += 1
+                        return True
+            # Room for one more message, or for its bytes
+            while entries and self._full(entries, size):
+                _, _, dropped_size = entries.popleft()
+                self._account(-dropped_size)
+                self.dropped += 1
+                websocket_messages_dropped_total.inc()
+        entries.append((key, message, size))
+        self._account(size)
+        if entries is self.queue:
+            self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+            self.ready.set()
+        return True
+
+    def replay(self, messages: list, live: list = ()):
+        """Queue missed messages, then the [(message, key)] held back meanwhile, beyond queue_size
+
+        The client asked for the missed ones, and the live ones were already held to the limits while pending.
+        """
+        for key, message in [(None, message) for message in messages] + [(key, message) for message, key in live]:
+            size = self.size(message)
+            self.queue.append((key, message, size))
+            self._account(size)
+        self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        if self.queue:
+            self.ready.set()
+
+    def take_pending(self) -> list:
+        """Stop holding back live messages, [(message, key)] to queue again, their bytes are counted again then"""
+        pending, self.pending = self.pending or (), None
+        self._account(-sum(size for _, _, size in pending))
+        return [(message, key) for key, message, _ in pending]
+
+    def release(self):
+        """Drop everything still queued, once the connection is gone"""
+        self.queue.clear()
+        if self.pending is not None:
+            self.pending = deque()
+        self._account(-self.queued_bytes)
+
+    def seen(self):
+        """The client sent something, it is still there"""
+        self.last_seen = time.time()
+
+    async def run(self):
+        """Drain the queue into the socket until it fails or is cancelled"""
+        while True:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+            _, message, size = self.queue.popleft()
+            # Handed to the socket, whose own write buffer is bounded by uvicorn
+            self._account(-size)
+            # No deadline per send, wait_for costs a task per message, the manager's watchdog evicts stuck writers
+            started = self.send_started = time.perf_counter()
+            await self._send(message)
+            self.send_started = None
+            latency = time.perf_counter() - started
+            self.sent += 1
+            websocket_messages_sent_total.inc()
+            self.last_send_latency = latency
+            self.max_send_latency = max(self.max_send_latency, latency)
+            self.total_send_latency += latency
+
+    def _send(self, message: Union[Frame, str]):
+        if isinstance(message, str):
+            return self.websocket.send_text(message)
+        if self.format == MSGPACK:
+            return self.websocket.send_bytes(message.msgpack)
+        return self.websocket.send_text(message.text)
+
+    def stats(self) -> dict:
+        client = getattr(self.websocket, "client", None)
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "connected_at": self.connected_at,
+            "format": self.format,
+            "topics": [list(topic) for topic in self.topics],
+            "queue_depth": len(self.queue),
+            "max_queue_depth": self.max_queue_depth,
+            "queued_bytes": self.queued_bytes,
+            "max_queued_bytes": self.max_queued_bytes,
+            "last_seen": self.last_seen,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "limited": self.limited,
+            "last_send_latency_ms": round(self.last_send_latency * 1000, 3),
+            "max_send_latency_ms": round(self.max_send_latency * 1000, 3),
+            "avg_send_latency_ms": round(self.total_send_latency / self.sent * 1000, 3) if self.sent else 0.0
+        }
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    def __init__(self, queue_size=WS_QUEUE_SIZE, policy=WS_SLOW_CONSUMER_POLICY, send_timeout=WS_SEND_TIMEOUT,
+                 max_connections=WS_MAX_CONNECTIONS, message_rate=WS_MESSAGE_RATE, message_burst=WS_MESSAGE_BURST,
+                 max_queue_bytes=WS_MAX_QUEUE_BYTES, max_buffered_bytes=WS_MAX_BUFFERED_BYTES,
+                 sweep_interval=WS_PING_INTERVAL, idle_timeout=WS_IDLE_TIMEOUT):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{policy}', expected one of {POLICIES}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.max_connections = max_connections
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.max_queue_bytes = max_queue_bytes
+        self.budget = ByteBudget(max_buffered_bytes)
+        self.sweep_interval = sweep_interval
+        self.idle_timeout = idle_timeout
+        self.active_connections: Dict[WebSocket, Connection] = {}
+        # (channel, user_id, symbol) -> sockets, None acts as a wildcard
+        self.topics: Dict[tuple, Set[WebSocket]] = defaultdict(set)
+        # Connections that never subscribed get DEFAULT_CHANNELS
+        self.unsubscribed: Set[WebSocket] = set()
+        self.evicted = 0
+        self.rejected = 0
+        self.reaped = 0
+        self._closing = set()
+        self._writers = set()
+        self._sweep_task = None
+        self._watchdog_task = None
+        # async (last_event_id) -> ([(event_id, frame, channel, user_id, symbol, key)], complete), set by RealtimeService
+        self.history = None
+        # (match=None) -> Optional[Frame], stats only without match, set by RealtimeService
+        self.snapshot = None
+        self._replays = set()
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async def connect(self, websocket: WebSocket) -> bool:
+        """Accept a client, False when this worker is full and the socket was refused instead"""
+        if len(self.active_connections) >= self.max_connections:
+            self.rejected += 1
+            websocket_connections_rejected_total.inc("full")
+            # Closing before accept() is a plain HTTP 403, accept first so the client sees 1013: try again later
+            await websocket.accept()
+            await websocket.close(code=1013)
+            return False
+        # Clients may negotiate binary msgpack frames through the subprotocol header
+        requested = websocket.scope.get("subprotocols") or []
+        fmt = MSGPACK if MSGPACK in requested and MSGPACK in supported_formats() else JSON
+        await websocket.accept(subprotocol=MSGPACK if fmt == MSGPACK else None)
+        messages = TokenBucket(self.message_rate, self.message_burst) if self.message_rate > 0 else None
+        connection = Connection(websocket, self.queue_size, self.policy, fmt, messages, self.max_queue_bytes,
+                                self.budget)
+        connection.task = asyncio.create_task(self._writer(connection))
+        self._writers.add(connection.task)
+        connection.task.add_done_callback(self._writers.discard)
+        self.active_connections[websocket] = connection
+        self.unsubscribed.add(websocket)
+        websocket_connections.set(value=len(self.active_connections))
+        # Stats only, positions and signals wait for a subscribe that says whose the client may see
+        snapshot = self.snapshot() if self.snapshot is not None else None
+        if snapshot is not None:
+            connection.enqueue(snapshot)
+            self._enforce_budget()
+        return True
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if not connection:
+            return
+        self.unsubscribed.discard(websocket)
+        websocket_connections.set(value=len(self.active_connections))
+        for topic in connection.topics:
+            self._unindex(topic, websocket)
+        connection.release()
+        if connection.task is not asyncio.current_task():
+            connection.task.cancel()
+
+    def _unindex(self, topic: tuple, websocket: WebSocket):
+        sockets = self.topics.get(topic)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.topics[topic]
+
+    def subscribe(self, websocket: WebSocket, topic: tuple):
+        connection = self.active_connections.get(websocket)
+        if connection:
+            connection.topics.add(topic)
+            self.topics[topic].add(websocket)
+            self.unsubscribed.discard(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, topic: tuple):
+        connection = self.active_connections.get(websocket)
+        if connection and topic in connection.topics:
+            connection.topics.discard(topic)
+            self._unindex(topic, websocket)
+
+    def handle_client_message(self, websocket: WebSocket, text: str):
+        """Apply a subscribe/unsubscribe/resume message from a client and acknowledge it"""
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.seen()
+        if connection is not None and connection.messages is not None:
+            wait = connection.messages.take()
+            if wait > 0:
+                connection.limited += 1
+                self.send_personal_message(websocket, Frame({
+                    "type": "error",
+                    "error": "Too many messages",
+                    "retry_after": round(wait, 3)
+                }))
+                return
+        try:
+            request = loads(text)
+            if isinstance(request, dict) and request.get("action") == "resume":
+                self.resume(websocket, Resume(**request).last_event_id)
+                return
+            subscription = Subscription(**request)
+        except (ValueError, TypeError) as e:
+            self.send_personal_message(websocket, Frame({"type": "error", "error": str(e)}))
+            return
+        if subscription.action == "subscribe":
+            self.subscribe(websocket, subscription.topic())
+        else:
+            self.unsubscribe(websocket, subscription.topic())
+        self.send_personal_message(websocket, Frame({
+            "type": f"{subscription.action}d",
+            "channel": subscription.channel,
+            "user_id": subscription.user_id,
+            "symbol": subscription.symbol
+        }))
+        if subscription.action == "subscribe":
+            self._send_snapshot(websocket, subscription.topic())
+
+    def _send_snapshot(self, websocket: WebSocket, topic: tuple):
+        """Catch a new subscription up with what the snapshot holds for it, as its live frames would route"""
+        connection = self.active_connections.get(websocket)
+        if connection is None or self.snapshot is None:
+            return
+        snapshot = self.snapshot(lambda channel, user_id, symbol: _matches(topic, channel, user_id, symbol))
+        if snapshot is not None:
+            connection.snapshot_id = snapshot.payload.get("id")
+            self.send_personal_message(websocket, snapshot)
+
+    def resume(self, websocket: WebSocket, last_event_id: str):
+        """Replay what this connection missed since last_event_id, then continue live"""
+        connection = self.active_connections.get(websocket)
+        if connection is None or connection.pending is not None:
+            return
+        if connection.snapshot_id is not None and stream_id(last_event_id) <= stream_id(connection.snapshot_id):
+            # The snapshot already covers what was missed and later events came live
+            connection.enqueue(Frame({
+                "type": "resumed",
+                "last_event_id": connection.snapshot_id,
+                "replayed": 0,
+                "complete": True
+            }))
+            return
+        connection.pending = deque()
+        task = asyncio.create_task(self._replay(connection, last_event_id))
+        self._replays.add(task)
+        task.add_done_callback(self._replays.discard)
+
+    async def _replay(self, connection: Connection, last_event_id: str):
+        events, complete = [], False
+        try:
+            if self.history is not None:
+                events, complete = await self.history(last_event_id)
+        except Exception as e:
+            logger.warning(f"Failed to replay events after {last_event_id}: {type(e).__name__} {str(e)}")
+        websocket = connection.websocket
+        if websocket not in self.active_connections:
+            return
+
+        # Only what this connection would have received live, and only the newest message per key
+        replayed, keys = [], set()
+        for _, frame, channel, user_id, symbol, key in reversed(events):
+            if key is not None:
+                if key in keys:
+                    continue
+                keys.add(key)
+            if self._receives(websocket, channel, user_id, symbol):
+                replayed.append(frame)
+        replayed.reverse()
+        last_event_id = events[-1][0] if events else last_event_id
+        live = []
+        for message, key in connection.take_pending():
+            event_id = message.payload.get("id") if isinstance(message, Frame) else None
+            if event_id is not None and stream_id(event_id) <= stream_id(last_event_id):
+                # Arrived live while the replay was read, already in it
+                continue
+            live.append((message, key))
+        # complete is False when the stream no longer holds everything, the client should reload over REST
+        connection.replay(replayed + [Frame({
+            "type": "resumed",
+            "last_event_id": last_event_id,
+            "replayed": len(replayed),
+            "complete": complete
+        })], live)
+        self._enforce_budget()
+
+    def has_subscribers(self, channel: str) -> bool:
+        if channel in DEFAULT_CHANNELS and self.unsubscribed:
+            return True
+        return any(topic[0] == channel for topic in self.topics)
+
+    def _recipients(self, channel: str, user_id=None, symbol=None) -> Set[WebSocket]:
+        recipients = set()
+        for topic in {
+            (channel, None, None),
+            (channel, user_id, None),
+            (channel, None, symbol),
+            (channel, user_id, symbol)
+        }:
+            recipients.update(self.topics.get(topic, ()))
+        if channel in DEFAULT_CHANNELS:
+            recipients.update(self.unsubscribed)
+        return recipients
+
+    def _receives(self, websocket: WebSocket, channel: str, user_id=None, symbol=None) -> bool:
+        """Whether a frame broadcast to (channel, user_id, symbol) reaches websocket, as _recipients routes it"""
+        if channel in DEFAULT_CHANNELS and websocket in self.unsubscribed:
+            return True
+        connection = self.active_connections.get(websocket)
+        return connection is not None and any(
+            _matches(topic, channel, user_id, symbol) for topic in connection.topics
+        )
+
+    async def _writer(self, connection: Connection):
+        try:
+            await connection.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            websocket_send_failures_total.inc()
+            logger.warning(f"Evicting WebSocket after failed send: {type(e).__name__} {str(e)}")
+            self.evict(connection.websocket)
+
+    def evict(self, websocket: WebSocket, code: int = 1011):
+        """Drop a connection now and close its socket in the background"""
+        if websocket not in self.active_connections:
+            return
+        self.evicted += 1
+        websocket_evictions_total.inc()
+        self.disconnect(websocket)
+        task = asyncio.create_task(self._close(websocket, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def send_personal_message(self, websocket: WebSocket, message: Union[Frame, str]):
+        connection = self.active_connections.get(websocket)
+        if connection and not connection.enqueue(message):
+            self.evict(websocket, code=1013)
+        self._enforce_budget()
+
+    def _enforce_budget(self):
+        """Disconnect the largest backlogs until the bytes queued for all connections fit the budget"""
+        while self.budget.exceeded() and self.active_connections:
+            websocket, connection = max(self.active_connections.items(), key=lambda item: item[1].queued_bytes)
+            logger.warning(f"Disconnecting WebSocket holding {connection.queued_bytes} queued bytes, "
+                           f"{self.budget.used} queued in total")
+            self.evict(websocket, code=1013)
+
+    async def _sweep(self):
+        """Close clients silent for longer than idle_timeout and publish the queued bytes, each interval
+
+        Sends nothing: uvicorn's protocol pings find vanished peers, the watchdog writers stuck on them.
+        """
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            if self.idle_timeout > 0:
+                now = time.time()
+                for websocket, connection in list(self.active_connections.items()):
+                    if now - connection.last_seen > self.idle_timeout:
+                        self.reap(websocket, "idle")
+            websocket_buffered_bytes.set(value=self.budget.used)
+
+    async def _watchdog(self):
+        """Evict connections whose writer has been stuck in one send for longer than send_timeout"""
+        while True:
+            await asyncio.sleep(self.send_timeout / 2)
+            now = time.perf_counter()
+            for websocket, connection in list(self.active_connections.items()):
+                if connection.send_started is not None and now - connection.send_started > self.send_timeout:
+                    websocket_send_failures_total.inc()
+                    logger.warning(f"Evicting WebSocket stuck in a send for {now - connection.send_started:.1f}s")
+                    self.evict(websocket)
+
+    def reap(self, websocket: WebSocket, reason: str):
+        self.reaped += 1
+        websocket_reaped_total.inc(reason)
+        logger.info(f"Closing {reason} WebSocket")
+        # 1001: going away
+        self.evict(websocket, code=1001)
+
+    def start(self):
+        """Start the idle sweep and the send watchdog, connections are still served without them"""
+        if self._sweep_task is None and self.sweep_interval > 0:
+            self._sweep_task = asyncio.create_task(self._sweep())
+        if self._watchdog_task is None and self.send_timeout > 0:
+            self._watchdog_task = asyncio.create_task(self._watchdog())
+
+    def stop(self):
+        for task in (self._sweep_task, self._watchdog_task):
+            if task is not None:
+                task.cancel()
+        self._sweep_task = self._watchdog_task = None
+
+    async def close(self):
+        """Stop, drop every connection and wait for the writer, replay and close tasks to finish"""
+        tasks = [task for task in (self._sweep_task, self._watchdog_task) if task is not None]
+        self.stop()
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+        for task in self._replays:
+            task.cancel()
+        tasks += [*self._writers, *self._replays, *self._closing]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def broadcast(self, message: Union[Frame, str], channel: Optional[str] = None, user_id=None, symbol=None,
+                        key: Optional[str] = None):
+        """Queue a message for every interested connection without waiting on any of them
+
+        Pass a Frame so the event is encoded once and the same bytes go to every recipient.
+        """
+        started = time.perf_counter()
+        if channel is None:
+            recipients = list(self.active_connections)
+        else:
+            recipients = self._recipients(channel, user_id, symbol)
+        for websocket in recipients:
+            connection = self.active_connections.get(websocket)
+            if connection and not connection.enqueue(message, key):
+                logger.warning("Disconnecting slow WebSocket consumer")
+                # 1013: try again later
+                self.evict(websocket, code=1013)
+        self._enforce_budget()
+        websocket_fanout_seconds.observe(time.perf_counter() - started, channel or "all")
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    def stats(self) -> dict:
+        connections = [connection.stats() for connection in self.active_connections.values()]
+        return {
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "max_connections": self.max_connections,
+            "active_connections": len(connections),
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+            "reaped": self.reaped,
+            "queued_bytes": self.budget.used,
+            "max_buffered_bytes": self.budget.limit,
+            "peak_queued_bytes": self.budget.peak,
+            "topics": len(self.topics),
+            "queued": sum(connection["queue_depth"] for connection in connections),
+            "dropped": sum(connection["dropped"] for connection in connections),
+            "connections": connections
+        }
 
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
@@ -0,0 +1,20 @@
+import asyncio
+import random
+
+def backoff_delay(attempt, base, cap):
+    """Full jitter exponential backoff, so workers retrying together spread out instead of hitting in lockstep"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+async def retry_until(name, check, errors, log, base, cap):
+    """Await check() until it stops raising one of errors, returns the failed attempts"""
+    attempt = 0
+    while True:
+        try:
+            await check()
+            return attempt
+        except errors as e:
+            delay = backoff_delay(attempt, base, cap)
+            attempt += 1
+            log.info(f"Could not reach {name} ({str(e) or type(e).__name__}), attempt {attempt}, "
+                     f"retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -0,0 +1,57 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack frames are optional
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+def _default(obj):
+    # datetimes as ISO 8601 like FastAPI's encoder, anything else (ObjectId, Decimal) as str
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+def dumps(obj) -> bytes:
+    """Encode an object to JSON bytes with the fastest available codec"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode("utf-8")
+
+def loads(data):
+    """Decode JSON from bytes or str with the fastest available codec"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def supported_formats():
+    return (JSON, MSGPACK) if msgpack is not None else (JSON,)
+
+class Frame:
+    """An outbound event, encoded at most once per wire format and shared by every recipient"""
+
+    __slots__ = ("payload", "_text", "_msgpack")
+
+    def __init__(self, payload):
+        self.payload = payload
+        self._text = None
+        self._msgpack = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps(self.payload).decode("utf-8")
+        return self._text
+
+    @property
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack.packb(self.payload, default=_default)
+        return self._msgpack
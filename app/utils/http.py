@@ -0,0 +1,32 @@
+from email.utils import format_datetime
+from hashlib import blake2b
+from typing import Optional
+from fastapi import Request, Response
+from app.utils.datetime import UTC
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the given version parts, weak because compression changes the bytes"""
+    digest = blake2b("|".join(map(str, parts)).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison, W/"x" and "x" are the same representation for If-None-Match
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+def validators(etag: str, last_modified=None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=UTC)
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(UTC), usegmt=True)
+    return headers
+
+def not_modified(request: Request, etag: str, last_modified=None) -> Optional[Response]:
+    """A 304 response when the client already holds this version, otherwise None"""
+    header = request.headers.get("if-none-match")
+    if header and _etag_matches(header, etag):
+        return Response(status_code=304, headers=validators(etag, last_modified))
+    return None
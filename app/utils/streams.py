@@ -0,0 +1,9 @@
+import re
+
+# Redis stream entry id, milliseconds and a sequence number
+STREAM_ID = re.compile(r"^\d+-\d+$")
+
+def stream_id(event_id: str) -> tuple:
+    """Order-comparable form of a stream entry id such as '1718000000000-3'"""
+    milliseconds, _, sequence = str(event_id).partition("-")
+    return int(milliseconds), int(sequence or 0)
@@ -0,0 +1,247 @@
+"""
+Overload scenario for admission control: REST pollers against live broadcasts.
+
+Connects --clients fake WebSocket clients to RealtimeService on the
+in-process Redis stand-in and publishes signals at --event-rate per second
+from another thread, like an outside producer. Meanwhile --pollers clients,
+each from its own IP, call --path through the ASGI app, on the same event
+loop as the broadcaster, like a single worker. They wait out Retry-After
+when turned away, as clients should.
+
+The default path is a synthetic route that waits --io-ms, like a database
+round trip, then spends --cpu-ms on the event loop, like decoding and
+encoding documents. Real routes would mostly measure the stand-in, which
+serves Redis from a Python thread.
+
+The scenario runs twice, first with admission control and rate limits turned
+off, then with the configured limits. Without them REST latency and broadcast
+latency grow together. With them the excess is turned away with fast 503s and
+429s, admitted requests keep a bounded latency and broadcasts keep flowing.
+Without admission control 503s still show up, but only from Redis pool
+timeouts after seconds of waiting.
+It ends with a reconnect storm of --storm WebSocket connects against a cap of
+--max-connections.
+
+    python -m benchmarks.admission_load --pollers 200 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+from benchmarks.redis_standin import RedisStandIn
+
+WORK_PATH = "/bench/work"
+
+
+class FakeWebSocket:
+    """Records the delivery latency of every signal it receives"""
+
+    def __init__(self, latencies):
+        self.scope = {}
+        self.latencies = latencies
+        self.closed = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+    async def send_text(self, message):
+        payload = json.loads(message)
+        # Stats snapshots go to the same clients, only count signals
+        if payload.get("type") == "signals":
+            self.latencies.append(time.perf_counter() - payload["data"]["sent_at"])
+
+    async def send_bytes(self, message):
+        pass
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def ms(values, pct):
+    return f"{percentile(values, pct) * 1000:8.1f}" if values else f"{'-':>8}"
+
+
+def add_work_route(app, io_ms, cpu_ms):
+    async def work():
+        await asyncio.sleep(io_ms / 1000)
+        deadline = time.perf_counter() + cpu_ms / 1000
+        while time.perf_counter() < deadline:
+            pass
+        return {"ok": True}
+
+    app.add_api_route(WORK_PATH, work)
+
+
+def publish(port, rate, deadline):
+    import redis
+
+    publisher = redis.Redis(host="127.0.0.1", port=port)
+    published = 0
+    while time.perf_counter() < deadline:
+        publisher.publish("signals", json.dumps({
+            "category": "signals",
+            "action": "create",
+            "data": {"seq": published, "sent_at": time.perf_counter()}
+        }))
+        published += 1
+        time.sleep(1 / rate)
+    publisher.close()
+    return published
+
+
+async def phase(app, args, port, latencies):
+    import httpx
+
+    statuses = Counter()
+    admitted, rejected, health = [], [], []
+    deadline = time.perf_counter() + args.duration
+    latencies.clear()
+
+    async def poll(client):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get(args.path)
+            elapsed = time.perf_counter() - started
+            statuses[response.status_code] += 1
+            (admitted if response.status_code == 200 else rejected).append(elapsed)
+            if "retry-after" in response.headers:
+                # The pollers share the server's event loop, a client spinning on rejections would load it
+                await asyncio.sleep(float(response.headers["retry-after"]))
+
+    async def probe(client):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await client.get("/health")
+            health.append(time.perf_counter() - started)
+            await asyncio.sleep(0.1)
+
+    clients = [
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(f"10.0.{i // 250}.{i % 250}", 40000)),
+                          base_url="http://bench", timeout=None)
+        for i in range(args.pollers + 1)
+    ]
+    published = []
+    publisher = threading.Thread(target=lambda: published.append(publish(port, args.event_rate, deadline)))
+    publisher.start()
+    try:
+        await asyncio.gather(probe(clients[-1]), *(poll(client) for client in clients[:-1]))
+    finally:
+        for client in clients:
+            await client.aclose()
+    publisher.join()
+    # Let the last broadcasts drain before counting them
+    await asyncio.sleep(1)
+    return {
+        "statuses": statuses,
+        "admitted": admitted,
+        "rejected": rejected,
+        "health": health,
+        "published": published[0],
+        "delivered": len(latencies) / max(1, args.clients),
+        "broadcast": list(latencies)
+    }
+
+
+def report(label, result, duration):
+    statuses = result["statuses"]
+    print(f"\n{label}")
+    print(f"  requests     200={statuses[200]:<7} 503={statuses[503]:<7} 429={statuses[429]:<7} "
+          f"ok/s={statuses[200] / duration:8.1f}")
+    print(f"  admitted ms  p50={ms(result['admitted'], 50)} p99={ms(result['admitted'], 99)}")
+    print(f"  rejected ms  p50={ms(result['rejected'], 50)} p99={ms(result['rejected'], 99)}")
+    print(f"  /health ms   p50={ms(result['health'], 50)} p99={ms(result['health'], 99)}")
+    print(f"  broadcast ms p50={ms(result['broadcast'], 50)} p99={ms(result['broadcast'], 99)} "
+          f"delivered={result['delivered']:.0f}/{result['published']} per client")
+
+
+async def run(args, port):
+    import redis.asyncio as aioredis
+    from loguru import logger
+    from app.main import app
+    from app.services.admission import admission, ip_limiter, user_limiter
+    from app.services.realtime import RealtimeService
+    from app.services.websocket import manager
+
+    # Measure the server, not the terminal
+    logger.remove()
+    add_work_route(app, args.io_ms, args.cpu_ms)
+
+    latencies = []
+    manager.max_connections = args.clients
+    sockets = [FakeWebSocket(latencies) for _ in range(args.clients)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+
+    service = RealtimeService()
+    listener = asyncio.create_task(service.start_listening())
+    admission.start()
+    publisher = aioredis.Redis(host="127.0.0.1", port=port)
+    while not await publisher.publish("trades", "{}") and not listener.done():
+        await asyncio.sleep(0.05)
+    await publisher.aclose()
+
+    limits = (admission.max_in_flight, ip_limiter.rate, user_limiter.rate)
+    admission.max_in_flight, ip_limiter.rate, user_limiter.rate = 0, 0, 0
+    unprotected = await phase(app, args, port, latencies)
+    admission.max_in_flight, ip_limiter.rate, user_limiter.rate = limits
+    protected = await phase(app, args, port, latencies)
+
+    print(f"pollers={args.pollers} websocket clients={args.clients} events/s={args.event_rate} "
+          f"duration={args.duration}s")
+    report("admission control off", unprotected, args.duration)
+    report(f"admission control on (max in flight {admission.max_in_flight}, {ip_limiter.rate:g}/s per IP)",
+           protected, args.duration)
+
+    # Reconnect storm, the cap refuses what doesn't fit instead of holding its buffers
+    manager.max_connections = args.max_connections
+    storm = [FakeWebSocket([]) for _ in range(args.storm)]
+    accepted = [await manager.connect(websocket) for websocket in storm].count(True)
+    print(f"\nreconnect storm  attempts={args.storm} accepted={accepted} refused={args.storm - accepted} "
+          f"connected={len(manager.active_connections)}/{args.max_connections}")
+    await manager.close()
+
+    admission.stop()
+    await service.stop_listening()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pollers", type=int, default=200)
+    parser.add_argument("--path", default=WORK_PATH, help="polled route")
+    parser.add_argument("--io-ms", type=float, default=20.0, help="simulated database wait of the synthetic route")
+    parser.add_argument("--cpu-ms", type=float, default=5.0, help="event loop time of the synthetic route")
+    parser.add_argument("--clients", type=int, default=50, help="WebSocket clients receiving broadcasts")
+    parser.add_argument("--event-rate", type=float, default=50.0, help="signals published per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--storm", type=int, default=500)
+    parser.add_argument("--max-connections", type=int, default=200)
+    args = parser.parse_args()
+
+    port = RedisStandIn().start()
+    os.environ.update({
+        "HOST": "127.0.0.1",
+        "PORT": "8000",
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(port),
+        "REDIS_PASSWORD": "",
+        # The database module names its database at import, nothing here queries MongoDB
+        "MONGO_DB_NAME": os.environ.get("MONGO_DB_NAME", "bench"),
+        # The stand-in speaks pub/sub but not streams
+        "REALTIME_SOURCE": "pubsub",
+        # Off by default, every poller has its own address here as if uvicorn trusted a proxy in front
+        "RATE_LIMIT_IP_RATE": os.environ.get("RATE_LIMIT_IP_RATE", "20")
+    })
+    asyncio.run(run(args, port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark for the /positions/analytics computation.
+
+Builds synthetic closed-position columns in steps (10k, 100k, 1M trades by
+default), in the shape AsyncCollection.columns returns for ANALYTICS_FIELDS.
+It times compute_analytics against a per-row Python loop that produces the same
+equity, drawdown and per-symbol totals. Reports the JSON payload size, which is
+bounded by --points rather than the trade count.
+
+Only the computation is timed. The Mongo fetch is covered by
+closed_positions_scale, and importing the app still needs a reachable Mongo.
+
+    MONGO_CONNECTION_STRING=mongodb://localhost:27017 python -m benchmarks.analytics_scale
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault("HOST", "127.0.0.1")
+os.environ.setdefault("PORT", "8000")
+
+from app.services.analytics import ANALYTICS_FIELDS, PNL_FIELD, compute_analytics  # noqa: E402
+
+SYMBOLS = ["NIFTY", "BANKNIFTY", "FINNIFTY"]
+BROKERS = ["breeze", "zerodha"]
+
+
+def synthetic_columns(count, now, history_days):
+    # Times are epoch milliseconds, as the $toLong projection returns them
+    columns = {field: [] for field in ANALYTICS_FIELDS}
+    for _ in range(count):
+        entry = now - random.randint(0, history_days * 86400) * 1000
+        columns["symbol"].append(random.choice(SYMBOLS))
+        columns["strike_price"].append(str(random.randrange(22000, 26000, 50)))
+        columns["broker"].append(random.choice(BROKERS))
+        columns["timestamp"].append(entry)
+        columns["exit_time"].append(entry + random.randint(1, 360) * 60000)
+        columns[PNL_FIELD].append(round(random.gauss(50, 2000), 2))
+    return columns
+
+
+def row_loop(columns):
+    """What the analytics would cost computed a trade at a time"""
+    # Stable on exit time like compute_analytics, ties keep their fetch order
+    rows = sorted(zip(columns["exit_time"], columns[PNL_FIELD], columns["symbol"]), key=lambda row: row[0])
+    equity = peak = max_drawdown = 0.0
+    curve = []
+    by_symbol = {}
+    for _, pnl, symbol in rows:
+        equity += pnl
+        peak = max(peak, equity)
+        max_drawdown = min(max_drawdown, equity - peak)
+        curve.append(equity)
+        by_symbol[symbol] = by_symbol.get(symbol, 0.0) + pnl
+    return curve, max_drawdown, by_symbol
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--points", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    now = int(time.time() * 1000)
+    print(f"{'trades':>10} {'analytics ms':>13} {'row loop ms':>12} {'payload KB':>11} {'max drawdown':>14}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        columns = synthetic_columns(size, now, args.history_days)
+        vectorized, result = timed(lambda: compute_analytics(columns, args.points), args.repeat)
+        looped, (_, max_drawdown, _) = timed(lambda: row_loop(columns), args.repeat)
+        # Both paths must agree on what the dashboard shows
+        assert abs(result["max_drawdown"] - round(max_drawdown, 2)) < 0.01
+        payload = len(json.dumps(result).encode()) / 1024
+        print(f"{size:>10,} {vectorized:>13.1f} {looped:>12.1f} {payload:>11.1f} {result['max_drawdown']:>14,.2f}")
+
+
+if __name__ == "__main__":
+    main()
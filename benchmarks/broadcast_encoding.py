@@ -0,0 +1,118 @@
+"""
+Micro-benchmark for encoding and fanning out one event to many WebSocket clients.
+
+Compares encoding per recipient (the old path) with a shared Frame encoded
+once by the stdlib codec, orjson, and msgpack, at 1, 100 and 1000 clients.
+
+    python -m benchmarks.broadcast_encoding --events 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("HOST", "127.0.0.1")
+os.environ.setdefault("PORT", "8000")
+
+from app.services.websocket import ConnectionManager  # noqa: E402
+from app.utils import codec  # noqa: E402
+from app.utils.codec import Frame, MSGPACK  # noqa: E402
+
+
+class NullWebSocket:
+    def __init__(self, subprotocols=()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.bytes_sent = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    async def send_text(self, message):
+        self.bytes_sent += len(message)
+
+    async def send_bytes(self, message):
+        self.bytes_sent += len(message)
+
+
+def make_event(seq):
+    return {
+        "type": "signals",
+        "action": "create",
+        "category": "signals",
+        "data": {
+            "seq": seq,
+            "user_id": "66f1c2b4e1a9d3f5a7b8c9d0",
+            "symbol": "NIFTY",
+            "strike_price": "24500",
+            "right": "call",
+            "expiry_date": "2024-10-31",
+            "entry_price": 132.45,
+            "stop_loss": 118.0,
+            "target": 160.0,
+            "quantity": 75,
+            "confidence": 0.83,
+            "timestamp": "2024-10-18T09:15:02.123456"
+        }
+    }
+
+
+async def drain(manager):
+    while any(connection.queue for connection in manager.active_connections.values()):
+        await asyncio.sleep(0)
+
+
+async def measure(label, clients, events, build, subprotocols=()):
+    manager = ConnectionManager(queue_size=events + 1, max_connections=clients)
+    sockets = [NullWebSocket(subprotocols) for _ in range(clients)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+
+    started = time.perf_counter()
+    for seq in range(events):
+        await build(manager, make_event(seq))
+        await drain(manager)
+    elapsed = time.perf_counter() - started
+
+    await manager.close()
+    per_event = elapsed / events * 1e6
+    sent = sum(websocket.bytes_sent for websocket in sockets) / events / clients
+    print(f"{label:<22} {clients:>6} {per_event:>14,.1f} {per_event / clients:>14,.2f} {sent:>12,.0f}")
+
+
+async def per_recipient(manager, event):
+    # Old behaviour: every send serializes its own copy of the event
+    for connection in manager.active_connections.values():
+        connection.enqueue(json.dumps(event))
+
+
+async def shared_frame(manager, event):
+    await manager.broadcast(Frame(event))
+
+
+async def run(events):
+    print(f"{'path':<22} {'clients':>6} {'us/event':>14} {'us/event/client':>14} {'bytes/frame':>12}")
+    orjson = codec.orjson
+    for clients in (1, 100, 1000):
+        await measure("json per recipient", clients, events, per_recipient)
+        codec.orjson = None
+        await measure("json frame (stdlib)", clients, events, shared_frame)
+        codec.orjson = orjson
+        if orjson is not None:
+            await measure("json frame (orjson)", clients, events, shared_frame)
+        if codec.msgpack is not None:
+            await measure("msgpack frame", clients, events, shared_frame, subprotocols=(MSGPACK,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.events))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Seeded-data benchmark for the closed_positions query shapes.
+
+Seeds a scratch database with synthetic closed positions in steps (10k, 100k,
+1M by default), ensures the declared indexes, and times the /positions/latest
+query and the /positions/performance pipeline at each size. The scratch
+database is dropped at the end unless --keep is passed.
+
+    MONGO_CONNECTION_STRING=mongodb://localhost:27017 python -m benchmarks.closed_positions_scale
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+os.environ.setdefault("HOST", "127.0.0.1")
+os.environ.setdefault("PORT", "8000")
+
+from app.database.mongodb import ensure_indexes, mongo_client  # noqa: E402
+from app.database.query_plans import check  # noqa: E402
+from app.services.rollups import performance_pipeline  # noqa: E402
+from app.utils.datetime import get_current_time  # noqa: E402
+
+USERS = [f"user-{i}" for i in range(20)]
+SYMBOLS = ["NIFTY", "BANKNIFTY", "FINNIFTY"]
+
+
+def synthetic_positions(start, count, now, history_days):
+    for i in range(start, start + count):
+        entry = now - timedelta(seconds=random.randint(0, history_days * 86400))
+        exit_time = entry + timedelta(minutes=random.randint(1, 360))
+        entry_price = round(random.uniform(50, 400), 2)
+        exit_price = round(entry_price * random.uniform(0.7, 1.4), 2)
+        quantity = random.choice([25, 50, 75, 150])
+        pnl = round((exit_price - entry_price) * quantity, 2)
+        yield {
+            "position_id": f"pos-{i}",
+            "user_id": random.choice(USERS),
+            "symbol": random.choice(SYMBOLS),
+            "strike_price": str(random.randrange(22000, 26000, 50)),
+            "right": random.choice(["call", "put"]),
+            "expiry_date": (entry + timedelta(days=7)).strftime("%Y-%m-%d"),
+            "broker": "breeze",
+            "quantity": str(quantity),
+            "entry_price": str(entry_price),
+            "current_price": exit_price,
+            "unrealized_pnl": pnl,
+            "realized_pnl": pnl,
+            "blocked_capital": entry_price * quantity,
+            "timestamp": entry,
+            "exit_price": exit_price,
+            "exit_time": exit_time
+        }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="alphaedge_benchmark")
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    database = mongo_client.client[args.db]
+    database.drop_collection("closed_positions")
+    ensure_indexes(database, ["closed_positions"])
+    now = get_current_time()
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    user_id = USERS[0]
+
+    def latest():
+        return list(database.closed_positions.find({"exit_time": {"$gt": now - timedelta(days=7)}}).sort([("exit_time", -1), ("_id", -1)]))
+
+    def performance():
+        return list(database.closed_positions.aggregate(performance_pipeline(user_id, day - timedelta(days=30), day)))
+
+    print(f"{'documents':>10} {'latest ms':>10} {'latest rows':>12} {'perf ms':>8} {'indexed':>8}")
+    seeded = 0
+    try:
+        for size in (int(value) for value in args.sizes.split(",")):
+            while seeded < size:
+                batch = min(10000, size - seeded)
+                database.closed_positions.insert_many(
+                    list(synthetic_positions(seeded, batch, now, args.history_days)), ordered=False
+                )
+                seeded += batch
+            rows = len(latest())
+            indexed = all(check(plan)[1] for plan in (
+                database.closed_positions.find({"exit_time": {"$gt": now - timedelta(days=7)}}).sort([("exit_time", -1), ("_id", -1)]).explain(),
+                database.command("aggregate", "closed_positions",
+                                 pipeline=performance_pipeline(user_id, day - timedelta(days=30), day), explain=True)
+            ))
+            print(f"{size:>10,} {timed(latest, args.repeat):>10.1f} {rows:>12,} "
+                  f"{timed(performance, args.repeat):>8.1f} {str(indexed):>8}")
+    finally:
+        if not args.keep:
+            mongo_client.client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Latency benchmark for the orders routes against a seeded orders hash.
+
+Seeds --orders synthetic orders (100k by default) and calls the routes
+in-process through the ASGI app. It compares fetching --ids orders with one
+GET each against a single POST /orders/batch, then times /orders listing
+pages with and without filters, and a full walk of one user's pages. The
+listings run twice, first on the HSCAN fallback and then again after
+rebuild_indexes("orders") has built the secondary indexes, with ORDERS_INDEXED on.
+
+Uses the in-process Redis stand-in unless --redis-host is given. Seeding
+overwrites the "orders" hash and its indexes, so only point it at a scratch Redis.
+
+    python -m benchmarks.orders_lookup --orders 100000 --ids 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from benchmarks.redis_standin import RedisStandIn
+
+USERS = [f"user-{i}" for i in range(50)]
+SYMBOLS = ["NIFTY", "BANKNIFTY", "FINNIFTY"]
+STATUSES = ["complete", "open", "cancelled", "rejected"]
+
+
+def synthetic_order(i, now):
+    placed = now - timedelta(seconds=random.randint(0, 30 * 86400))
+    return {
+        "user_id": random.choice(USERS),
+        "broker": "breeze",
+        "symbol": random.choice(SYMBOLS),
+        "strike_price": str(random.randrange(22000, 26000, 50)),
+        "expiry_date": (placed + timedelta(days=7)).strftime("%Y-%m-%d"),
+        "right": random.choice(["call", "put"]),
+        "quantity": random.choice([25, 50, 75, 150]),
+        "entry_price": round(random.uniform(50, 400), 2),
+        "stop_loss": 0.0,
+        "target": 0.0,
+        "order_type": "market",
+        "transaction_type": random.choice(["buy", "sell"]),
+        "product": "options",
+        "position_type": "long",
+        "timestamp": placed.isoformat(),
+        "order_id": f"broker-{i}",
+        "status": random.choice(STATUSES),
+        "average_price": round(random.uniform(50, 400), 2),
+        "exchange_order_id": f"exchange-{i}",
+        "order_timestamp": placed.isoformat(),
+        "variety": "regular",
+        "validity": "day",
+        "exchange": "NFO",
+        "position_id": f"pos-{i}",
+        "created_at": placed.isoformat()
+    }
+
+
+def seed(count):
+    from app.database.redis import redis_client
+    from app.utils.datetime import get_current_time
+
+    now = get_current_time()
+    redis_client.client.delete("orders", redis_client._index_key("orders", "built"))
+    for start in range(0, count, 10000):
+        mapping = {f"order-{i}": json.dumps(synthetic_order(i, now)) for i in range(start, min(start + 10000, count))}
+        redis_client.client.hset("orders", mapping=mapping)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(label, samples):
+    print(f"{label:<40} p50={statistics.median(samples) * 1000:8.1f}ms p99={percentile(samples, 99) * 1000:8.1f}ms")
+
+
+async def timed(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def run(args):
+    import httpx
+    from loguru import logger
+    from app.database.redis import redis_client
+    from app.main import app
+
+    # Measure the routes, not the terminal
+    logger.remove()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def get(url, **params):
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+            return response
+
+        ids = [f"order-{random.randrange(args.orders)}" for _ in range(args.ids)]
+
+        async def one_by_one():
+            for order_id in ids:
+                await get(f"/api/v1/orders/{order_id}")
+
+        async def batch():
+            response = await client.post("/api/v1/orders/batch", json={"ids": ids})
+            response.raise_for_status()
+
+        async def walk_user():
+            cursor, pages = None, 0
+            while True:
+                response = await get("/api/v1/orders", user_id=USERS[0], limit=args.limit,
+                                     **({"cursor": cursor} if cursor else {}))
+                pages += 1
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    return pages
+
+        async def listings(mode):
+            report(f"GET /orders page [{mode}]",
+                   await timed(lambda: get("/api/v1/orders", limit=args.limit), args.repeat))
+            report(f"GET /orders?user_id page [{mode}]",
+                   await timed(lambda: get("/api/v1/orders", user_id=USERS[0], limit=args.limit), args.repeat))
+            report(f"GET /orders?user_id&status [{mode}]",
+                   await timed(lambda: get("/api/v1/orders", user_id=USERS[0], status="open", limit=args.limit),
+                               args.repeat))
+            report(f"all pages of one user [{mode}]", await timed(walk_user, max(1, args.repeat // 5)))
+
+        report(f"{args.ids} x GET /orders/{{id}}", await timed(one_by_one, args.repeat))
+        report(f"POST /orders/batch ({args.ids} ids)", await timed(batch, args.repeat))
+        await listings("scan")
+        started = time.perf_counter()
+        redis_client.rebuild_indexes("orders")
+        print(f"{'rebuild_indexes(orders)':<40} {(time.perf_counter() - started) * 1000:8.1f}ms")
+        await listings("index")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--ids", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--redis-host")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-password", default="")
+    args = parser.parse_args()
+
+    host, port = args.redis_host, args.redis_port
+    if host is None:
+        host, port = "127.0.0.1", RedisStandIn().start()
+    os.environ.update({
+        "HOST": "127.0.0.1",
+        "PORT": "8000",
+        "REDIS_HOST": host,
+        "REDIS_PORT": str(port),
+        "REDIS_PASSWORD": args.redis_password,
+        # The database module names its database at import, nothing here queries MongoDB
+        "MONGO_DB_NAME": os.environ.get("MONGO_DB_NAME", "bench"),
+        "ORDERS_INDEXED": "true",
+        # One client timing routes back to back, admission control would only measure its own 429s
+        "ADMISSION_MAX_IN_FLIGHT": "0",
+        "RATE_LIMIT_IP_RATE": "0",
+        "RATE_LIMIT_USER_RATE": "0"
+    })
+    random.seed(7)
+    seed(args.orders)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
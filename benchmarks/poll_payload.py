@@ -0,0 +1,62 @@
+"""
+Bytes and latency per dashboard poll against a running server.
+
+Polls each endpoint with every Accept-Encoding, first unconditionally and then
+with the ETag from the previous response, and reports wire bytes (compressed,
+as received) and latency per poll.
+
+    python -m benchmarks.poll_payload --url http://localhost:8000 --order-id <id> -n 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+async def poll(session, path, encoding, conditional, count):
+    latencies, sizes, statuses = [], [], set()
+    etag = None
+    for _ in range(count):
+        headers = {"Accept-Encoding": encoding}
+        if conditional and etag:
+            headers["If-None-Match"] = etag
+        started = time.perf_counter()
+        async with session.get(path, headers=headers) as response:
+            body = await response.read()
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(body))
+            statuses.add(response.status)
+            etag = response.headers.get("ETag", etag)
+    return statistics.median(latencies) * 1000, statistics.mean(sizes), sorted(statuses)
+
+
+async def run(base_url, paths, count):
+    print(f"{'endpoint':<28} {'encoding':<9} {'mode':<12} {'p50 ms':>8} {'bytes/poll':>11} status")
+    async with aiohttp.ClientSession(base_url, auto_decompress=False) as session:
+        for path in paths:
+            for encoding in ENCODINGS:
+                for conditional in (False, True):
+                    latency, size, statuses = await poll(session, path, encoding, conditional, count)
+                    mode = "conditional" if conditional else "full"
+                    print(f"{path.split('?')[0][-28:]:<28} {encoding:<9} {mode:<12} {latency:>8.2f} "
+                          f"{size:>11,.0f} {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--order-id")
+    parser.add_argument("-n", "--count", type=int, default=50)
+    args = parser.parse_args()
+    paths = ["/api/v1/positions/latest", "/api/v1/positions/stats"]
+    if args.order_id:
+        paths.append(f"/api/v1/orders/{args.order_id}")
+    asyncio.run(run(args.url, paths, args.count))
+
+
+if __name__ == "__main__":
+    main()
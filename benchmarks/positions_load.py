@@ -0,0 +1,96 @@
+"""
+Concurrent load test for the positions routes of a running server.
+
+Fires requests at /positions/latest and /positions/performance with a fixed
+concurrency while probing /health in the background. When handlers block the
+event loop, /health latency climbs with the route latency, so run it once
+against the old build and once against the new one to compare.
+
+    python -m benchmarks.positions_load --url http://localhost:8000 --user-id <id> -c 50 -n 1000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(label, latencies, elapsed=None):
+    if not latencies:
+        print(f"{label:<14} no samples")
+        return
+    line = (f"{label:<14} n={len(latencies):<6} p50={statistics.median(latencies) * 1000:8.1f}ms "
+            f"p99={percentile(latencies, 99) * 1000:8.1f}ms max={max(latencies) * 1000:8.1f}ms")
+    if elapsed:
+        line += f" rps={len(latencies) / elapsed:8.1f}"
+    print(line)
+
+
+async def timed_get(session, url):
+    started = time.perf_counter()
+    async with session.get(url) as response:
+        await response.read()
+        response.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def run(base_url, concurrency, requests, paths):
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(paths[i % len(paths)])
+
+    latencies = {path: [] for path in paths}
+    health = []
+    errors = 0
+    done = asyncio.Event()
+
+    async with aiohttp.ClientSession(base_url) as session:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                path = queue.get_nowait()
+                try:
+                    latencies[path].append(await timed_get(session, path))
+                except aiohttp.ClientError:
+                    errors += 1
+
+        async def probe():
+            while not done.is_set():
+                health.append(await timed_get(session, "/health"))
+                await asyncio.sleep(0.05)
+
+        prober = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await prober
+
+    print(f"concurrency={concurrency} requests={requests} errors={errors} elapsed={elapsed:.2f}s")
+    for path, values in latencies.items():
+        report(path.split("?")[0].rsplit("/", 1)[-1], values, elapsed)
+    report("health probe", health)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    args = parser.parse_args()
+    paths = [
+        "/api/v1/positions/latest",
+        f"/api/v1/positions/performance?user_id={args.user_id}"
+    ]
+    asyncio.run(run(args.url, args.concurrency, args.requests, paths))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Throughput benchmark for the Redis pub/sub -> WebSocket broadcast path.
+
+Publishes signal events to an in-process Redis stand-in and measures how many
+events per second RealtimeService delivers to fake WebSocket clients, plus the
+publish -> broadcast latency distribution.
+
+    python -m benchmarks.realtime_throughput --events 5000 --clients 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from benchmarks.redis_standin import RedisStandIn
+
+
+class FakeWebSocket:
+    """Records the delivery latency of every frame it receives"""
+
+    def __init__(self, latencies):
+        self.scope = {}
+        self.latencies = latencies
+        self.received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    async def send_text(self, message):
+        self._record(message)
+
+    async def send_bytes(self, message):
+        self._record(message)
+
+    def _record(self, message):
+        payload = json.loads(message)
+        # Stats snapshots go to the same clients, only count signals
+        if payload.get("type") != "signals":
+            return
+        self.latencies.append(time.perf_counter() - payload["data"]["sent_at"])
+        self.received += 1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(events, clients, port):
+    import redis.asyncio as aioredis
+    from loguru import logger
+    from app.database.redis import async_redis_client
+    from app.services.realtime import RealtimeService
+    from app.services.websocket import manager
+
+    # Measure the pipeline, not the terminal
+    logger.remove()
+
+    latencies = []
+    manager.max_connections = max(manager.max_connections, clients)
+    sockets = [FakeWebSocket(latencies) for _ in range(clients)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+
+    service = RealtimeService()
+    listener = asyncio.create_task(service.start_listening())
+    publisher = aioredis.Redis(host="127.0.0.1", port=port)
+    while not await publisher.publish("trades", "{}") and not listener.done():
+        await asyncio.sleep(0.05)
+
+    latencies.clear()
+    for socket in sockets:
+        socket.received = 0
+
+    started = time.perf_counter()
+    for seq in range(events):
+        await publisher.publish("signals", json.dumps({
+            "category": "signals",
+            "action": "create",
+            "data": {"seq": seq, "sent_at": time.perf_counter()}
+        }))
+    deadline = time.perf_counter() + 60
+    while min(socket.received for socket in sockets) < events and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    await service.stop_listening()
+    await publisher.aclose()
+    await manager.close()
+    await async_redis_client.close()
+
+    delivered = min(socket.received for socket in sockets)
+    print(f"events published : {events}")
+    print(f"events delivered : {delivered} per client x {clients} clients")
+    print(f"throughput       : {delivered / elapsed:,.0f} events/s")
+    if latencies:
+        print(f"latency p50      : {statistics.median(latencies) * 1000:.2f} ms")
+        print(f"latency p99      : {percentile(latencies, 99) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=10)
+    args = parser.parse_args()
+
+    port = RedisStandIn().start()
+    os.environ.update({
+        "HOST": "127.0.0.1",
+        "PORT": "8000",
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(port),
+        "REDIS_PASSWORD": "",
+        # The database module names its database at import, nothing here queries MongoDB
+        "MONGO_DB_NAME": os.environ.get("MONGO_DB_NAME", "bench"),
+        # The stand-in speaks pub/sub but not streams
+        "REALTIME_SOURCE": "pubsub"
+    })
+    asyncio.run(run(args.events, args.clients, port))
+
+
+if __name__ == "__main__":
+    main()
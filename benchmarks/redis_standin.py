@@ -0,0 +1,275 @@
+"""
+Minimal in-process Redis stand-in for benchmarks.
+
+Speaks enough RESP2 for the web server's clients: connection setup, pub/sub,
+the hash commands used by RedisClient, HSCAN included, and the set and sorted
+set commands behind the secondary indexes (no Lua, so indexed writes need a
+real Redis). It runs on its own event loop in a background thread so
+synchronous clients can reach it.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from fnmatch import fnmatchcase
+
+
+class SimpleString(str):
+    pass
+
+
+class ReplyError(Exception):
+    pass
+
+
+def encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, SimpleString):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, ReplyError):
+        return b"-ERR " + str(value).encode() + b"\r\n"
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, float):
+        value = repr(value).encode()
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+    raise TypeError(f"Cannot encode {type(value)!r}")
+
+
+OK = SimpleString("OK")
+
+
+class RedisStandIn:
+    def __init__(self):
+        self.hashes = defaultdict(dict)
+        self.sets = defaultdict(set)
+        self.zsets = defaultdict(dict)
+        self.strings = {}
+        self.subscribers = defaultdict(set)
+        self.loop = None
+        self.port = None
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            header = await reader.readline()
+            data = await reader.readexactly(int(header[1:]) + 2)
+            args.append(data[:-2])
+        return args
+
+    async def _handle(self, reader, writer):
+        channels = set()
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name, args = command[0].upper().decode(), command[1:]
+                if name in ("SUBSCRIBE", "UNSUBSCRIBE"):
+                    targets = args or list(channels)
+                    for channel in targets:
+                        if name == "SUBSCRIBE":
+                            channels.add(channel)
+                            self.subscribers[channel].add(writer)
+                        else:
+                            channels.discard(channel)
+                            self.subscribers[channel].discard(writer)
+                        writer.write(encode([name.lower().encode(), channel, len(channels)]))
+                    if not targets:
+                        writer.write(encode([b"unsubscribe", None, 0]))
+                else:
+                    handler = getattr(self, f"cmd_{name.lower()}", None)
+                    try:
+                        reply = handler(*args) if handler else ReplyError(f"unknown command '{name}'")
+                    except ReplyError as e:
+                        reply = e
+                    writer.write(encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers[channel].discard(writer)
+            writer.close()
+
+    # connection
+    def cmd_ping(self, *args):
+        return SimpleString("PONG")
+
+    def cmd_auth(self, *args):
+        return OK
+
+    def cmd_select(self, *args):
+        return OK
+
+    def cmd_client(self, *args):
+        return OK
+
+    # pub/sub
+    def cmd_publish(self, channel, message):
+        frame = encode([b"message", channel, message])
+        receivers = self.subscribers.get(channel, ())
+        for writer in receivers:
+            writer.write(frame)
+        return len(receivers)
+
+    # streams, none are kept, the pub/sub snapshot just finds no recent events
+    def cmd_xrevrange(self, key, *args):
+        return []
+
+    # hashes
+    def cmd_hset(self, key, *pairs):
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in self.hashes[key]
+            self.hashes[key][field] = value
+        return added
+
+    def cmd_hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def cmd_hgetall(self, key):
+        return [item for pair in self.hashes.get(key, {}).items() for item in pair]
+
+    def cmd_hlen(self, key):
+        return len(self.hashes.get(key, {}))
+
+    def cmd_hscan(self, key, cursor, *options):
+        # The cursor is an offset into insertion order, fine while nothing is deleted mid-scan
+        count = 10
+        for option, value in zip(options[::2], options[1::2]):
+            if option.upper() == b"COUNT":
+                count = int(value)
+        items = list(self.hashes.get(key, {}).items())[int(cursor):int(cursor) + count]
+        following = int(cursor) + count
+        return [str(following if following < len(self.hashes.get(key, {})) else 0),
+                [item for pair in items for item in pair]]
+
+    def cmd_hdel(self, key, *fields):
+        return sum(self.hashes.get(key, {}).pop(field, None) is not None for field in fields)
+
+    def cmd_hincrbyfloat(self, key, field, amount):
+        value = float(self.hashes[key].get(field, 0)) + float(amount)
+        self.hashes[key][field] = repr(value).encode()
+        return value
+
+    # keys
+    def _keyspaces(self):
+        return (self.hashes, self.sets, self.zsets, self.strings)
+
+    def cmd_del(self, *keys):
+        return sum(any(space.pop(key, None) is not None for space in self._keyspaces()) for key in keys)
+
+    def cmd_exists(self, *keys):
+        return sum(any(key in space for space in self._keyspaces()) for key in keys)
+
+    def cmd_set(self, key, value, *options):
+        self.strings[key] = value
+        return OK
+
+    def cmd_scan(self, cursor, *options):
+        # Everything in one step, like a keyspace small enough to fit one SCAN reply
+        options = dict(zip((option.upper() for option in options[::2]), options[1::2]))
+        pattern = options.get(b"MATCH", b"*").decode()
+        keys = {key for space in self._keyspaces() for key, value in space.items() if value}
+        return ["0", [key for key in keys if fnmatchcase(key.decode(), pattern)]]
+
+    # sets
+    def cmd_sadd(self, key, *members):
+        added = len(set(members) - self.sets[key])
+        self.sets[key].update(members)
+        return added
+
+    def cmd_smembers(self, key):
+        return list(self.sets.get(key, ()))
+
+    # sorted sets
+    def cmd_zadd(self, key, *args):
+        added = 0
+        for score, member in zip(args[::2], args[1::2]):
+            added += member not in self.zsets[key]
+            self.zsets[key][member] = float(score)
+        return added
+
+    def cmd_zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def _scored(self, entries, withscores):
+        return [item for member, score in entries for item in ((member, score) if withscores else (member,))]
+
+    def _bound(self, value):
+        value = value.decode()
+        if value.startswith("("):
+            return float(value[1:]), True
+        return float(value.replace("+inf", "inf")), False
+
+    def _by_score(self, key, low, high, reverse, options):
+        (low, low_open), (high, high_open) = self._bound(low), self._bound(high)
+        def within(score):
+            return (low < score if low_open else low <= score) and (score < high if high_open else score <= high)
+
+        entries = sorted(((member, score) for member, score in self.zsets.get(key, {}).items() if within(score)),
+                         key=lambda entry: (entry[1], entry[0]), reverse=reverse)
+        upper = [option.upper() for option in options]
+        if b"LIMIT" in upper:
+            offset, count = (int(value) for value in options[upper.index(b"LIMIT") + 1:upper.index(b"LIMIT") + 3])
+            entries = entries[offset:] if count < 0 else entries[offset:offset + count]
+        return self._scored(entries, b"WITHSCORES" in upper)
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        return self._by_score(key, low, high, False, options)
+
+    def cmd_zrevrangebyscore(self, key, high, low, *options):
+        return self._by_score(key, low, high, True, options)
+
+    def cmd_zrevrange(self, key, start, stop, *options):
+        entries = sorted(self.zsets.get(key, {}).items(), key=lambda entry: (entry[1], entry[0]), reverse=True)
+        stop = int(stop)
+        entries = entries[int(start):None if stop == -1 else stop + 1]
+        return self._scored(entries, any(option.upper() == b"WITHSCORES" for option in options))
+
+    def cmd_zinter(self, numkeys, *args):
+        keys, options = args[:int(numkeys)], args[int(numkeys):]
+        upper = [option.upper() for option in options]
+        weights = [1.0] * len(keys)
+        if b"WEIGHTS" in upper:
+            start = upper.index(b"WEIGHTS") + 1
+            weights = [float(weight) for weight in options[start:start + len(keys)]]
+        # Plain sets count as score 1
+        scored = [self.zsets[key] if key in self.zsets else dict.fromkeys(self.sets.get(key, ()), 1.0) for key in keys]
+        members = set.intersection(*(set(scores) for scores in scored))
+        entries = sorted(((member, sum(weight * scores[member] for weight, scores in zip(weights, scored)))
+                          for member in members), key=lambda entry: (entry[1], entry[0]))
+        return self._scored(entries, b"WITHSCORES" in upper)
+
+    def start(self, host="127.0.0.1"):
+        """Start serving in a background thread and return the bound port"""
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            server = self.loop.run_until_complete(asyncio.start_server(self._handle, host, 0))
+            self.port = server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self.port
@@ -0,0 +1,113 @@
+"""
+Startup benchmark: cold import time, time to live and time to ready.
+
+Cold import runs `import app.main` in a fresh interpreter --repeat times and
+reports the median. --top also lists the slowest modules from `-X importtime`.
+Each start then launches uvicorn on a free port and polls /health and /ready
+until they answer 200. Times are measured from process start.
+
+/health needs no database, so time to live should stay well under a second
+even if Redis and MongoDB are down. Time to ready includes connecting to both
+and ensuring indexes, so it needs them reachable. A start that is not ready
+within --timeout is reported as "-".
+
+    python -m benchmarks.startup_time --repeat 5 --top 15
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def answers(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return False
+
+
+def cold_import(env):
+    output = subprocess.run([sys.executable, "-c", IMPORT], env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                            env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in output.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package, indented by nesting depth
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        # Our own modules and whole third party packages, their submodules are already in the package's time
+        if name != "app.main" and (name.startswith("app.") or "." not in name):
+            modules.append((int(cumulative), name))
+    return sorted(modules, reverse=True)[:top]
+
+
+def start(env, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if live is None and answers(f"http://127.0.0.1:{port}/health"):
+                live = time.perf_counter() - started
+            if live is not None and answers(f"http://127.0.0.1:{port}/ready"):
+                ready = time.perf_counter() - started
+                break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return live, ready
+
+
+def seconds(values):
+    values = [value for value in values if value is not None]
+    return f"{statistics.median(values):8.3f}" if values else f"{'-':>8}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for /ready per start")
+    parser.add_argument("--top", type=int, default=0, help="list the slowest top level imports")
+    args = parser.parse_args()
+
+    env = {**os.environ, "HOST": os.environ.get("HOST", "127.0.0.1"), "PORT": os.environ.get("PORT", "8000")}
+    imports = [cold_import(env) for _ in range(args.repeat)]
+    starts = [start(env, args.timeout) for _ in range(args.repeat)]
+
+    print(f"{'':>14} {'median s':>8}")
+    print(f"{'cold import':>14} {seconds(imports)}")
+    print(f"{'time to live':>14} {seconds([live for live, _ in starts])}")
+    print(f"{'time to ready':>14} {seconds([ready for _, ready in starts])}")
+    if args.top:
+        print(f"\n{'ms':>8}  slowest imports")
+        for cumulative, name in slowest_imports(env, args.top):
+            print(f"{cumulative / 1000:8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Memory held by vanished WebSocket clients, with and without the idle sweep.
+
+Connects --clients fake clients, --vanished of them gone without a close:
+their sends never complete, like a peer whose TCP window filled up. Live
+clients send a subscribe every --keepalive seconds, as clients opting into
+WS_IDLE_TIMEOUT do. Signals of --event-size bytes are broadcast at
+--event-rate per second for --duration seconds, and every client also gets
+--personal-every-th event as its own frame, like replies and replays, which
+unlike broadcasts are not shared between connections.
+
+Without the sweep the vanished clients stay connected until the watchdog
+evicts them after --send-timeout, queueing until the slow consumer policy
+drops messages. With it they are reaped after --idle-timeout, and the byte
+caps bound what any of them can hold meanwhile. In production uvicorn's
+protocol pings find them too, those are not part of this benchmark. Memory is
+measured with tracemalloc, so it covers Python objects only, not socket
+buffers.
+
+    python -m benchmarks.websocket_heartbeat --clients 2000 --vanished 0.2
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+
+
+KEEPALIVE = '{"action":"subscribe","channel":"signals"}'
+
+
+class FakeWebSocket:
+    def __init__(self, vanished):
+        self.scope = {}
+        self.vanished = vanished
+        self.received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    async def send_text(self, message):
+        if self.vanished:
+            await asyncio.Event().wait()
+        self.received += 1
+
+    async def send_bytes(self, message):
+        pass
+
+
+async def scenario(args, sweep):
+    from app.services.websocket import ConnectionManager
+    from app.utils.codec import Frame
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    options = {"sweep_interval": args.sweep_interval, "idle_timeout": args.idle_timeout} if sweep else {
+        "sweep_interval": 0, "idle_timeout": 0, "max_queue_bytes": 0, "max_buffered_bytes": 0
+    }
+    manager = ConnectionManager(send_timeout=args.send_timeout, max_connections=args.clients, message_rate=0, **options)
+    manager.start()
+    vanished = int(args.clients * args.vanished)
+    sockets = [FakeWebSocket(i < vanished) for i in range(args.clients)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+    connected = tracemalloc.get_traced_memory()[0]
+
+    padding = "x" * args.event_size
+    started = time.perf_counter()
+    seq = peak = 0
+    keepalive = started
+    while time.perf_counter() - started < args.duration:
+        if time.perf_counter() - keepalive >= args.keepalive:
+            keepalive = time.perf_counter()
+            for websocket in sockets[vanished:]:
+                manager.handle_client_message(websocket, KEEPALIVE)
+        frame = Frame({"type": "signals", "action": "create", "data": {"seq": seq, "padding": padding}})
+        await manager.broadcast(frame, "signals")
+        if args.personal_every and seq % args.personal_every == 0:
+            for websocket in list(manager.active_connections):
+                manager.send_personal_message(websocket, Frame({"type": "ack", "seq": seq, "padding": padding}))
+        seq += 1
+        peak = max(peak, tracemalloc.get_traced_memory()[0])
+        await asyncio.sleep(1 / args.event_rate)
+
+    current = tracemalloc.get_traced_memory()[0]
+    alive = sum(websocket in manager.active_connections for websocket in sockets[:vanished])
+    stats = manager.stats()
+    await manager.close()
+    tracemalloc.stop()
+    return {
+        "events": seq,
+        "connected_mb": (connected - baseline) / 2 ** 20,
+        "peak_mb": (peak - baseline) / 2 ** 20,
+        "end_mb": (current - baseline) / 2 ** 20,
+        "vanished_left": alive,
+        "vanished": vanished,
+        "queued_mb": stats["queued_bytes"] / 2 ** 20,
+        "peak_queued_mb": stats["peak_queued_bytes"] / 2 ** 20,
+        "reaped": stats["reaped"],
+        "evicted": stats["evicted"],
+        "dropped": stats["dropped"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--vanished", type=float, default=0.2, help="fraction of clients that are gone")
+    parser.add_argument("--event-size", type=int, default=2000, help="padding bytes per event")
+    parser.add_argument("--event-rate", type=float, default=50.0)
+    parser.add_argument("--personal-every", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--sweep-interval", type=float, default=1.0)
+    parser.add_argument("--keepalive", type=float, default=1.0, help="seconds between messages from live clients")
+    parser.add_argument("--idle-timeout", type=float, default=3.0)
+    parser.add_argument("--send-timeout", type=float, default=60.0, help="how long a dead peer's send takes to fail")
+    args = parser.parse_args()
+
+    os.environ.setdefault("HOST", "127.0.0.1")
+    os.environ.setdefault("PORT", "8000")
+    from loguru import logger
+
+    # Measure the manager, not the terminal
+    logger.remove()
+    print(f"clients={args.clients} vanished={int(args.clients * args.vanished)} events/s={args.event_rate} "
+          f"duration={args.duration}s\n")
+    print(f"{'sweep':>10} {'events':>7} {'connect MB':>11} {'peak MB':>8} {'end MB':>7} {'queued MB':>10} "
+          f"{'peak queued':>12} {'vanished left':>14} {'reaped':>7} {'evicted':>8} {'dropped':>9}")
+    for sweep in (False, True):
+        result = asyncio.run(scenario(args, sweep))
+        print(f"{'on' if sweep else 'off':>10} {result['events']:>7} {result['connected_mb']:>11.1f} "
+              f"{result['peak_mb']:>8.1f} {result['end_mb']:>7.1f} {result['queued_mb']:>10.1f} "
+              f"{result['peak_queued_mb']:>12.1f} {result['vanished_left']:>7}/{result['vanished']:<6} "
+              f"{result['reaped']:>7} {result['evicted']:>8} {result['dropped']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Scaling benchmark for running the server with several worker processes.
+
+Starts N worker processes. Each one runs its own RealtimeService and
+ConnectionManager and gets an equal share of fake WebSocket clients, the way
+`uvicorn --workers N` spreads real connections. The benchmark publishes
+signal events to Redis and reports aggregate deliveries per second and
+publish -> client latency for each worker and client count. For each worker
+count it also reports the largest client count whose p99 stays under
+--budget. It checks that exactly one worker held the stats leader lock.
+
+Needs a real Redis. The in-process stand-in is single threaded and would be
+the bottleneck.
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 --clients 1000 5000 10000 --events 500
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import time
+
+# Every SAMPLE_EVERY-th client decodes its frames to record latency, the rest only count
+SAMPLE_EVERY = 50
+
+
+class CountingWebSocket:
+    def __init__(self, latencies=None):
+        self.scope = {}
+        self.latencies = latencies
+        self.received = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    async def send_text(self, message):
+        # Stats and connect snapshots go to the same clients, only count signals
+        if not message.startswith('{"type":"signals"'):
+            return
+        self.received += 1
+        if self.latencies is not None:
+            self.latencies.append(time.time() - json.loads(message)["data"]["sent_at"])
+
+    async def send_bytes(self, message):
+        pass
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def serve(clients, events, results):
+    from loguru import logger
+    from app.services.realtime import RealtimeService
+    from app.services.websocket import manager
+
+    logger.remove()
+    # Every client of this worker's share must fit
+    manager.max_connections = max(manager.max_connections, clients)
+    latencies = []
+    sockets = [CountingWebSocket(latencies if i % SAMPLE_EVERY == 0 else None) for i in range(clients)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+
+    service = RealtimeService()
+    listener = asyncio.create_task(service.start_listening())
+    # Ready once the reader knows where in the event stream to start
+    while service.last_event_id is None:
+        await asyncio.sleep(0.01)
+    results.put("ready")
+    deadline = time.time() + 120
+    while min(websocket.received for websocket in sockets) < events and time.time() < deadline:
+        await asyncio.sleep(0.01)
+    finished = time.time()
+    leader = service.leader
+
+    await service.stop_listening()
+    await listener
+    results.put({
+        "finished": finished,
+        "delivered": sum(websocket.received for websocket in sockets),
+        "latencies": latencies,
+        "leader": leader
+    })
+
+
+def worker(env, clients, events, results):
+    os.environ.update(env)
+    from loguru import logger
+    # Keep the publisher's per-event log lines out of the table
+    logger.remove()
+    asyncio.run(serve(clients, events, results))
+
+
+def run(env, workers, clients, events):
+    from app.database.redis import redis_client
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    share = [clients // workers + (1 if i < clients % workers else 0) for i in range(workers)]
+    processes = [context.Process(target=worker, args=(env, share[i], events, results)) for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    for _ in processes:
+        results.get(timeout=60)
+    # Let the stats election settle before timing
+    time.sleep(1)
+
+    started = time.time()
+    for seq in range(events):
+        # The same stream append and publish the producers use
+        redis_client._publish_event("signals", "create", {"seq": seq, "sent_at": time.time()})
+    reports = [results.get(timeout=180) for _ in processes]
+    for process in processes:
+        process.join()
+
+    elapsed = max(report["finished"] for report in reports) - started
+    latencies = [latency for report in reports for latency in report["latencies"]]
+    return {
+        "delivered": sum(report["delivered"] for report in reports),
+        "expected": events * clients,
+        "rate": sum(report["delivered"] for report in reports) / elapsed,
+        "p50": statistics.median(latencies) if latencies else None,
+        "p99": percentile(latencies, 99) if latencies else None,
+        "leaders": sum(report["leader"] for report in reports)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-host", default="127.0.0.1")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-password", default="")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--budget", type=float, default=100.0, help="p99 latency budget in ms")
+    args = parser.parse_args()
+
+    env = {
+        "HOST": "127.0.0.1",
+        "PORT": "8000",
+        "REDIS_HOST": args.redis_host,
+        "REDIS_PORT": str(args.redis_port),
+        "REDIS_PASSWORD": args.redis_password,
+        # Room for every event, so the benchmark measures fan-out rather than the slow consumer policy
+        "WS_QUEUE_SIZE": str(args.events + 100)
+    }
+    os.environ.update(env)
+    capacity = {}
+    print(f"{'workers':>7} {'clients':>8} {'delivered':>12} {'deliveries/s':>14} {'p50 ms':>8} {'p99 ms':>8} {'leaders':>7}")
+    for workers in args.workers:
+        capacity[workers] = 0
+        for clients in args.clients:
+            result = run(env, workers, clients, args.events)
+            p50 = f"{result['p50'] * 1000:8.1f}" if result["p50"] is not None else f"{'-':>8}"
+            p99 = f"{result['p99'] * 1000:8.1f}" if result["p99"] is not None else f"{'-':>8}"
+            print(f"{workers:>7} {clients:>8} {result['delivered']:>12,} {result['rate']:>14,.0f} {p50} {p99} "
+                  f"{result['leaders']:>7}")
+            complete = result["delivered"] == result["expected"]
+            if complete and result["p99"] is not None and result["p99"] * 1000 <= args.budget:
+                capacity[workers] = max(capacity[workers], clients)
+
+    print(f"\nclients held under a p99 of {args.budget:.0f} ms")
+    for workers, clients in capacity.items():
+        print(f"{workers:>7} workers: {clients:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os
+
+# app.config reads these at import, the tests never start the server
+os.environ.setdefault("HOST", "127.0.0.1")
+os.environ.setdefault("PORT", "8000")
+os.environ.setdefault("MONGO_DB_NAME", "alphaedge_test")
+os.environ.setdefault("REDIS_PORT", "6379")
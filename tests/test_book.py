@@ -0,0 +1,29 @@
+"""PositionBook against positions with values that aren't numbers"""
+from app.services.book import PositionBook
+from app.services.stats import PositionStats
+
+
+def test_bad_values_are_skipped_per_field():
+    book = PositionBook()
+    book.load({
+        "1": {"user_id": "u1", "symbol": "NIFTY", "quantity": 50, "current_price": 100, "unrealized_pnl": 10.5},
+        "2": {"user_id": "u1", "symbol": "NIFTY", "quantity": "n/a", "current_price": 100, "unrealized_pnl": "nan"},
+        "3": ["not", "a", "position"]
+    })
+
+    assert len(book) == 2
+    assert book.summary() == {"positions": 2, "unrealized_pnl": 10.5, "exposure": 5000.0}
+
+
+def test_bad_value_keeps_the_previous_one():
+    book = PositionBook()
+    book.upsert("1", {"quantity": 50, "current_price": 100, "unrealized_pnl": 10.5})
+    book.upsert("1", {"unrealized_pnl": "n/a"})
+    assert book.total_pnl() == 10.5
+
+
+def test_stats_load_survives_a_bad_position():
+    stats = PositionStats(PositionBook())
+    stats.load({"1": {"unrealized_pnl": "n/a"}, "2": {"unrealized_pnl": 3.25}})
+    assert stats.book.total_pnl() == 3.25
+    assert not stats.needs_resync
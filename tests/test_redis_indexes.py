@@ -0,0 +1,101 @@
+"""Indexed writes of RedisClient and AsyncRedisClient, on fakeredis with Lua through lupa"""
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+from app.database.redis import WRITE_INDEXED, AsyncRedisClient, RedisClient
+
+ORDER = {
+    "user_id": "user-1",
+    "symbol": "NIFTY",
+    "status": "open",
+    "timestamp": "2024-03-04T09:15:00",
+    # 17 significant digits, and an integer beyond 2^53
+    "price": 24501.123456789012,
+    "broker_order_id": 123456789012345678,
+    "fills": [],
+    "tags": {}
+}
+
+
+@pytest.fixture
+def client():
+    client = RedisClient("alphaedge", "localhost", 6379, None)
+    client.client = fakeredis.FakeRedis()
+    client._write_indexed = client.client.register_script(WRITE_INDEXED)
+    return client
+
+
+@pytest.fixture
+def async_client():
+    client = AsyncRedisClient("alphaedge", "localhost", 6379, None)
+    client.client = fakeredis.FakeAsyncRedis()
+    client._write_indexed = client.client.register_script(WRITE_INDEXED)
+    return client
+
+
+def members(client, key):
+    return {member.decode() for member in client.client.smembers(key)}
+
+
+def test_set_keeps_the_document_exact(client):
+    client.set_hash("orders", "order-1", ORDER)
+
+    stored = json.loads(client.client.hget("orders", "order-1"))
+    assert stored == ORDER
+    assert stored["price"] == 24501.123456789012
+    assert stored["broker_order_id"] == 123456789012345678
+    assert stored["fills"] == [] and stored["tags"] == {}
+    assert [identifier for identifier, _ in client.query_ids("orders", {"status": "open"})] == ["order-1"]
+
+
+def test_update_leaves_the_document_and_its_indexes_alone(client):
+    client.set_hash("orders", "order-1", ORDER)
+    client.update_hash("orders", "order-1", {"status": "filled"})
+
+    assert client.get_hash("orders", "order-1") == ORDER
+    assert client.client.hgetall("orders:order-1") == {b"status": b"filled"}
+    assert members(client, "idx:orders:status:open") == {"order-1"}
+    assert members(client, "idx:orders:status:filled") == set()
+
+
+def test_set_and_delete_move_index_members(client):
+    client.set_hash("orders", "order-1", ORDER)
+    client.set_hash("orders", "order-1", {**ORDER, "symbol": "BANKNIFTY", "user_id": None})
+    assert members(client, "idx:orders:symbol:NIFTY") == set()
+    assert members(client, "idx:orders:symbol:BANKNIFTY") == {"order-1"}
+    assert members(client, "idx:orders:user_id:user-1") == set()
+
+    client.delete_hash("orders", "order-1")
+    assert client.client.hget("orders", "order-1") is None
+    assert members(client, "idx:orders:symbol:BANKNIFTY") == set()
+    assert client.client.zcard("idx:orders:time") == 0
+
+
+def test_async_set_query_and_delete(async_client):
+    async def run():
+        await async_client.set_hash("orders", "order-1", ORDER)
+        await async_client.update_hash("orders", "order-1", {"status": "filled"})
+        stored = json.loads(await async_client.client.hget("orders", "order-1"))
+        open_orders = await async_client.query_ids("orders", {"status": "open"})
+        await async_client.delete_hash("orders", "order-1")
+        remaining = await async_client.client.smembers("idx:orders:status:open")
+        return stored, open_orders, remaining
+
+    stored, open_orders, remaining = asyncio.run(run())
+    assert stored == ORDER
+    assert [identifier for identifier, _ in open_orders] == ["order-1"]
+    assert remaining == set()
+
+
+def test_indexes_not_built_once_a_write_goes_around_them(client):
+    client.client.hset("orders", "order-1", json.dumps(ORDER))
+    assert not client.indexes_built("orders")
+
+    client.rebuild_indexes("orders")
+    assert client.indexes_built("orders")
+
+    client.client.hset("orders", "order-2", json.dumps(ORDER))
+    assert not client.indexes_built("orders")
@@ -0,0 +1,121 @@
+"""
+/performance from rollups against the raw pipeline, on a real MongoDB.
+
+mongomock implements neither $merge nor $round, so these run against the
+server in MONGO_TEST_URI, in a scratch database that is dropped afterwards,
+and are skipped without one. No replica set is needed, the tests call
+refresh_bucket themselves instead of going through the change stream.
+
+    MONGO_TEST_URI=mongodb://localhost:27017 python -m pytest tests
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from app.database.mongodb import AsyncDatabase
+from app.services import rollups
+
+USER = "user-1"
+OTHER = "user-2"
+
+TRADES = [
+    (USER, datetime(2024, 3, 4, 9, 15), 120.5),
+    (USER, datetime(2024, 3, 4, 9, 59, 59, 999000), -40.25),
+    # on an hour boundary
+    (USER, datetime(2024, 3, 4, 10, 0), 75.0),
+    (USER, datetime(2024, 3, 4, 23, 30), -10.0),
+    # on a day boundary
+    (USER, datetime(2024, 3, 5, 0, 0), 33.333),
+    # zero counts as a loss
+    (USER, datetime(2024, 3, 5, 14, 20), 0),
+    (USER, datetime(2024, 3, 6, 8, 5), -99.99),
+    (USER, datetime(2024, 3, 7, 16, 45), 250.0),
+    (OTHER, datetime(2024, 3, 4, 10, 30), 500.0),
+    (OTHER, datetime(2024, 3, 5, 11, 0), -300.0)
+]
+
+RANGES = [
+    # whole days, served from daily buckets
+    (datetime(2024, 3, 4), datetime(2024, 3, 8)),
+    # raw slivers at both ends, hourly and daily buckets in between
+    (datetime(2024, 3, 4, 9, 30), datetime(2024, 3, 6, 8, 5)),
+    # starting and ending on bucket boundaries
+    (datetime(2024, 3, 4, 10, 0), datetime(2024, 3, 5, 0, 0)),
+    # within one hour
+    (datetime(2024, 3, 4, 9, 0), datetime(2024, 3, 4, 9, 59, 59, 999000)),
+    # no trades
+    (datetime(2024, 3, 1), datetime(2024, 3, 2))
+]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    uri = os.getenv("MONGO_TEST_URI")
+    if not uri:
+        pytest.skip("MONGO_TEST_URI is not set")
+    client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB at MONGO_TEST_URI is unreachable: {str(e)}")
+    database = client[f"rollups_test_{uuid.uuid4().hex[:8]}"]
+    database.closed_positions.insert_many([
+        {"user_id": user_id, "timestamp": timestamp, "unrealized_pnl": pnl} for user_id, timestamp, pnl in TRADES
+    ])
+    async_database = AsyncDatabase(database)
+    monkeypatch.setattr(rollups, "db", database)
+    monkeypatch.setattr(rollups, "async_db", async_database)
+    monkeypatch.setattr(rollups, "PERFORMANCE_ROLLUPS", True)
+    # Read built_at on every call
+    monkeypatch.setattr(rollups, "rollup_watcher", rollups.RollupWatcher(state_ttl=0))
+    yield database
+    async_database.close()
+    client.drop_database(database.name)
+    client.close()
+
+
+def build(database):
+    rollups.rebuild()
+    database[rollups.ROLLUP_STATE].update_one({"_id": "closed_positions"},
+                                              {"$set": {"built_at": datetime.utcnow()}}, upsert=True)
+
+
+def pipeline(database, from_date, to_date):
+    result = list(database.closed_positions.aggregate(rollups.performance_pipeline(USER, from_date, to_date)))
+    return result[0] if result else dict(rollups.EMPTY_PERFORMANCE)
+
+
+@pytest.mark.parametrize("from_date, to_date", RANGES)
+def test_rollups_match_pipeline(database, from_date, to_date):
+    build(database)
+    actual = asyncio.run(rollups.get_performance(USER, from_date, to_date))
+    assert rollups.compare(pipeline(database, from_date, to_date), actual) == {}
+
+
+def test_refresh_after_update(database):
+    build(database)
+    # A closed position on an hour and day boundary turns from a win into the biggest loss
+    timestamp = datetime(2024, 3, 5, 0, 0)
+    database.closed_positions.update_one({"user_id": USER, "timestamp": timestamp},
+                                         {"$set": {"unrealized_pnl": -150.75}})
+    rollups.refresh_bucket(USER, timestamp)
+    for from_date, to_date in RANGES:
+        actual = asyncio.run(rollups.get_performance(USER, from_date, to_date))
+        assert rollups.compare(pipeline(database, from_date, to_date), actual) == {}
+        _, _, mismatches = rollups.verify(USER, from_date, to_date)
+        assert mismatches == {}
+
+
+def test_raw_pipeline_until_built(database):
+    # Stale buckets are ignored while built_at is missing
+    rollups.rebuild()
+    database.closed_positions.delete_many({"user_id": USER, "unrealized_pnl": {"$gt": 0}})
+    from_date, to_date = RANGES[0]
+    actual = asyncio.run(rollups.get_performance(USER, from_date, to_date))
+    assert actual == pipeline(database, from_date, to_date)
+    assert actual["winning_trades"] == 0
@@ -0,0 +1,75 @@
+"""Live messages held back while a resume replays missed events"""
+import asyncio
+
+from app.services.websocket import COALESCE, DISCONNECT, DROP_OLDEST, ConnectionManager
+from app.utils.codec import Frame
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.scope = {}
+        self.sent = []
+        self.closed = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def send_bytes(self, message):
+        self.sent.append(message)
+
+
+def flood_during_replay(policy, events=100, key=None):
+    """Broadcast events while a replay is held open, the connection and its manager once the replay ends"""
+    async def run():
+        manager = ConnectionManager(queue_size=5, policy=policy, max_queue_bytes=0, max_buffered_bytes=0,
+                                    message_rate=0, sweep_interval=0, send_timeout=0)
+        released = asyncio.Event()
+
+        async def history(last_event_id):
+            await released.wait()
+            return [], True
+
+        manager.history = history
+        websocket = FakeWebSocket()
+        await manager.connect(websocket)
+        connection = manager.active_connections[websocket]
+        manager.handle_client_message(websocket, '{"action": "resume", "last_event_id": "1-0"}')
+        held = []
+        for seq in range(events):
+            await manager.broadcast(Frame({"type": "signals", "data": {"seq": seq}}), "signals", key=key)
+            if connection.pending is not None:
+                held.append(len(connection.pending))
+        released.set()
+        await asyncio.sleep(0.05)
+        await manager.close()
+        return connection, held, websocket
+
+    return asyncio.run(run())
+
+
+def test_pending_is_capped_by_the_queue_size():
+    connection, held, websocket = flood_during_replay(DROP_OLDEST)
+    assert max(held) == 5
+    assert connection.dropped == 95
+    assert connection.queued_bytes == 0
+    # The resumed marker first, then the newest events that fit
+    assert '"resumed"' in websocket.sent[-6]
+    assert ['"seq":%d' % seq in message for seq, message in zip(range(95, 100), websocket.sent[-5:])] == [True] * 5
+
+
+def test_pending_coalesces_by_key():
+    connection, held, _ = flood_during_replay(COALESCE, key="signals")
+    assert max(held) == 5
+    assert connection.coalesced == 95
+
+
+def test_pending_overflow_disconnects_under_disconnect_policy():
+    _, held, websocket = flood_during_replay(DISCONNECT)
+    assert max(held) == 5
+    assert websocket.closed == 1013